@@ -0,0 +1,30 @@
+"""Add rate_limit_buckets table
+
+Revision ID: b5e81f4c2d67
+Revises: 3c7d2a9e51f0
+Create Date: 2026-10-19 ...
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e81f4c2d67'
+down_revision = '3c7d2a9e51f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('rate_limit_buckets',
+    sa.Column('bucket_key', sa.String(), nullable=False),
+    sa.Column('tokens', sa.Float(), nullable=False),
+    sa.Column('updated_at', sa.Float(), nullable=False),
+    sa.Column('allowed', sa.Boolean(), nullable=False),
+    sa.PrimaryKeyConstraint('bucket_key')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('rate_limit_buckets')
@@ -0,0 +1,38 @@
+"""Add catalog_changes table for the incremental catalog feed
+
+Revision ID: d2a4f6b8c013
+Revises: b5e81f4c2d67
+Create Date: 2026-10-19 ...
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a4f6b8c013'
+down_revision = 'b5e81f4c2d67'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('catalog_changes',
+    sa.Column('seq', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('app_id', sa.Integer(), nullable=False),
+    sa.Column('op', sa.String(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['app_id'], ['apps.id'], ),
+    sa.PrimaryKeyConstraint('seq')
+    )
+    op.create_index(op.f('ix_catalog_changes_app_id'), 'catalog_changes', ['app_id'], unique=False)
+    # 既存の公開アプリを変更履歴に登録しておく (カーソル0から同期したランチャーが全件を受け取れるように)
+    op.execute(
+        "INSERT INTO catalog_changes (app_id, op, created_at) "
+        "SELECT id, 'upsert', CURRENT_TIMESTAMP FROM apps WHERE status = 'public' ORDER BY id"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_catalog_changes_app_id'), table_name='catalog_changes')
+    op.drop_table('catalog_changes')
@@ -0,0 +1,28 @@
+"""Add package digest columns and owner/name index to apps
+
+Revision ID: e7c19a3b5d24
+Revises: d2a4f6b8c013
+Create Date: 2026-10-19 ...
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7c19a3b5d24'
+down_revision = 'd2a4f6b8c013'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('apps', sa.Column('package_sha256', sa.String(), nullable=True))
+    op.add_column('apps', sa.Column('package_size', sa.Integer(), nullable=True))
+    op.create_index('ix_apps_owner_id_name', 'apps', ['owner_id', 'name'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_apps_owner_id_name', table_name='apps')
+    op.drop_column('apps', 'package_size')
+    op.drop_column('apps', 'package_sha256')
@@ -0,0 +1,117 @@
+"""
+ランチャーのアイコンの読み込み (launcher/icon_cache.py) にかかる時間を計測するベンチマーク。
+ローカルのHTTPサーバー (応答ごとに --latency-ms だけ待つ) が配信するWebPのアイコンを --icons 個読み込む。
+
+    cold    ディスクのキャッシュが空の状態で、サーバーから取得する (同時に読み込む数を1と ICON_CONCURRENCY で比べる)
+    disk    ディスクのキャッシュから読み込む (サーバーには問い合わせない)
+    memory  一覧の data() がアイコンを返すのにかかる時間 (メインスレッドで行うのはこれだけ)
+
+使い方 (リポジトリのルートで実行):
+    python -m benchmarks.bench_icon_cache
+    python -m benchmarks.bench_icon_cache --icons 400 --latency-ms 50
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "launcher"))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtCore import QBuffer, QByteArray  # noqa: E402
+from PySide6.QtGui import QColor, QImage  # noqa: E402
+from PySide6.QtWidgets import QApplication  # noqa: E402
+
+from http_client import create_session  # noqa: E402
+from icon_cache import ICON_CONCURRENCY, IconDiskCache, IconLoader  # noqa: E402
+from request_scheduler import RequestScheduler  # noqa: E402
+
+
+def make_icon(size: int) -> bytes:
+    image = QImage(size, size, QImage.Format_ARGB32)
+    image.fill(QColor("steelblue"))
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QBuffer.WriteOnly)
+    image.save(buffer, "WEBP")
+    return bytes(data)
+
+
+def start_server(body: bytes, latency: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # ヘッダーと本文をまとめて送る (別々に送ると、keep-alive の接続で遅延ACKの待ちが入る)
+        wbufsize = 64 * 1024
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def load_all(app, loader: IconLoader, urls) -> float:
+    """すべてのアイコンを読み込み終えるまでの秒数"""
+    ready = set()
+    loader.icon_ready.connect(ready.add)
+    start = time.perf_counter()
+    loader.prefetch(urls)
+    while len(ready) < len(urls):
+        app.processEvents()
+        time.sleep(0.001)
+        if loader._failed:
+            raise RuntimeError(f"failed to load icons: {list(loader._failed)[:3]}")
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="アイコンのキャッシュの読み込み時間を計測する")
+    parser.add_argument("--icons", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=30)
+    args = parser.parse_args()
+
+    app = QApplication([])
+    server = start_server(make_icon(64), args.latency_ms / 1000)
+    base = f"http://127.0.0.1:{server.server_port}"
+    urls = [f"{base}/icons/{hashlib.sha256(str(i).encode()).hexdigest()}/128.webp" for i in range(args.icons)]
+    scheduler = RequestScheduler()
+    session = create_session()
+
+    with tempfile.TemporaryDirectory(prefix="catbox-icons-") as work_dir:
+        for concurrency in (1, ICON_CONCURRENCY):
+            cache_dir = os.path.join(work_dir, f"cold-{concurrency}")
+            loader = IconLoader(scheduler, session, IconDiskCache(cache_dir), concurrency=concurrency)
+            elapsed = load_all(app, loader, urls)
+            print(f"cold   concurrency {concurrency}: {elapsed * 1000:>8.1f} ms  ({elapsed / len(urls) * 1000:.2f} ms/icon)")
+
+        loader = IconLoader(scheduler, session, IconDiskCache(cache_dir))
+        elapsed = load_all(app, loader, urls)
+        print(f"disk   concurrency {ICON_CONCURRENCY}: {elapsed * 1000:>8.1f} ms  ({elapsed / len(urls) * 1000:.2f} ms/icon)")
+
+        iterations = 100_000
+        start = time.perf_counter()
+        for i in range(iterations):
+            loader.pixmap(urls[i % len(urls)])
+        elapsed = time.perf_counter() - start
+        print(f"memory hit (GUI thread): {elapsed / iterations * 1e6:.2f} us/icon")
+
+    scheduler.shutdown()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+計測 (metrics.py) のオーバーヘッドを計測するマイクロベンチマーク。
+ヒストグラムへの記録1回、アップロード段階の計測1回、
+InstrumentationMiddleware を通した1リクエストあたりのコストを表示する。
+
+使い方 (リポジトリのルートで実行):
+    python -m benchmarks.bench_metrics --iterations 200000
+"""
+import argparse
+import asyncio
+import time
+
+from server import metrics
+
+
+async def _dummy_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _null_send(message):
+    return None
+
+
+def _scope():
+    return {"type": "http", "method": "GET", "path": "/", "headers": [(b"host", b"localhost")], "client": ("127.0.0.1", 1)}
+
+
+def _report(label: str, per_call: float, baseline: float = None):
+    overhead = f"  (overhead {per_call - baseline:>6.3f} us)" if baseline is not None else ""
+    print(f"{label:<40} {per_call:>8.3f} us/op{overhead}")
+
+
+def bench_histogram(iterations: int):
+    histogram = metrics.Histogram("bench_seconds", "bench", ("route",))
+    start = time.perf_counter()
+    for _ in range(iterations):
+        histogram.observe(0.004, "/")
+    _report("Histogram.observe", (time.perf_counter() - start) / iterations * 1_000_000)
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with metrics.upload_stage("bench"):
+            pass
+    _report("upload_stage (with block)", (time.perf_counter() - start) / iterations * 1_000_000)
+
+
+async def bench_middleware(iterations: int):
+    scope = _scope()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await _dummy_app(scope, None, _null_send)
+    baseline = (time.perf_counter() - start) / iterations * 1_000_000
+    _report("no middleware", baseline)
+
+    middleware = metrics.InstrumentationMiddleware(_dummy_app)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await middleware(scope, None, _null_send)
+    _report("InstrumentationMiddleware", (time.perf_counter() - start) / iterations * 1_000_000, baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="計測のオーバーヘッドを計測する")
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+    bench_histogram(args.iterations)
+    asyncio.run(bench_middleware(args.iterations))
+
+
+if __name__ == "__main__":
+    main()
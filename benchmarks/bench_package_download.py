@@ -0,0 +1,120 @@
+"""
+パッケージ配信のスループットを計測するベンチマーク。
+Starlette の FileResponse と PackageResponse (読み込み送信 / ゼロコピー送信) を
+ASGIアプリとして直接呼び出し、送られたデータを /dev/null に書き出す。
+
+ゼロコピー送信は、ASGIの zerocopysend 拡張を受け取ったサーバーと同じように
+os.sendfile で /dev/null に送ることで再現する (Linuxのみ)。
+/dev/null への sendfile はカーネル内でほぼ何もしないため、この値はPython側のオーバーヘッドの目安であり、
+実際のソケットへの送信速度ではない。
+
+使い方 (リポジトリのルートで実行):
+    python -m benchmarks.bench_package_download --size-mb 64 --repeat 5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from starlette.responses import FileResponse
+
+from server.packages import PackageResponse
+
+DIGEST = "0" * 64
+
+
+class NullSink:
+    """ASGIのsendを受け取り、本文を /dev/null に書き出す"""
+
+    def __init__(self):
+        self.fd = os.open(os.devnull, os.O_WRONLY)
+        self.sent = 0
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.body":
+            body = message.get("body", b"")
+            if body:
+                os.write(self.fd, body)
+                self.sent += len(body)
+        elif message["type"] == "http.response.zerocopysend":
+            offset, count = message["offset"], message["count"]
+            while count > 0:
+                written = os.sendfile(self.fd, message["file"].fileno(), offset, count)
+                if written == 0:
+                    break
+                offset += written
+                count -= written
+                self.sent += written
+
+    def close(self):
+        os.close(self.fd)
+
+
+async def _receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+def _scope(headers=None, zerocopy=False):
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/packages/bench.zip",
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in (headers or {}).items()],
+        "extensions": {"http.response.zerocopysend": {}} if zerocopy else {},
+    }
+    return scope
+
+
+async def _bench(label: str, make_response, scope, expected: int, repeat: int):
+    best = None
+    for _ in range(repeat):
+        sink = NullSink()
+        start = time.perf_counter()
+        await make_response()(scope, _receive, sink)
+        elapsed = time.perf_counter() - start
+        sink.close()
+        if sink.sent != expected:
+            raise RuntimeError(f"{label}: sent {sink.sent} bytes, expected {expected}")
+        best = elapsed if best is None else min(best, elapsed)
+    throughput = expected / best / 1024 / 1024
+    print(f"{label:<45} {best * 1000:>9.2f} ms  {throughput:>9.1f} MB/s")
+
+
+async def main_async(size_mb: int, repeat: int):
+    size = size_mb * 1024 * 1024
+    with tempfile.NamedTemporaryFile(suffix=".zip", delete=False) as f:
+        path = f.name
+        block = os.urandom(1024 * 1024)
+        for _ in range(size_mb):
+            f.write(block)
+
+    try:
+        half = {"Range": f"bytes={size // 2}-"}
+        print(f"file size: {size_mb} MB, best of {repeat}")
+        await _bench("FileResponse (full)", lambda: FileResponse(path), _scope(), size, repeat)
+        await _bench("PackageResponse read (full)", lambda: PackageResponse(path, DIGEST), _scope(), size, repeat)
+        if sys.platform.startswith("linux"):
+            await _bench("PackageResponse zerocopysend (full)",
+                         lambda: PackageResponse(path, DIGEST), _scope(zerocopy=True), size, repeat)
+        await _bench("FileResponse (range, second half)", lambda: FileResponse(path), _scope(half), size - size // 2, repeat)
+        await _bench("PackageResponse read (range, second half)",
+                     lambda: PackageResponse(path, DIGEST), _scope(half), size - size // 2, repeat)
+        if sys.platform.startswith("linux"):
+            await _bench("PackageResponse zerocopysend (range)",
+                         lambda: PackageResponse(path, DIGEST), _scope(half, zerocopy=True), size - size // 2, repeat)
+    finally:
+        os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="パッケージ配信のスループットを計測する")
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main_async(args.size_mb, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+bcryptのコスト設定ごとに、1コアあたり何回ログイン (パスワード検証) できるかを計測するベンチマーク。
+
+使い方 (リポジトリのルートで実行):
+    python -m benchmarks.bench_password_hash --rounds 10 11 12 13 --workers 4
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from passlib.context import CryptContext
+
+PASSWORD = "correct horse battery staple"
+
+
+def _verify_many(rounds: int, hashed: str, count: int) -> int:
+    """(ワーカープロセス側) 指定回数だけパスワード検証を行う"""
+    context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+    for _ in range(count):
+        context.verify(PASSWORD, hashed)
+    return count
+
+
+def bench_rounds(rounds: int, workers: int, logins_per_worker: int) -> dict:
+    """1つのコスト設定について、単一プロセスとプロセスプールでの検証速度を計測する"""
+    context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+    hashed = context.hash(PASSWORD)
+
+    # 1コアでの計測
+    start = time.perf_counter()
+    _verify_many(rounds, hashed, logins_per_worker)
+    single_elapsed = time.perf_counter() - start
+
+    # プロセスプールでの計測 (本番のハッシュプールと同じ構成)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # プロセスの起動コストを計測に含めないよう、先に1回ずつ実行しておく
+        list(pool.map(_verify_many, [rounds] * workers, [hashed] * workers, [1] * workers))
+        start = time.perf_counter()
+        total = sum(pool.map(_verify_many, [rounds] * workers, [hashed] * workers, [logins_per_worker] * workers))
+        pool_elapsed = time.perf_counter() - start
+
+    return {
+        "rounds": rounds,
+        "ms_per_login": single_elapsed / logins_per_worker * 1000,
+        "logins_per_sec_per_core": logins_per_worker / single_elapsed,
+        "logins_per_sec_pool": total / pool_elapsed,
+        "workers": workers,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bcryptコスト別のログイン処理性能を計測する")
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 11, 12, 13])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--logins", type=int, default=10, help="1ワーカーあたりの検証回数")
+    args = parser.parse_args()
+
+    print(f"{'rounds':>6} {'ms/login':>10} {'login/s/core':>13} {'login/s (pool x' + str(args.workers) + ')':>22}")
+    for rounds in args.rounds:
+        result = bench_rounds(rounds, args.workers, args.logins)
+        print(
+            f"{result['rounds']:>6} {result['ms_per_login']:>10.1f} "
+            f"{result['logins_per_sec_per_core']:>13.1f} {result['logins_per_sec_pool']:>22.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
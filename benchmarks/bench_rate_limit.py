@@ -0,0 +1,52 @@
+"""
+レート制限ミドルウェアの1リクエストあたりのオーバーヘッドを計測するマイクロベンチマーク。
+ダミーのASGIアプリを包み、ミドルウェアなしの場合との差を表示する。
+
+使い方 (リポジトリのルートで実行):
+    python -m benchmarks.bench_rate_limit --iterations 200000
+"""
+import argparse
+import asyncio
+import time
+
+from server.ratelimit import RateLimitMiddleware, RateLimitPolicy, MemoryBackend
+
+POLICIES = {
+    ("POST", "/api/v1/token"): RateLimitPolicy("token", rate=1e9, burst=1000000, key="ip"),
+}
+
+
+async def _dummy_app(scope, receive, send):
+    return None
+
+
+def _scope(method: str, path: str, client_ip: str = "127.0.0.1"):
+    return {"type": "http", "method": method, "path": path, "headers": [], "client": (client_ip, 12345)}
+
+
+async def _bench(label: str, app, scope, iterations: int, baseline: float = None) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await app(scope, None, None)
+    per_request = (time.perf_counter() - start) / iterations * 1_000_000
+    overhead = f"  (overhead {per_request - baseline:>6.3f} us)" if baseline is not None else ""
+    print(f"{label:<40} {per_request:>8.3f} us/req{overhead}")
+    return per_request
+
+
+async def main_async(iterations: int):
+    middleware = RateLimitMiddleware(_dummy_app, POLICIES, backend=MemoryBackend())
+    baseline = await _bench("no middleware", _dummy_app, _scope("GET", "/"), iterations)
+    await _bench("unlimited route (pass through)", middleware, _scope("GET", "/"), iterations, baseline)
+    await _bench("limited route (bucket check)", middleware, _scope("POST", "/api/v1/token"), iterations, baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="レート制限ミドルウェアのオーバーヘッドを計測する")
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+    asyncio.run(main_async(args.iterations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+サンプリングプロファイラーのミドルウェアが、プロファイルしていないときにどれだけコストがかかるかを計測する。
+比較のため、全リクエストを対象にプロファイル中の場合 (サンプリングスレッドが動いている状態) も表示する。
+
+使い方 (リポジトリのルートで実行):
+    python -m benchmarks.bench_sampling_profiler --iterations 200000
+"""
+import argparse
+import asyncio
+import time
+
+from server.sampling_profiler import SamplingProfiler, SamplingProfilerMiddleware
+
+
+async def _dummy_app(scope, receive, send):
+    return None
+
+
+async def _bench(label: str, app, scope, iterations: int, baseline: float = None) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await app(scope, None, None)
+    per_request = (time.perf_counter() - start) / iterations * 1_000_000
+    overhead = f"  (overhead {per_request - baseline:>6.3f} us)" if baseline is not None else ""
+    print(f"{label:<40} {per_request:>8.3f} us/req{overhead}")
+    return per_request
+
+
+async def main_async(iterations: int):
+    scope = {"type": "http", "method": "GET", "path": "/mypage", "headers": []}
+    profiler = SamplingProfiler()
+    middleware = SamplingProfilerMiddleware(_dummy_app, profiler)
+
+    baseline = await _bench("no middleware", _dummy_app, scope, iterations)
+    await _bench("profiler off", middleware, scope, iterations, baseline)
+
+    profiler.start(duration=60, sample_rate=1.0)
+    try:
+        await _bench("profiler on (all requests)", middleware, scope, iterations, baseline)
+    finally:
+        profiler.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="サンプリングプロファイラーのオーバーヘッドを計測する")
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+    asyncio.run(main_async(args.iterations))
+
+
+if __name__ == "__main__":
+    main()
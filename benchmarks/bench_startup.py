@@ -0,0 +1,133 @@
+"""
+サーバーのコールドスタート時間を計測するベンチマーク。
+新しいPythonプロセスで「server.main のインポート → lifespan の起動 → 最初のリクエスト」までを
+何度か繰り返し、中央値が目標時間 (--target-ms) 以内かを確認する (オートスケール時の起動速度の目安)。
+
+--importtime を付けると、python -X importtime の結果から、インポートに時間がかかっている
+モジュールの一覧 (累積時間・自身の時間の上位) も表示する。
+
+使い方 (リポジトリのルートで実行):
+    python -m benchmarks.bench_startup --runs 5 --target-ms 1500
+    python -m benchmarks.bench_startup --importtime --top 20
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 子プロセスで実行するスクリプト。各段階の経過時間をJSONで出力する
+_CHILD_SCRIPT = r"""
+import time
+t0 = time.perf_counter()
+import asyncio, json
+import server.main as main
+from server import database, models
+t1 = time.perf_counter()
+models.Base.metadata.create_all(bind=database.engine)
+t2 = time.perf_counter()
+
+async def run():
+    import httpx
+    async with main.app.router.lifespan_context(main.app):
+        t3 = time.perf_counter()
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.get("/api/v1/apps/")
+            assert response.status_code == 200, response.status_code
+        t4 = time.perf_counter()
+    return t3, t4
+
+t3, t4 = asyncio.run(run())
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "startup_ms": (t3 - t2) * 1000,
+    "first_request_ms": (t4 - t3) * 1000,
+    "total_ms": (t4 - t0 - (t2 - t1)) * 1000,
+}))
+"""
+
+
+def _child_env(database_url: str) -> dict:
+    env = dict(os.environ)
+    env["DATABASE_URL"] = database_url
+    env.setdefault("LOG_LEVEL", "WARNING")
+    env["PYTHONPATH"] = ROOT_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def measure_startup(runs: int, database_url: str):
+    results = []
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, "-W", "ignore", "-c", _CHILD_SCRIPT],
+            cwd=ROOT_DIR, env=_child_env(database_url), capture_output=True, text=True, check=True,
+        )
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return results
+
+
+def importtime_report(database_url: str, top: int):
+    """python -X importtime の結果を集計して表示する"""
+    completed = subprocess.run(
+        [sys.executable, "-W", "ignore", "-X", "importtime", "-c", "import server.main"],
+        cwd=ROOT_DIR, env=_child_env(database_url), capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        # 形式: "import time:  自身[us] |  累積[us] | モジュール名"
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+
+    print(f"\nimport time: top {top} by cumulative time")
+    for name, self_us, cumulative_us in sorted(rows, key=lambda row: row[2], reverse=True)[:top]:
+        print(f"  {cumulative_us / 1000:>9.1f} ms  (self {self_us / 1000:>7.1f} ms)  {name}")
+
+    print(f"\nimport time: top {top} by self time")
+    for name, self_us, cumulative_us in sorted(rows, key=lambda row: row[1], reverse=True)[:top]:
+        print(f"  {self_us / 1000:>9.1f} ms  {name}")
+
+    server_rows = [row for row in rows if row[0].startswith("server.")]
+    print("\nimport time: server modules (cumulative)")
+    for name, self_us, cumulative_us in sorted(server_rows, key=lambda row: row[2], reverse=True):
+        print(f"  {cumulative_us / 1000:>9.1f} ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="サーバーのコールドスタート時間を計測する")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--target-ms", type=float, default=1500.0, help="起動〜最初のリクエストまでの目標時間 (中央値)")
+    parser.add_argument("--database-url", help="省略時は一時ファイルのSQLite")
+    parser.add_argument("--importtime", action="store_true", help="インポート時間の内訳も表示する")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="catbox-startup-") as temp_dir:
+        database_url = args.database_url or f"sqlite:///{os.path.join(temp_dir, 'bench.db')}"
+        results = measure_startup(args.runs, database_url)
+
+        print(f"{'run':>4} {'import':>10} {'lifespan':>10} {'1st req':>10} {'total':>10}")
+        for i, result in enumerate(results, 1):
+            print(
+                f"{i:>4} {result['import_ms']:>8.1f}ms {result['startup_ms']:>8.1f}ms"
+                f" {result['first_request_ms']:>8.1f}ms {result['total_ms']:>8.1f}ms"
+            )
+        median_total = statistics.median(result["total_ms"] for result in results)
+        verdict = "OK" if median_total <= args.target_ms else "OVER TARGET"
+        print(f"median total: {median_total:.1f} ms (target {args.target_ms:.0f} ms) {verdict}")
+
+        if args.importtime:
+            importtime_report(database_url, args.top)
+
+    if median_total > args.target_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+アクセストークン検証 (1リクエストあたりの認証オーバーヘッド) を計測するマイクロベンチマーク。
+キャッシュなしの jwt.decode と、キャッシュ付きの security.verify_token を比較する。
+
+使い方 (リポジトリのルートで実行):
+    python -m benchmarks.bench_token_verify --iterations 100000
+"""
+import argparse
+import time
+
+from jose import jwt
+
+from server import security
+
+
+def _bench(label: str, func, iterations: int):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed / iterations * 1_000_000:>8.2f} us/req")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="アクセストークン検証のオーバーヘッドを計測する")
+    parser.add_argument("--iterations", type=int, default=100000)
+    args = parser.parse_args()
+
+    token = security.create_access_token(data={"sub": "bench@example.com", "sid": 1})
+    key = security.SIGNING_KEYS[security.ACTIVE_KID]
+
+    # 変更前と同じ処理: 毎回署名検証とJSONデコードを行う
+    _bench("jwt.decode (no cache)", lambda: jwt.decode(token, key, algorithms=[security.ALGORITHM]), args.iterations)
+
+    # キャッシュなしの verify_token (kidによる鍵の選択 + 失効チェックを含む)
+    def _verify_uncached():
+        security.claims_cache.clear()
+        security.verify_token(token)
+    _bench("verify_token (cache miss)", _verify_uncached, args.iterations)
+
+    # キャッシュありの verify_token (同じトークンが繰り返し届く通常のケース)
+    security.claims_cache.clear()
+    security.verify_token(token)
+    _bench("verify_token (cache hit)", lambda: security.verify_token(token), args.iterations)
+
+
+if __name__ == "__main__":
+    main()
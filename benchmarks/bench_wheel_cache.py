@@ -0,0 +1,96 @@
+"""
+ランチャーの wheel キャッシュ (launcher/wheel_cache.py) の効果を計測するベンチマーク。
+同じ requirements.txt を、毎回新しく作った仮想環境にインストールし、次の時間を比べる
+(仮想環境の作成時間は含めない)。
+
+    pip (no cache)  キャッシュを使わない pip install -r (pip 自身のキャッシュも無効)
+    cold cache      空の wheel キャッシュでのインストール (wheel の作成とキャッシュへの保存を含む)
+    warm cache      キャッシュ済みの wheel だけでのインストール (--no-index、ネットワークを使わない)
+
+使い方 (リポジトリのルートで実行、cold の計測にはネットワークが必要):
+    python -m benchmarks.bench_wheel_cache
+    python -m benchmarks.bench_wheel_cache --requirements path/to/requirements.txt --runs 3
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "launcher"))
+
+from env_pool import env_python  # noqa: E402
+from wheel_cache import PIP_INSTALL, WheelCache  # noqa: E402
+
+DEFAULT_REQUIREMENTS = "requests==2.32.3\nPyYAML==6.0.2\n"
+
+
+def run_process(args, check: bool = True) -> int:
+    completed = subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if check and completed.returncode != 0:
+        raise RuntimeError(f"command failed ({completed.returncode}): {' '.join(args)}\n{completed.stderr}")
+    return completed.returncode
+
+
+def fresh_env(work_dir: str, name: str) -> str:
+    env_dir = os.path.join(work_dir, name)
+    run_process([sys.executable, "-m", "venv", env_dir])
+    return env_dir
+
+
+def measure(label: str, runs: int, work_dir: str, install) -> list:
+    timings = []
+    for i in range(runs):
+        env_dir = fresh_env(work_dir, f"{label.replace(' ', '-')}-{i}")
+        start = time.perf_counter()
+        install(env_dir)
+        timings.append(time.perf_counter() - start)
+    print(f"{label:<16} median {statistics.median(timings):>7.2f} s  (runs: {', '.join(f'{t:.2f}' for t in timings)})")
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="wheel キャッシュを使ったインストール時間を計測する")
+    parser.add_argument("--requirements", help="requirements.txt のパス (省略時は requests と PyYAML)")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    # pip 自身のHTTPキャッシュ・wheelキャッシュの影響を除く
+    os.environ["PIP_NO_CACHE_DIR"] = "1"
+
+    with tempfile.TemporaryDirectory(prefix="catbox-wheels-") as work_dir:
+        requirements_path = args.requirements
+        if requirements_path is None:
+            requirements_path = os.path.join(work_dir, "requirements.txt")
+            with open(requirements_path, "w", encoding="utf-8") as f:
+                f.write(DEFAULT_REQUIREMENTS)
+
+        def install_without_cache(env_dir):
+            run_process([env_python(env_dir), *PIP_INSTALL, "-r", requirements_path])
+
+        def install_cold(env_dir):
+            # 毎回空のキャッシュから始める
+            cache = WheelCache(tempfile.mkdtemp(prefix="cold-", dir=work_dir))
+            assert cache.install(run_process, env_python(env_dir), env_dir, requirements_path) is False
+
+        warm_cache = WheelCache(os.path.join(work_dir, "warm-cache"))
+        prime_env = fresh_env(work_dir, "prime")
+        warm_cache.install(run_process, env_python(prime_env), prime_env, requirements_path)
+
+        def install_warm(env_dir):
+            assert warm_cache.install(run_process, env_python(env_dir), env_dir, requirements_path) is True
+
+        baseline = measure("pip (no cache)", args.runs, work_dir, install_without_cache)
+        cold = measure("cold cache", args.runs, work_dir, install_cold)
+        warm = measure("warm cache", args.runs, work_dir, install_warm)
+
+        print(f"\ncache size: {warm_cache.size() / 1024 / 1024:.1f} MB")
+        print(f"warm vs pip: {statistics.median(baseline) / statistics.median(warm):.1f}x faster")
+        print(f"cold overhead vs pip: {statistics.median(cold) - statistics.median(baseline):+.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+アプリの起動時間を、zygote (launcher/zygote.py) を使う場合と使わない場合で比べるベンチマーク (Linuxのみ)。
+起動を要求してから、アプリのスクリプトが重いモジュールのimportを終えて最初の1行を出力するまでの時間を計測する。
+
+    popen   これまでどおり subprocess.Popen で新しいPythonを起動する
+    zygote  モジュールをimport済みの zygote から fork して起動する (zygote の起動とimportは計測に含めない)
+
+アプリの代わりに、--modules のモジュールをimportしてから出力するだけのスクリプトを使い、
+Python は仮想環境の代わりにこのベンチマークを実行しているPythonを使う。
+
+使い方 (リポジトリのルートで実行):
+    python -m benchmarks.bench_zygote_launch
+    python -m benchmarks.bench_zygote_launch --modules PySide6.QtWidgets,PySide6.QtGui --runs 10
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "launcher"))
+
+from zygote import ZygotePool  # noqa: E402
+
+_APP_SCRIPT = """
+import sys
+{imports}
+print("started", sys.argv[1], flush=True)
+"""
+
+
+def wait_started(read_fd: int):
+    """アプリが1行出力するまで待つ"""
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = os.read(read_fd, 4096)
+        if not chunk:
+            raise RuntimeError(f"app exited before printing: {data!r}")
+        data += chunk
+    return data
+
+
+def measure(label: str, runs: int, launch) -> list:
+    timings = []
+    for i in range(runs):
+        read_fd, write_fd = os.pipe()
+        try:
+            start = time.perf_counter()
+            process = launch(write_fd, i)
+            os.close(write_fd)
+            write_fd = None
+            wait_started(read_fd)
+            timings.append(time.perf_counter() - start)
+            if isinstance(process, subprocess.Popen):
+                process.wait()
+        finally:
+            os.close(read_fd)
+            if write_fd is not None:
+                os.close(write_fd)
+    print(f"{label:<8} median {statistics.median(timings) * 1000:>8.1f} ms  "
+          f"(min {min(timings) * 1000:.1f}, max {max(timings) * 1000:.1f})")
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="zygote を使ったアプリの起動時間を計測する")
+    parser.add_argument("--modules", default="PySide6.QtWidgets", help="アプリがimportするモジュール (カンマ区切り)")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    if not sys.platform.startswith("linux"):
+        parser.error("zygote は Linux でのみ使えます。")
+
+    modules = [name.strip() for name in args.modules.split(",") if name.strip()]
+    with tempfile.TemporaryDirectory(prefix="catbox-zygote-") as work_dir:
+        script = os.path.join(work_dir, "run.py")
+        with open(script, "w", encoding="utf-8") as f:
+            f.write(_APP_SCRIPT.format(imports="\n".join(f"import {name}" for name in modules)))
+
+        def launch_popen(stdout_fd, i):
+            return subprocess.Popen([sys.executable, script, f"app-{i}"], stdout=stdout_fd, cwd=work_dir)
+
+        pool = ZygotePool(enabled=True)
+        prewarm_start = time.perf_counter()
+        pool.launch(sys.executable, modules, [script, "warmup"], cwd=work_dir, stdio=[0, 1, 2])
+        print(f"zygote warm-up (start + preload + first launch): {(time.perf_counter() - prewarm_start) * 1000:.1f} ms")
+
+        def launch_zygote(stdout_fd, i):
+            return pool.launch(sys.executable, modules, [script, f"app-{i}"], cwd=work_dir, stdio=[0, stdout_fd, 2])
+
+        try:
+            baseline = measure("popen", args.runs, launch_popen)
+            zygote = measure("zygote", args.runs, launch_zygote)
+        finally:
+            pool.shutdown()
+        print(f"\nzygote vs popen: {statistics.median(baseline) / statistics.median(zygote):.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,70 @@
+import json
 import requests
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional
+
+from http_client import create_session
 
 # サーバーの公開URL。将来的には設定ファイルなどから読み込むのが望ましい。
 # あなたのRender.comのAPIのURLに書き換えてください。
 # 例: "https://cat-box-api.onrender.com"
 BASE_URL = "http://127.0.0.1:8000"
 
+# イベント受信の読み取りタイムアウト(秒)。サーバーは15秒ごとにハートビートを送るので、
+# これより長く何も届かなければ接続が切れたとみなす。
+EVENT_READ_TIMEOUT = 45
+
+# 更新確認 (versions:batchGet) で1回に問い合わせるアプリ数の上限 (サーバーの VERSION_BATCH_MAX_ITEMS と同じ)
+VERSION_BATCH_MAX_ITEMS = 500
+
 class ApiClient:
     """
     Cat-box APIと通信するためのクライアントクラス。
     """
 
-    def __init__(self, base_url: str = BASE_URL):
+    def __init__(self, base_url: str = BASE_URL, session: Optional[requests.Session] = None):
         """
         ApiClientのインスタンスを初期化します。
         
         :param base_url: APIのベースURL
+        :param session: 通信に使うセッション (省略時は http_client.create_session で作る)。
+                        接続を使い回すため、すべてのリクエストはこのセッションで送る
         """
         self.base_url = base_url
-        self.session = requests.Session() # セッションを使って効率的に通信する
+        self.session = session or create_session()
+        # 最後に同期したカタログのカーソル (差分同期の開始位置)
+        self.catalog_cursor = 0
+        # 最後に取得したアプリ一覧のETag (条件付きリクエスト用)
+        self.catalog_etag = None
 
-    def get_app_list(self) -> List[Dict[str, Any]]:
+    def get_app_list(self, after_id: int = 0, limit: int = 100,
+                     if_none_match: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
         """
-        サーバーからアプリケーションのリストを取得します。
+        サーバーからアプリケーションのリストをID順に取得します。
 
-        :return: アプリケーション情報の辞書のリスト
+        :param after_id: このIDより後のアプリから取得する (続きのページは、前のページの最後のID)
+        :param limit: 1ページの件数
+        :param if_none_match: 前回取得した一覧のETag。一覧が変わっていなければ本文を受け取らない
+        :return: アプリケーション情報の辞書のリスト。if_none_match の一覧から変わっていない場合はNone
         :raises requests.exceptions.RequestException: 通信に失敗した場合
         """
         try:
-            # APIエンドポイントの完全なURLを構築
-            url = f"{self.base_url}/api/v1/apps"
+            # APIエンドポイントの完全なURLを構築 (末尾の / がないとリダイレクトが1回増える)
+            url = f"{self.base_url}/api/v1/apps/"
+            headers = {"If-None-Match": if_none_match} if if_none_match else {}
             
             # GETリクエストを送信
-            response = self.session.get(url, timeout=60) # 10秒でタイムアウト
-            
-            # ステータスコードが200番台でない場合はエラーを発生させる
-            response.raise_for_status()
+            params = {"after_id": after_id, "limit": limit}
+            response = self.session.get(url, params=params, headers=headers, timeout=60) # 10秒でタイムアウト
+
+            # ステータスコードが200番台でない場合はエラーを発生させる (304 は一覧に変更がないことを表す)
+            if response.status_code != 304:
+                response.raise_for_status()
+
+            # 次回の差分同期の開始位置を覚えておく
+            self.catalog_cursor = int(response.headers.get("X-Catalog-Cursor", 0))
+            if response.status_code == 304:
+                return None
+            self.catalog_etag = response.headers.get("ETag")
             
             # レスポンスのJSONボディをPythonの辞書リストに変換して返す
             return response.json()
@@ -46,6 +75,85 @@ class ApiClient:
             # エラーを呼び出し元に再度投げる
             raise
 
+    def get_app_changes(self, since: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        前回の同期以降に変更されたアプリだけを取得します。
+        レスポンスの cursor は自動で保持するので、続けて呼ぶと次の差分を取得できます。
+
+        :param since: 差分の開始カーソル (省略時は前回の同期位置)
+        :return: {"cursor", "has_more", "upserts", "deletes"} の辞書。
+                 カーソルが古すぎて差分を取得できない場合はNone (get_app_list で全件を取得し直すこと)
+        :raises requests.exceptions.RequestException: 通信に失敗した場合
+        """
+        url = f"{self.base_url}/api/v1/apps/changes"
+        params = {"since": self.catalog_cursor if since is None else since}
+        try:
+            response = self.session.get(url, params=params, timeout=60)
+            if response.status_code == 410:
+                return None
+            response.raise_for_status()
+            changes = response.json()
+            self.catalog_cursor = changes["cursor"]
+            return changes
+        except requests.exceptions.RequestException as e:
+            print(f"APIへのリクエストに失敗しました: {e}")
+            raise
+
+    def check_updates(self, installed: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        インストール済みアプリの更新をまとめて確認します (1回のリクエストで済みます)。
+
+        :param installed: {"id": アプリID, "version": インストール済みのバージョン} のリスト
+        :return: 新しいバージョンがあるアプリの情報のリスト。
+                 各要素の installed_id が、問い合わせたアプリIDに対応します。
+        :raises requests.exceptions.RequestException: 通信に失敗した場合
+        """
+        url = f"{self.base_url}/api/v1/apps/versions:batchGet"
+        updates = []
+        try:
+            # サーバー側の上限ごとに分けて問い合わせる
+            for start in range(0, len(installed), VERSION_BATCH_MAX_ITEMS):
+                chunk = installed[start:start + VERSION_BATCH_MAX_ITEMS]
+                payload = {"apps": [{"id": item["id"], "version": item["version"]} for item in chunk]}
+                response = self.session.post(url, json=payload, timeout=60)
+                response.raise_for_status()
+                updates.extend(response.json()["updates"])
+            return updates
+        except requests.exceptions.RequestException as e:
+            print(f"APIへのリクエストに失敗しました: {e}")
+            raise
+
+    def open_catalog_events(self) -> requests.Response:
+        """
+        カタログ変更イベント (Server-Sent Events) の接続を開きます。
+        受信は read_catalog_events で行い、終わったら response.close() で閉じてください。
+        (別スレッドから close() すると、受信待ちを中断できます)
+        """
+        url = f"{self.base_url}/api/v1/events/catalog"
+        response = self.session.get(
+            url, stream=True, headers={"Accept": "text/event-stream"}, timeout=(10, EVENT_READ_TIMEOUT)
+        )
+        response.raise_for_status()
+        return response
+
+    @staticmethod
+    def read_catalog_events(response: requests.Response) -> Iterator[Dict[str, Any]]:
+        """
+        SSEのストリームを読み、イベント (dict) を1つずつ返します。
+        ハートビート (コメント行) は読み飛ばします。接続が切れると例外が発生します。
+        """
+        data_lines = []
+        for line in response.iter_lines(decode_unicode=True):
+            if line is None:
+                continue
+            if line == "":
+                # 空行でイベントが区切られる
+                if data_lines:
+                    yield json.loads("\n".join(data_lines))
+                    data_lines = []
+            elif line.startswith("data:"):
+                data_lines.append(line[len("data:"):].lstrip())
+
     def create_user(self, username, email, password):
         """
         新しいユーザーを登録する
@@ -58,7 +166,7 @@ class ApiClient:
             "password": password
         }
         try:
-            response = requests.post(url, json=payload, timeout=10)
+            response = self.session.post(url, json=payload, timeout=10)
             
             # ステータスコードに応じたハンドリング
             if response.status_code == 200:
@@ -0,0 +1,206 @@
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, Optional
+import sys
+
+from PySide6.QtCore import QAbstractListModel, QModelIndex, QSortFilterProxyModel, Qt
+
+# --- アプリ一覧のモデル ---
+# アプリが数万件になっても一覧が重くならないよう、QListWidgetItem ではなく QAbstractListModel で表示する。
+# 行ごとに持つのは (ID, 名前, バージョン, アイコンのURL) だけで、説明やダウンロードURLなどは、
+# アプリが選択されたときに catalog_cache から読み込む。
+#
+# 行はID順に並べ、キャッシュ (catalog_cache.py) から FETCH_PAGE_SIZE 件ずつ読み込む。
+# ビューが一覧の最後までスクロールすると canFetchMore / fetchMore で次のページを読み込むので、
+# 見ていない部分のアプリは読み込まない。絞り込みは AppFilterProxyModel で、読み込み済みの行に対して行う。
+# アイコンは IconLoader (icon_cache.py) のメモリのキャッシュにあるものだけを返し、data() の中では読み込まない。
+FETCH_PAGE_SIZE = 200
+
+# data() で使うロール
+AppIdRole = Qt.UserRole
+AppVersionRole = Qt.UserRole + 1
+# data() は行ごと・ロールごとに呼ばれるので、列挙型の属性を毎回引かないようにしておく
+_DISPLAY_ROLE = Qt.DisplayRole
+_TOOLTIP_ROLE = Qt.ToolTipRole
+_DECORATION_ROLE = Qt.DecorationRole
+
+
+class AppListModel(QAbstractListModel):
+    """
+    アプリ一覧のモデル。キャッシュから必要な分だけを読み込む。
+
+    :param catalog_cache: 行を読み込む CatalogCache
+    :param icon_loader: アイコンを表示する場合は IconLoader
+    :param page_size: fetchMore で1回に読み込む件数
+    """
+
+    def __init__(self, catalog_cache, icon_loader=None, page_size: int = FETCH_PAGE_SIZE, parent=None):
+        super().__init__(parent)
+        self.catalog_cache = catalog_cache
+        self.icon_loader = icon_loader
+        self.page_size = page_size
+        # 行の情報は、行ごとのオブジェクトではなく列ごとの配列で持つ (1行あたりのメモリを減らすため)
+        self._ids = array('q')
+        self._names = []
+        self._versions = []
+        self._icon_urls = []
+        # このIDまでキャッシュから読み込んだ (次のページはこのIDより後から)
+        self._loaded_until = 0
+        # キャッシュを最後まで読み込んだか
+        self._exhausted = False
+
+    # --- QAbstractListModel ---
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._ids)
+
+    def data(self, index, role=_DISPLAY_ROLE):
+        row = index.row()
+        # 無効なインデックスの行は -1
+        if not 0 <= row < len(self._ids):
+            return None
+        if role == _DISPLAY_ROLE:
+            return self._names[row]
+        if role == _DECORATION_ROLE:
+            if self.icon_loader is None:
+                return None
+            url = self._icon_urls[row]
+            return self.icon_loader.pixmap(url) if url else self.icon_loader.placeholder
+        if role == AppIdRole:
+            return self._ids[row]
+        if role == AppVersionRole:
+            return self._versions[row]
+        if role == _TOOLTIP_ROLE:
+            return f"{self._names[row]} v{self._versions[row]}"
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        """キャッシュから次のページを読み込んで、一覧の最後に追加する"""
+        if parent.isValid() or self._exhausted:
+            return
+        rows = self.catalog_cache.load_rows(after_id=self._loaded_until, limit=self.page_size)
+        if len(rows) < self.page_size:
+            self._exhausted = True
+        if not rows:
+            return
+        first = len(self._ids)
+        self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+        for app_id, name, version, icon_url in rows:
+            self._append(app_id, name, version, icon_url)
+        self._loaded_until = rows[-1][0]
+        self.endInsertRows()
+
+    # --- 一覧の更新 ---
+    def app_id(self, row: int) -> int:
+        return self._ids[row]
+
+    def name(self, row: int) -> str:
+        return self._names[row]
+
+    def icon_url(self, row: int) -> Optional[str]:
+        return self._icon_urls[row]
+
+    def row_for_id(self, app_id: int) -> Optional[int]:
+        """アプリIDの行番号 (読み込んでいなければNone)"""
+        row = bisect_left(self._ids, app_id)
+        if row < len(self._ids) and self._ids[row] == app_id:
+            return row
+        return None
+
+    def upsert(self, app_data: Dict[str, Any]) -> bool:
+        """
+        アプリを追加・更新する。まだ読み込んでいない範囲のアプリは、スクロールしたときに読み込まれる。
+        :return: 表示中の行が変わった場合はTrue
+        """
+        app_id, name, version = app_data["id"], app_data.get("name", ""), app_data.get("version", "")
+        icon_url = app_data.get("icon_url")
+        if app_id > self._loaded_until:
+            self._exhausted = False
+            return False
+        row = bisect_left(self._ids, app_id)
+        if row < len(self._ids) and self._ids[row] == app_id:
+            if self._names[row] == name and self._versions[row] == version and self._icon_urls[row] == icon_url:
+                return False
+            self._names[row] = name
+            self._versions[row] = sys.intern(version)
+            self._icon_urls[row] = icon_url
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+            return True
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._ids.insert(row, app_id)
+        self._names.insert(row, name)
+        self._versions.insert(row, sys.intern(version))
+        self._icon_urls.insert(row, icon_url)
+        self.endInsertRows()
+        return True
+
+    def remove(self, app_id: int) -> bool:
+        """アプリを削除する。:return: 表示中の行を削除した場合はTrue"""
+        row = self.row_for_id(app_id)
+        if row is None:
+            return False
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self._ids[row]
+        del self._names[row]
+        del self._versions[row]
+        del self._icon_urls[row]
+        self.endRemoveRows()
+        return True
+
+    def reload_range(self, after_id: int, last_id: Optional[int]) -> int:
+        """
+        キャッシュの (after_id, last_id] の範囲が置き換えられたときに、読み込み済みの行をキャッシュに合わせる。
+        last_id がNoneなら after_id より後すべて。
+        :return: 変わった行の数
+        """
+        # 読み込んでいない範囲は、スクロールしたときに新しい内容で読み込まれる
+        if last_id is None or last_id > self._loaded_until:
+            self._exhausted = False
+        if after_id >= self._loaded_until:
+            return 0
+        until_id = self._loaded_until if last_id is None else min(last_id, self._loaded_until)
+        rows = self.catalog_cache.load_rows(after_id=after_id, until_id=until_id)
+        fresh_ids = {row[0] for row in rows}
+        first, last = bisect_left(self._ids, after_id + 1), bisect_left(self._ids, until_id + 1)
+        stale_ids = [app_id for app_id in self._ids[first:last] if app_id not in fresh_ids]
+        changed = sum(1 for app_id in stale_ids if self.remove(app_id))
+        changed += sum(
+            1 for app_id, name, version, icon_url in rows
+            if self.upsert({"id": app_id, "name": name, "version": version, "icon_url": icon_url})
+        )
+        return changed
+
+    def _append(self, app_id: int, name: str, version: str, icon_url: Optional[str]):
+        self._ids.append(app_id)
+        self._names.append(name)
+        # バージョン文字列は "1.0" のように重複が多いので、同じ文字列を共有する
+        self._versions.append(sys.intern(version))
+        self._icon_urls.append(icon_url)
+
+
+class AppFilterProxyModel(QSortFilterProxyModel):
+    """
+    アプリ名で一覧を絞り込むモデル (大文字・小文字を区別しない部分一致)。
+    標準の絞り込みは行ごとに data() を呼ぶので、AppListModel の名前を直接比べて呼び出し回数を減らす。
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._source: Optional[AppListModel] = None
+        self._needle = ""
+
+    def setSourceModel(self, model):
+        self._source = model
+        super().setSourceModel(model)
+
+    def set_filter_text(self, text: str):
+        needle = text.strip().casefold()
+        if needle != self._needle:
+            self._needle = needle
+            self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        return not self._needle or self._needle in self._source.name(source_row).casefold()
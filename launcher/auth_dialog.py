@@ -12,12 +12,13 @@ class AuthDialog(QDialog):
     # 認証成功シグナル（将来のログイン機能のために用意）
     # authenticated = Signal(str) # トークンを渡す想定
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, api_client=None):
         super().__init__(parent)
         self.setWindowTitle("アカウント")
         self.setModal(True) # 他のウィンドウを操作できなくする
 
-        self.api_client = ApiClient()
+        # メインウィンドウと同じクライアントを使うと、サーバーへの接続を使い回せる
+        self.api_client = api_client or ApiClient()
 
         # --- UI要素の作成 ---
         # ユーザー名入力
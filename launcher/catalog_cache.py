@@ -0,0 +1,208 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# --- アプリ一覧のローカルキャッシュ ---
+# 前回サーバーから取得したアプリ一覧を SQLite (APPDATA/Cat-box/catalog.sqlite3) に保存しておき、
+# ランチャーの起動直後はここから一覧を表示する (サーバーの応答を待たない)。
+# その後バックグラウンドで、保存しておいたカーソルからの差分 (/api/v1/apps/changes) か、
+# ETag付きの条件付きリクエスト (/api/v1/apps/) でサーバーと同期し、変わった分だけを反映する。
+#
+# 一覧の取得スレッドと、変更通知の受信スレッドの両方から書き込むので、書き込みは操作ごとに接続を開き、ロックで1つずつ行う。
+# 読み込みはスレッドごとに開いたままの接続で行い、ロックは取らない (WALモードなので、書き込み中のトランザクションを待たずに、
+# コミット済みの内容を読める)。画面の一覧 (app_list_model.py) は、メインスレッドからID順に少しずつ (load_rows) 読み込む。
+CATALOG_CACHE_PATH = os.path.join(os.getenv('APPDATA', os.path.expanduser('~')), 'Cat-box', 'catalog.sqlite3')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS apps (
+    id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class CatalogCache:
+    """
+    アプリ一覧のキャッシュ。
+
+    :param path: SQLiteファイルのパス
+    """
+
+    def __init__(self, path: str = CATALOG_CACHE_PATH):
+        self.path = path
+        # 書き込み用のロック
+        self._lock = threading.Lock()
+        self._initialized = False
+        # スレッドごとの読み込み用の接続
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        """(書き込み用。self._lock を持った状態で呼ぶ)"""
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=10)
+        if not self._initialized:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+            self._initialized = True
+        return connection
+
+    def _reader(self) -> sqlite3.Connection:
+        """このスレッドの読み込み用の接続 (初めて使うときに開き、以降は使い回す)"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            if not self._initialized:
+                # ファイルとテーブルを作っておく
+                with self._lock:
+                    self._connect().close()
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA query_only=ON")
+            self._local.connection = connection
+        return connection
+
+    def load_rows(self, after_id: int = 0, until_id: Optional[int] = None,
+                  limit: Optional[int] = None) -> List[Tuple[int, str, str, Optional[str]]]:
+        """
+        一覧の表示に使う (ID, 名前, バージョン, アイコンのURL) だけを、ID順に返す。
+        :param after_id: このIDより後から
+        :param until_id: このIDまで (Noneなら最後まで)
+        :param limit: 件数の上限
+        """
+        sql = "SELECT id, data FROM apps WHERE id > ?"
+        params: list = [after_id]
+        if until_id is not None:
+            sql += " AND id <= ?"
+            params.append(until_id)
+        sql += " ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        try:
+            rows = self._reader().execute(sql, params).fetchall()
+        except sqlite3.DatabaseError:
+            return []
+        result = []
+        for app_id, data in rows:
+            app = json.loads(data)
+            result.append((app_id, app.get("name", ""), app.get("version", ""), app.get("icon_url")))
+        return result
+
+    def get(self, app_id: int) -> Optional[Dict[str, Any]]:
+        """アプリ1件の情報を返す (なければNone)"""
+        try:
+            row = self._reader().execute("SELECT data FROM apps WHERE id = ?", (app_id,)).fetchone()
+        except sqlite3.DatabaseError:
+            return None
+        return json.loads(row[0]) if row else None
+
+    def find_app_ids(self, installed: List[Tuple[str, str]]) -> Dict[Tuple[str, str], int]:
+        """
+        (名前, バージョン) に一致するアプリのIDを探す。一覧全体を読むので、メインスレッドからは呼ばないこと。
+        :return: {(名前, バージョン): アプリID} (キャッシュにないものは含まない)
+        """
+        wanted = set(installed)
+        found = {}
+        try:
+            rows = self._reader().execute("SELECT id, data FROM apps ORDER BY id").fetchall()
+        except sqlite3.DatabaseError:
+            return found
+        for app_id, data in rows:
+            app = json.loads(data)
+            key = (app.get("name", ""), app.get("version", ""))
+            if key in wanted:
+                found.setdefault(key, app_id)
+        return found
+
+    def get_meta(self, key: str) -> Optional[str]:
+        try:
+            row = self._reader().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        except sqlite3.DatabaseError:
+            return None
+        return row[0] if row else None
+
+    @property
+    def cursor(self) -> int:
+        """最後に同期したカタログのカーソル (差分同期の開始位置)。キャッシュがなければ0"""
+        return int(self.get_meta("cursor") or 0)
+
+    @property
+    def etag(self) -> Optional[str]:
+        """最後に取得したアプリ一覧のETag"""
+        return self.get_meta("etag")
+
+    def replace_range(self, after_id: int, last_id: Optional[int], apps: List[Dict[str, Any]]):
+        """
+        ID順に取得した一覧の1ページで、キャッシュの (after_id, last_id] の範囲を置き換える
+        (ページにないアプリは削除する)。last_id がNoneなら最後のページとして、after_id より後すべてを置き換える。
+        カーソルとETagは変えないので、すべてのページを置き換えたら set_sync_state を呼ぶこと。
+        """
+        def write(connection):
+            if last_id is None:
+                connection.execute("DELETE FROM apps WHERE id > ?", (after_id,))
+            else:
+                connection.execute("DELETE FROM apps WHERE id > ? AND id <= ?", (after_id, last_id))
+            self._upsert(connection, apps)
+        self._write(write)
+
+    def set_sync_state(self, cursor: int, etag: Optional[str]):
+        """一覧全体を取得し終えたときの、カーソルとETagを保存する"""
+        self._write(lambda connection: self._set_meta(connection, cursor, etag))
+
+    def apply_changes(self, upserts: List[Dict[str, Any]], deletes: List[int], cursor: int):
+        """
+        差分 (追加・更新されたアプリと、削除されたアプリのID) を反映する。
+        更新は保存済みの情報に項目ごとに上書きする (差分に含まれない項目は、保存済みの値を残す)。
+        カーソルは戻さない (変更通知と差分の取得が前後しても、反映済みの位置より前には戻らない)。
+        """
+        def write(connection):
+            self._merge(connection, upserts)
+            connection.executemany("DELETE FROM apps WHERE id = ?", [(app_id,) for app_id in deletes])
+            row = connection.execute("SELECT value FROM meta WHERE key = 'cursor'").fetchone()
+            # 差分を反映した一覧は、ETagの一覧とは一致しなくなる
+            self._set_meta(connection, max(cursor, int(row[0] or 0) if row else 0), None)
+        self._write(write)
+
+    def apply_event(self, event: Dict[str, Any]):
+        """変更通知 ({"seq", "op", "app"}) を1件反映する"""
+        if event["op"] == "delete":
+            self.apply_changes([], [event["app"]["id"]], event["seq"])
+        else:
+            self.apply_changes([event["app"]], [], event["seq"])
+
+    def _write(self, write):
+        with self._lock:
+            connection = self._connect()
+            try:
+                with connection:
+                    write(connection)
+            finally:
+                connection.close()
+
+    @staticmethod
+    def _upsert(connection: sqlite3.Connection, apps: List[Dict[str, Any]]):
+        connection.executemany(
+            "INSERT OR REPLACE INTO apps (id, data) VALUES (?, ?)",
+            [(app["id"], json.dumps(app, ensure_ascii=False)) for app in apps],
+        )
+
+    @classmethod
+    def _merge(cls, connection: sqlite3.Connection, apps: List[Dict[str, Any]]):
+        """保存済みのアプリは、その情報に新しい項目を上書きしたものを保存する"""
+        merged = []
+        for app in apps:
+            row = connection.execute("SELECT data FROM apps WHERE id = ?", (app["id"],)).fetchone()
+            merged.append({**json.loads(row[0]), **app} if row else app)
+        cls._upsert(connection, merged)
+
+    @staticmethod
+    def _set_meta(connection: sqlite3.Connection, cursor: int, etag: Optional[str]):
+        connection.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [("cursor", str(cursor)), ("etag", etag)],
+        )
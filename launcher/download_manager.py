@@ -0,0 +1,527 @@
+import bisect
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import requests
+
+# --- パッケージのダウンロードマネージャー ---
+# 大きなパッケージを、複数の Range リクエストで並列にダウンロードする。
+# ファイルを一定サイズの区間 (セグメント) に分け、各接続が空いている区間を順に取得して
+# 「保存先.part」の該当位置に書き込む。区間ごとの進み具合は「保存先.part.json」に保存するので、
+# 通信が切れたり、ランチャーを再起動したりしても、続きから再開できる。
+#
+# 受け取ったデータはその場でSHA-256を計算し (先頭から連続して書き込まれた部分を順に読む)、
+# 完了時にサーバーが公開している package_sha256 と照合する。一致しなければファイルを破棄する。
+#
+# 同時にダウンロードするパッケージの数は MAX_CONCURRENT_DOWNLOADS までで、それ以上は順番待ちになる。
+# DOWNLOAD_RATE_LIMIT (バイト/秒) を指定すると、全ダウンロードの合計速度を制限する。
+CONNECTIONS_PER_DOWNLOAD = 4
+MAX_CONCURRENT_DOWNLOADS = 2
+DOWNLOAD_RATE_LIMIT = 0           # 0 は無制限
+SEGMENT_SIZE = 4 * 1024 * 1024     # 区間の大きさ。これより小さいファイルは1本の接続で取得する
+CHUNK_SIZE = 64 * 1024
+HASH_READ_SIZE = 1024 * 1024
+MAX_RETRIES = 8                    # 区間ごとの再試行の回数 (Wi-Fi の瞬断などに備える)
+MAX_BACKOFF = 30
+REQUEST_TIMEOUT = (10, 30)         # (接続, 読み取り) の秒数
+STATE_SAVE_INTERVAL = 1.0
+PROGRESS_INTERVAL = 0.1
+
+ProgressCallback = Callable[[int, int], None]
+
+
+class DownloadError(Exception):
+    """ダウンロードに失敗した場合の例外"""
+
+
+class HashMismatchError(DownloadError):
+    """ダウンロードした内容のSHA-256が一致しない場合の例外"""
+
+
+class DownloadCancelled(DownloadError):
+    """ダウンロードがキャンセルされた場合の例外 (途中までの状態は残るので、後で再開できる)"""
+
+
+class _ResourceChanged(Exception):
+    """ダウンロードの途中でサーバー上のファイルが変わった場合 (最初からやり直す)"""
+
+
+class _RetryableStatus(Exception):
+    """再試行すれば成功する可能性のあるステータスコード (5xx など)"""
+
+
+def file_sha256(path: str) -> str:
+    """ファイル全体のSHA-256を計算する"""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_READ_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class RateLimiter:
+    """
+    トークンバケットによる速度制限。複数のスレッド・ダウンロードで共有する。
+    rate が0以下の場合は制限しない。
+    """
+
+    def __init__(self, rate: int = 0):
+        self.rate = rate
+        self._tokens = float(rate)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: int):
+        """amount バイト分のトークンを使う。足りない場合は貯まるまで待つ"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            # 最大で1秒分までバーストを許す
+            self._tokens = min(float(self.rate), self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class _Segment:
+    """ファイルの区間 [start, end) と、そのうち先頭から書き込み済みのバイト数"""
+
+    def __init__(self, start: int, end: int, done: int = 0):
+        self.start = start
+        self.end = end
+        self.done = done
+
+    @property
+    def finished(self) -> bool:
+        return self.start + self.done >= self.end
+
+
+class DownloadTask:
+    """
+    1つのファイルのダウンロード。DownloadManager.submit で作成する。
+
+    :param url: ダウンロードするURL
+    :param save_path: 保存先のパス
+    :param sha256: 期待するSHA-256 (16進数)。指定した場合は完了時に照合する
+    :param connections: 並列に張る接続の数
+    :param limiter: 速度制限 (マネージャーで共有する)
+    """
+
+    def __init__(self, url: str, save_path: str, sha256: Optional[str] = None,
+                 connections: int = CONNECTIONS_PER_DOWNLOAD, limiter: Optional[RateLimiter] = None):
+        self.url = url
+        self.save_path = save_path
+        self.sha256 = sha256.lower() if sha256 else None
+        self.connections = max(1, connections)
+        self.limiter = limiter or RateLimiter()
+        self.part_path = f"{save_path}.part"
+        self.state_path = f"{save_path}.part.json"
+        self.future: Future = Future()
+
+        self.size = 0
+        self.etag: Optional[str] = None
+        self.downloaded = 0
+        self.segments: List[_Segment] = []
+        self._starts: List[int] = []
+        self._callbacks: List[ProgressCallback] = []
+        # キャンセルされたか、他の接続が失敗したときにセットされ、すべての接続を止める
+        self._stop = threading.Event()
+        self._cancelled = False
+        self._lock = threading.Lock()
+        self._hasher = None
+        self._hash_offset = 0
+        self._hash_file = None
+        self._last_state_save = 0.0
+        self._last_progress = 0.0
+
+    # --- 外部から使うメソッド ---
+    def add_progress_callback(self, callback: ProgressCallback):
+        """進捗 (ダウンロード済みバイト数, 全体のバイト数) を受け取る関数を登録する (別スレッドから呼ばれる)"""
+        self._callbacks.append(callback)
+
+    def cancel(self):
+        """ダウンロードを中断する。途中までの状態は保存され、次回は続きから再開する"""
+        self._cancelled = True
+        self._stop.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def run(self) -> str:
+        """
+        ダウンロードを実行する (完了するまでブロックする)。
+        :return: 保存先のパス
+        :raises DownloadError: 失敗・キャンセル・SHA-256の不一致の場合
+        """
+        if self.sha256 and os.path.exists(self.save_path) and file_sha256(self.save_path) == self.sha256:
+            # 以前に完了したものが残っている
+            return self.save_path
+
+        os.makedirs(os.path.dirname(self.save_path) or ".", exist_ok=True)
+        try:
+            return self._run_once()
+        except _ResourceChanged:
+            self._discard_partial()
+        # ダウンロード中にサーバー上のファイルが差し替えられていた場合は、1回だけ最初からやり直す
+        try:
+            return self._run_once()
+        except _ResourceChanged:
+            self._discard_partial()
+            raise DownloadError("ダウンロード中にサーバー上のファイルが変更されました。")
+
+    # --- 内部処理 ---
+    def _run_once(self) -> str:
+        if not self._cancelled:
+            self._stop.clear()
+        self._check_cancelled()
+        size, etag, accepts_ranges = self._probe()
+        if size is None or not accepts_ranges:
+            # 範囲指定に対応していないサーバーでは、分割も再開もせず1本の接続で取得する
+            return self._download_single()
+
+        self.size, self.etag = size, etag
+        if not self._load_state():
+            self._discard_partial()
+            self._plan_segments()
+            # 先にファイル全体の大きさを確保しておき、各区間を該当位置に書き込む
+            with open(self.part_path, "wb") as f:
+                f.truncate(self.size)
+            self._save_state(force=True)
+
+        self._starts = [segment.start for segment in self.segments]
+        self.downloaded = sum(segment.done for segment in self.segments)
+        self._hasher = hashlib.sha256()
+        self._hash_offset = 0
+        with open(self.part_path, "rb", buffering=0) as self._hash_file:
+            with self._lock:
+                # 前回までに書き込み済みの部分を先にハッシュに含める
+                self._advance_hash()
+            self._report_progress(force=True)
+            self._fetch_segments()
+            with self._lock:
+                self._advance_hash()
+        self._save_state(force=True)
+
+        if self._hash_offset != self.size:
+            raise DownloadError("ダウンロードが完了していない区間があります。")
+        self._finish(self._hasher.hexdigest())
+        return self.save_path
+
+    def _probe(self):
+        """HEADリクエストで、大きさ・ETag・範囲指定への対応を確認する"""
+        try:
+            response = requests.head(self.url, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            raise DownloadError(f"サーバーに接続できませんでした: {e}") from e
+        if response.status_code == 405:
+            # HEAD に対応していないサーバー
+            return None, None, False
+        if response.status_code != 200:
+            raise DownloadError(f"ダウンロードに失敗しました (HTTP {response.status_code})")
+        length = response.headers.get("Content-Length")
+        accepts_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        return (int(length) if length is not None else None), response.headers.get("ETag"), accepts_ranges
+
+    def _plan_segments(self):
+        self.segments = [
+            _Segment(start, min(start + SEGMENT_SIZE, self.size))
+            for start in range(0, self.size, SEGMENT_SIZE)
+        ] or [_Segment(0, 0)]
+
+    def _fetch_segments(self):
+        """未完了の区間を、接続ごとのスレッドで先頭から順に取得する"""
+        pending = [segment for segment in self.segments if not segment.finished]
+        if not pending:
+            return
+        pending_lock = threading.Lock()
+        errors = []
+
+        def worker():
+            # 接続ごとにセッションを分けて、区間をまたいで接続を再利用する
+            with requests.Session() as session:
+                while not errors:
+                    with pending_lock:
+                        if not pending:
+                            return
+                        segment = pending.pop(0)
+                    try:
+                        self._fetch_segment(session, segment)
+                    except BaseException as e:
+                        errors.append(e)
+                        # 他の接続も止める (状態は保存されるので、次回はそこから再開できる)
+                        self._stop.set()
+                        return
+                    finally:
+                        self._save_state(force=True)
+
+        threads = [
+            threading.Thread(target=worker, name=f"download-{i}", daemon=True)
+            for i in range(min(self.connections, len(pending)))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            # 他の接続を止めたことによる DownloadCancelled より、元の原因を優先する
+            raise next((e for e in errors if not isinstance(e, DownloadCancelled)), errors[0])
+
+    def _fetch_segment(self, session: requests.Session, segment: _Segment):
+        """1つの区間を取得する。通信エラーの場合は、待ち時間を延ばしながら続きから再試行する"""
+        attempt = 0
+        while not segment.finished:
+            self._check_cancelled()
+            try:
+                self._stream_segment(session, segment)
+                attempt = 0
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError, _RetryableStatus) as e:
+                attempt += 1
+                if attempt > MAX_RETRIES:
+                    raise DownloadError(f"ダウンロードに失敗しました: {e}") from e
+                # 待っている間もキャンセルできるようにする
+                self._stop.wait(min(2 ** attempt, MAX_BACKOFF))
+
+    def _stream_segment(self, session: requests.Session, segment: _Segment):
+        position = segment.start + segment.done
+        headers = {"Range": f"bytes={position}-{segment.end - 1}"}
+        if self.etag:
+            # ファイルが変わっていた場合は、範囲ではなく全体 (200) が返ってくる
+            headers["If-Range"] = self.etag
+        with session.get(self.url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+            if response.status_code in (200, 416):
+                raise _ResourceChanged()
+            if response.status_code >= 500 or response.status_code == 429:
+                raise _RetryableStatus(f"HTTP {response.status_code}")
+            if response.status_code != 206:
+                raise DownloadError(f"ダウンロードに失敗しました (HTTP {response.status_code})")
+
+            # バッファリングせずに書き込み、ハッシュ計算用のハンドルからすぐ読めるようにする
+            with open(self.part_path, "r+b", buffering=0) as f:
+                f.seek(position)
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    self._check_cancelled()
+                    chunk = chunk[:segment.end - position]
+                    if not chunk:
+                        break
+                    self.limiter.consume(len(chunk))
+                    f.write(chunk)
+                    self._on_written(segment, position, chunk)
+                    position += len(chunk)
+
+    def _on_written(self, segment: _Segment, position: int, chunk: bytes):
+        with self._lock:
+            segment.done += len(chunk)
+            self.downloaded += len(chunk)
+            if position == self._hash_offset:
+                # 先頭から連続している部分は、受け取ったデータをそのままハッシュに渡す
+                self._hasher.update(chunk)
+                self._hash_offset += len(chunk)
+            self._advance_hash()
+        self._save_state()
+        self._report_progress()
+
+    def _advance_hash(self):
+        """
+        ハッシュを計算済みの位置から先が書き込み済みなら、ファイルから読んでハッシュに含める。
+        (先に書き込まれた後ろの区間は、前の区間が追いついたときにここで読まれる)
+        self._lock を取得した状態で呼ぶこと。
+        """
+        while self._hash_offset < self.size:
+            segment = self.segments[bisect.bisect_right(self._starts, self._hash_offset) - 1]
+            available = segment.start + segment.done - self._hash_offset
+            if available <= 0:
+                return
+            self._hash_file.seek(self._hash_offset)
+            data = self._hash_file.read(min(available, HASH_READ_SIZE))
+            if not data:
+                return
+            self._hasher.update(data)
+            self._hash_offset += len(data)
+
+    def _download_single(self) -> str:
+        """範囲指定に対応していない場合のダウンロード。失敗したら最初からやり直す"""
+        attempt = 0
+        while True:
+            self._check_cancelled()
+            try:
+                digest = self._stream_single()
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError, _RetryableStatus) as e:
+                attempt += 1
+                if attempt > MAX_RETRIES:
+                    raise DownloadError(f"ダウンロードに失敗しました: {e}") from e
+                self._stop.wait(min(2 ** attempt, MAX_BACKOFF))
+        self._finish(digest)
+        return self.save_path
+
+    def _stream_single(self) -> str:
+        sha256 = hashlib.sha256()
+        self.downloaded = 0
+        with requests.get(self.url, stream=True, timeout=REQUEST_TIMEOUT) as response:
+            if response.status_code >= 500 or response.status_code == 429:
+                raise _RetryableStatus(f"HTTP {response.status_code}")
+            if response.status_code != 200:
+                raise DownloadError(f"ダウンロードに失敗しました (HTTP {response.status_code})")
+            self.size = int(response.headers.get("Content-Length", 0))
+            with open(self.part_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    self._check_cancelled()
+                    self.limiter.consume(len(chunk))
+                    f.write(chunk)
+                    sha256.update(chunk)
+                    self.downloaded += len(chunk)
+                    self._report_progress()
+        return sha256.hexdigest()
+
+    def _finish(self, digest: str):
+        """SHA-256を照合し、一致すれば保存先に移動する"""
+        if self.sha256 and digest != self.sha256:
+            self._discard_partial()
+            raise HashMismatchError(
+                f"ダウンロードしたファイルが壊れています (SHA-256 が一致しません: {digest})"
+            )
+        os.replace(self.part_path, self.save_path)
+        self._remove(self.state_path)
+        self._report_progress(force=True)
+
+    def _check_cancelled(self):
+        if self._stop.is_set():
+            raise DownloadCancelled("ダウンロードがキャンセルされました。")
+
+    def _report_progress(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        total = self.size or self.downloaded
+        for callback in list(self._callbacks):
+            callback(self.downloaded, total)
+
+    # --- 途中までの状態の保存と読み込み ---
+    def _load_state(self) -> bool:
+        """
+        前回の途中までの状態を読み込む。
+        :return: 同じファイルの続きから再開できる場合はTrue
+        """
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+            if (state["url"] != self.url or state["size"] != self.size or state["etag"] != self.etag
+                    or os.path.getsize(self.part_path) != self.size):
+                return False
+            self.segments = [_Segment(start, end, done) for start, end, done in state["segments"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        return True
+
+    def _save_state(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_state_save < STATE_SAVE_INTERVAL:
+            return
+        with self._lock:
+            self._last_state_save = now
+            state = {
+                "url": self.url,
+                "size": self.size,
+                "etag": self.etag,
+                "segments": [[segment.start, segment.end, segment.done] for segment in self.segments],
+            }
+            # 書きかけの状態ファイルが残らないよう、一時ファイル経由で置き換える
+            temp_path = f"{self.state_path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(temp_path, self.state_path)
+
+    def _discard_partial(self):
+        self.segments = []
+        self._remove(self.part_path)
+        self._remove(self.state_path)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class DownloadManager:
+    """
+    ダウンロードの順番待ちと速度制限を管理する。
+
+    :param max_concurrent: 同時に実行するダウンロードの数
+    :param rate_limit: 全ダウンロードの合計速度の上限 (バイト/秒、0は無制限)
+    :param connections: 1つのダウンロードで並列に張る接続の数
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_DOWNLOADS, rate_limit: int = DOWNLOAD_RATE_LIMIT,
+                 connections: int = CONNECTIONS_PER_DOWNLOAD):
+        self.max_concurrent = max_concurrent
+        self.connections = connections
+        self.limiter = RateLimiter(rate_limit)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._active: Dict[str, DownloadTask] = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix="download-task")
+        return self._executor
+
+    def submit(self, url: str, save_path: str, sha256: Optional[str] = None,
+               progress: Optional[ProgressCallback] = None) -> DownloadTask:
+        """
+        ダウンロードを順番待ちに追加する。結果は task.future で受け取る。
+        同じ保存先のダウンロードが既に実行中・待機中の場合は、そのタスクを返す。
+        """
+        with self._lock:
+            task = self._active.get(save_path)
+            if task is None:
+                task = DownloadTask(url, save_path, sha256, connections=self.connections, limiter=self.limiter)
+                self._active[save_path] = task
+                self._get_executor().submit(self._run, task)
+            if progress is not None:
+                task.add_progress_callback(progress)
+        return task
+
+    def _run(self, task: DownloadTask):
+        if not task.future.set_running_or_notify_cancel():
+            return
+        try:
+            task.future.set_result(task.run())
+        except BaseException as e:
+            task.future.set_exception(e)
+        finally:
+            with self._lock:
+                self._active.pop(task.save_path, None)
+
+    def set_rate_limit(self, rate: int):
+        """速度の上限を変更する (実行中のダウンロードにもすぐ反映される)"""
+        self.limiter.rate = rate
+
+    def shutdown(self):
+        """すべてのダウンロードをキャンセルして終了する (途中までの状態は次回の起動時に再開できる)"""
+        with self._lock:
+            tasks = list(self._active.values())
+        for task in tasks:
+            task.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+download_manager = DownloadManager()
@@ -0,0 +1,458 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+from wheel_cache import wheel_cache
+
+# --- 仮想環境の共有プール ---
+# アプリのバージョンごとに仮想環境を作り直すと、更新のたびに同じライブラリを入れ直すことになる。
+# そこで、正規化した requirements.txt とPythonのバージョンのダイジェストをキーにして、
+# 仮想環境を APPDATA/Cat-box/envs/<ダイジェスト>/ で共有する。
+#
+# - 同じダイジェストの環境があれば、そのまま使う (インストールは一瞬で終わる)
+# - なければ、要件が今回の部分集合になっている既存の環境 (なければ空の環境) を複製し、
+#   足りないライブラリだけを pip でインストールする。複製には、ファイルシステムが対応していれば
+#   コピーオンライト (reflink) を、次にハードリンクを使い、どちらもできなければ通常のコピーをする。
+# - どのアプリ (インストール先) がどの環境を使っているかを index.json で参照カウントし、
+#   誰も使っていない環境は、プール全体が ENV_DISK_BUDGET を超えたときに古い順に削除する。
+ENVS_DIR = os.path.join(os.getenv('APPDATA', os.path.expanduser('~')), 'Cat-box', 'envs')
+INDEX_FILE = 'index.json'
+READY_MARKER = '.catbox-env-ready'
+ENV_DISK_BUDGET = 5 * 1024 * 1024 * 1024
+
+# Linux の FICLONE ioctl (btrfs, xfs などでコピーオンライトの複製を作る)
+_FICLONE = 0x40049409
+
+_NAME_RE = re.compile(r"^([A-Za-z0-9][A-Za-z0-9._-]*)(.*)$")
+
+# (コマンド, check) -> 終了コード。check=True の場合は失敗時に例外を送出する
+RunProcess = Callable[..., int]
+
+
+def python_key() -> str:
+    """環境を作るPython (ランチャー自身のPython) を表す文字列。これが変わると別の環境になる"""
+    return f"{sys.version} {sys.platform} {os.path.realpath(sys.executable)}"
+
+
+def normalize_requirements(text: str) -> List[str]:
+    """
+    requirements.txt の内容を正規化する。
+    コメント・空行・余分な空白を取り除き、パッケージ名を PEP 503 の形式 (小文字、区切りは -) にして並べ替える。
+    """
+    lines = set()
+    for raw_line in text.splitlines():
+        line = raw_line.split(" #", 1)[0].strip()
+        if not line or line.startswith("#"):
+            continue
+        match = _NAME_RE.match(line)
+        if match and not line.startswith("-"):
+            name = re.sub(r"[-_.]+", "-", match.group(1)).lower()
+            line = name + re.sub(r"\s+", "", match.group(2))
+        lines.add(line)
+    return sorted(lines)
+
+
+def _is_local_reference(line: str) -> bool:
+    """他のファイルやローカルのパスを参照する行か (内容がアプリごとに違うので、環境を共有できない)"""
+    if line.startswith(("-r", "-c", "-e", "--requirement", "--constraint", "--editable", ".")):
+        return True
+    return ("/" in line or "\\" in line) and "://" not in line
+
+
+def requirements_digest(requirements: List[str], requirements_path: Optional[str] = None) -> str:
+    """正規化した要件とPythonのバージョンから、環境のダイジェストを計算する"""
+    sha256 = hashlib.sha256()
+    sha256.update(python_key().encode("utf-8"))
+    for line in requirements:
+        sha256.update(b"\n" + line.encode("utf-8"))
+    if requirements_path and any(_is_local_reference(line) for line in requirements):
+        # ローカルのファイルを参照している場合は、そのアプリ専用の環境にする
+        sha256.update(b"\n" + os.path.abspath(requirements_path).encode("utf-8"))
+    return sha256.hexdigest()
+
+
+def _disk_usage(paths) -> int:
+    """ディレクトリの合計サイズ (ハードリンクで共有しているファイルは1回だけ数える)"""
+    seen = set()
+    total = 0
+    for path in paths:
+        for root, dirs, files in os.walk(path):
+            for name in files:
+                try:
+                    stat = os.lstat(os.path.join(root, name))
+                except OSError:
+                    continue
+                key = (stat.st_dev, stat.st_ino)
+                if key not in seen:
+                    seen.add(key)
+                    total += stat.st_size
+    return total
+
+
+class _Cloner:
+    """ファイルを、使える中で最も安い方法 (reflink → ハードリンク → コピー) で複製する"""
+
+    def __init__(self):
+        self.can_reflink = sys.platform.startswith("linux")
+        self.can_hardlink = True
+
+    def clone_file(self, src: str, dst: str):
+        if self.can_reflink:
+            try:
+                import fcntl
+                with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                    fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+                shutil.copystat(src, dst)
+                return
+            except OSError:
+                # 対応していないファイルシステムでは、以降は試さない
+                self.can_reflink = False
+                if os.path.exists(dst):
+                    os.remove(dst)
+        if self.can_hardlink:
+            try:
+                os.link(src, dst)
+                return
+            except OSError:
+                self.can_hardlink = False
+        shutil.copy2(src, dst)
+
+
+def clone_tree(src_dir: str, dst_dir: str):
+    """
+    仮想環境のディレクトリを複製し、環境のパスが埋め込まれたファイル (スクリプトのシバンなど) を書き換える。
+    ダイジェストはすべて同じ長さなので、パスの置き換えでファイルの長さは変わらない
+    (Windows の pip の起動用exeのように、末尾にzipが付いたファイルも壊れない)。
+    """
+    cloner = _Cloner()
+    old_path = os.path.abspath(src_dir).encode("utf-8")
+    new_path = os.path.abspath(dst_dir).encode("utf-8")
+    for root, dirs, files in os.walk(src_dir):
+        relative = os.path.relpath(root, src_dir)
+        target_root = os.path.join(dst_dir, relative)
+        os.makedirs(target_root, exist_ok=True)
+        for name in files:
+            src = os.path.join(root, name)
+            dst = os.path.join(target_root, name)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+            elif name == READY_MARKER:
+                continue
+            else:
+                cloner.clone_file(src, dst)
+        for name in dirs:
+            src = os.path.join(root, name)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), os.path.join(target_root, name))
+        # シンボリックリンクのディレクトリはたどらない
+        dirs[:] = [name for name in dirs if not os.path.islink(os.path.join(root, name))]
+
+    for scripts_dir in ("bin", "Scripts"):
+        directory = os.path.join(dst_dir, scripts_dir)
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                _replace_path(os.path.join(directory, name), old_path, new_path)
+    _replace_path(os.path.join(dst_dir, "pyvenv.cfg"), old_path, new_path)
+
+
+def _replace_path(path: str, old: bytes, new: bytes):
+    """ファイル中の old を new に置き換える。複製元と共有しているファイルを変更しないよう、新しいファイルとして書き直す"""
+    if os.path.islink(path) or not os.path.isfile(path):
+        return
+    with open(path, "rb") as f:
+        data = f.read()
+    if old not in data:
+        return
+    mode = os.stat(path).st_mode
+    os.remove(path)
+    with open(path, "wb") as f:
+        f.write(data.replace(old, new))
+    os.chmod(path, mode)
+
+
+class EnvLease:
+    """
+    EnvPool.lease で取得する、1つのアプリのための環境。
+    同じダイジェストの環境を同時に作らないよう、with ブロックの間はそのダイジェストをロックする。
+    ブロックが例外で終わった場合は、作りかけの環境を削除する。
+    """
+
+    def __init__(self, pool: "EnvPool", digest: str, requirements: List[str], requirements_path: Optional[str],
+                 owner: str):
+        self.pool = pool
+        self.digest = digest
+        self.requirements = requirements
+        self.requirements_path = requirements_path
+        self.owner = owner
+        self.env_dir = pool.env_dir(digest)
+        self.reused = False
+        self.cloned_from: Optional[str] = None
+        self._building = False
+
+    @property
+    def ready(self) -> bool:
+        return os.path.exists(os.path.join(self.env_dir, READY_MARKER))
+
+    def create(self, run: RunProcess):
+        """
+        環境を用意する。同じダイジェストの環境があれば再利用し、
+        なければ近い環境 (なければ空の環境) を複製するか、新しく作成する。
+        """
+        if self.ready:
+            self.reused = True
+            return
+        self._building = True
+        if os.path.exists(self.env_dir):
+            # 前回作りかけのまま終わった環境
+            shutil.rmtree(self.env_dir)
+        source = self.pool.find_clone_source(self.requirements, exclude=self.digest)
+        if source is None and self.requirements:
+            # 空の環境を先に作っておき、次からはそれを複製する
+            source = self.pool.ensure_base_env(run)
+        if source is not None:
+            self.pool.pin(source)
+            try:
+                clone_tree(self.pool.env_dir(source), self.env_dir)
+            finally:
+                self.pool.unpin(source)
+            self.cloned_from = source
+        else:
+            run([sys.executable, '-m', 'venv', self.env_dir])
+
+    def install(self, run: RunProcess) -> Optional[bool]:
+        """
+        requirements.txt のライブラリを、wheel のキャッシュを使ってインストールする (再利用した環境では何もしない)。
+        :return: キャッシュだけでインストールできた場合はTrue、ダウンロードが必要だった場合はFalse、何もしなかった場合はNone
+        """
+        if self.reused or not self.requirements:
+            return None
+        return wheel_cache.install(run, env_python(self.env_dir), self.env_dir, self.requirements_path)
+
+    def commit(self):
+        """環境を完成したものとして記録し、アプリからの参照を追加する"""
+        if self._building:
+            with open(os.path.join(self.env_dir, READY_MARKER), 'w', encoding='utf-8') as f:
+                f.write(self.cloned_from or '')
+        self.pool.add_ref(self, size=_disk_usage([self.env_dir]) if self._building else None)
+        self._building = False
+
+    def abort(self):
+        if self._building:
+            shutil.rmtree(self.env_dir, ignore_errors=True)
+            self._building = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is not None:
+                self.abort()
+        finally:
+            self.pool.unlock(self.digest)
+        if exc_type is None:
+            self.pool.collect_garbage()
+        return False
+
+
+class EnvPool:
+    """
+    仮想環境の共有プール。
+
+    :param envs_dir: 環境を置くディレクトリ
+    :param disk_budget: 誰も使っていない環境を削除し始める、プール全体のサイズ (バイト)
+    """
+
+    def __init__(self, envs_dir: str = ENVS_DIR, disk_budget: int = ENV_DISK_BUDGET):
+        self.envs_dir = envs_dir
+        self.disk_budget = disk_budget
+        self._lock = threading.Lock()
+        self._digest_locks: Dict[str, threading.Lock] = {}
+        self._pins: Counter = Counter()
+
+    def env_dir(self, digest: str) -> str:
+        return os.path.join(self.envs_dir, digest)
+
+    # --- 環境の取得 ---
+    def lease(self, requirements_path: Optional[str], owner: str) -> EnvLease:
+        """
+        アプリのための環境を取得する。with ブロックの中で create → install → commit の順に呼ぶ。
+
+            with env_pool.lease(requirements_path, app_dir) as lease:
+                lease.create(run)
+                lease.install(run)
+                lease.commit()
+
+        :param requirements_path: requirements.txt のパス (ない場合はNone)
+        :param owner: 環境を使うアプリのインストール先 (参照カウントのキー)
+        """
+        requirements = []
+        if requirements_path and os.path.exists(requirements_path):
+            with open(requirements_path, encoding='utf-8') as f:
+                requirements = normalize_requirements(f.read())
+        else:
+            requirements_path = None
+        digest = requirements_digest(requirements, requirements_path)
+        self.lock(digest)
+        return EnvLease(self, digest, requirements, requirements_path, owner)
+
+    def lock(self, digest: str):
+        with self._lock:
+            digest_lock = self._digest_locks.setdefault(digest, threading.Lock())
+        digest_lock.acquire()
+
+    def unlock(self, digest: str):
+        self._digest_locks[digest].release()
+
+    def pin(self, digest: str):
+        """複製元として使っている間、ガベージコレクションで削除されないようにする"""
+        with self._lock:
+            self._pins[digest] += 1
+
+    def unpin(self, digest: str):
+        with self._lock:
+            self._pins[digest] -= 1
+
+    def ensure_base_env(self, run: RunProcess) -> str:
+        """ライブラリを何も入れていない環境を用意し、そのダイジェストを返す"""
+        digest = requirements_digest([])
+        self.lock(digest)
+        try:
+            env_dir = self.env_dir(digest)
+            if not os.path.exists(os.path.join(env_dir, READY_MARKER)):
+                shutil.rmtree(env_dir, ignore_errors=True)
+                try:
+                    run([sys.executable, '-m', 'venv', env_dir])
+                except BaseException:
+                    shutil.rmtree(env_dir, ignore_errors=True)
+                    raise
+                with open(os.path.join(env_dir, READY_MARKER), 'w', encoding='utf-8') as f:
+                    f.write('')
+                self._update_entry(digest, requirements=[], size=_disk_usage([env_dir]))
+        finally:
+            self.unlock(digest)
+        return digest
+
+    def find_clone_source(self, requirements: List[str], exclude: Optional[str] = None) -> Optional[str]:
+        """要件が requirements の部分集合になっている完成済みの環境のうち、最も要件の多いものを返す"""
+        wanted = set(requirements)
+        key = python_key()
+        best, best_size = None, -1
+        for digest, entry in self._load_index().items():
+            if digest == exclude or entry.get("python") != key:
+                continue
+            have = set(entry.get("requirements", []))
+            if not have <= wanted or len(have) <= best_size:
+                continue
+            if any(_is_local_reference(line) for line in have):
+                continue
+            if os.path.exists(os.path.join(self.env_dir(digest), READY_MARKER)):
+                best, best_size = digest, len(have)
+        return best
+
+    # --- 参照カウント ---
+    def add_ref(self, lease: EnvLease, size: Optional[int] = None):
+        self._update_entry(lease.digest, requirements=lease.requirements, size=size, add_owner=lease.owner)
+
+    def release(self, owner: str):
+        """アプリが環境を使わなくなったとき (アンインストール・再インストール時) に参照を外す"""
+        with self._lock:
+            index = self._load_index()
+            for entry in index.values():
+                if owner in entry.get("refs", []):
+                    entry["refs"].remove(owner)
+            self._save_index(index)
+
+    def env_for(self, owner: str) -> Optional[str]:
+        """アプリが使っている環境のディレクトリ"""
+        for digest, entry in self._load_index().items():
+            if owner in entry.get("refs", []):
+                return self.env_dir(digest)
+        return None
+
+    def _update_entry(self, digest: str, requirements: List[str], size: Optional[int] = None,
+                      add_owner: Optional[str] = None):
+        with self._lock:
+            index = self._load_index()
+            entry = index.setdefault(digest, {"python": python_key(), "requirements": requirements, "refs": []})
+            entry["last_used"] = time.time()
+            if size is not None:
+                entry["size"] = size
+            if add_owner is not None:
+                # 1つのアプリが参照する環境は1つだけ
+                for other in index.values():
+                    if add_owner in other.get("refs", []):
+                        other["refs"].remove(add_owner)
+                entry["refs"].append(add_owner)
+            self._save_index(index)
+
+    # --- ガベージコレクション ---
+    def collect_garbage(self) -> List[str]:
+        """
+        プール全体のサイズが予算を超えていれば、誰も使っていない環境を最後に使った時刻の古い順に削除する。
+        インストール先が削除されたアプリからの参照は、ここで外す。
+        :return: 削除した環境のダイジェスト
+        """
+        removed = []
+        with self._lock:
+            index = self._load_index()
+            for entry in index.values():
+                entry["refs"] = [owner for owner in entry.get("refs", []) if os.path.isdir(owner)]
+            # 作りかけの環境 (index にないもの) は、ロックされていなければ削除する
+            if os.path.isdir(self.envs_dir):
+                for name in os.listdir(self.envs_dir):
+                    path = self.env_dir(name)
+                    if (name not in index and os.path.isdir(path) and not self._is_busy(name)
+                            and not os.path.exists(os.path.join(path, READY_MARKER))):
+                        shutil.rmtree(path, ignore_errors=True)
+
+            candidates = sorted(
+                (entry.get("last_used", 0), digest) for digest, entry in index.items()
+                if not entry.get("refs") and not self._is_busy(digest)
+            )
+            if candidates and _disk_usage([self.env_dir(d) for d in index]) > self.disk_budget:
+                for _, digest in candidates:
+                    shutil.rmtree(self.env_dir(digest), ignore_errors=True)
+                    del index[digest]
+                    removed.append(digest)
+                    if _disk_usage([self.env_dir(d) for d in index]) <= self.disk_budget:
+                        break
+            self._save_index(index)
+        return removed
+
+    def _is_busy(self, digest: str) -> bool:
+        digest_lock = self._digest_locks.get(digest)
+        return self._pins[digest] > 0 or (digest_lock is not None and digest_lock.locked())
+
+    # --- index.json ---
+    def _load_index(self) -> dict:
+        try:
+            with open(os.path.join(self.envs_dir, INDEX_FILE), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self, index: dict):
+        os.makedirs(self.envs_dir, exist_ok=True)
+        path = os.path.join(self.envs_dir, INDEX_FILE)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, path)
+
+
+def env_python(env_dir: str) -> str:
+    """仮想環境のPythonのパス (OSによって異なる)"""
+    if sys.platform == "win32":
+        return os.path.join(env_dir, 'Scripts', 'python.exe')
+    return os.path.join(env_dir, 'bin', 'python')
+
+
+env_pool = EnvPool()
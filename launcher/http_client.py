@@ -0,0 +1,58 @@
+import random
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# --- ランチャーの HTTP 通信 ---
+# サーバーとの通信は create_session で作ったセッションを共有し、接続を使い回す (keep-alive)。
+# 毎回接続を張り直すと、リクエストごとに TCP (と TLS) のハンドシェイクで往復が増えるため。
+#
+# 冪等なリクエスト (GET/HEAD/PUT/DELETE/OPTIONS) は、接続が切れた場合や 429/502/503/504 が返った場合に
+# ゆらぎ (jitter) 付きの指数バックオフで再試行する。Retry-After があればそれに従う。
+# POST などは、リクエストを送る前の接続エラーだけを再試行する (二重に登録されないように)。
+# 応答は gzip で受け取る (サーバーはアプリ一覧などの大きなJSONを圧縮して返す)。
+#
+# 1つのホストに張る接続の数は POOL_MAXSIZE までで、request_scheduler.py のスレッド数と揃えてある。
+POOL_MAXSIZE = 8
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5     # 再試行の間隔は 0.5, 1, 2... 秒 (にゆらぎを加えたもの)
+BACKOFF_MAX = 10
+RETRY_STATUSES = (429, 502, 503, 504)
+USER_AGENT = "Cat-box-Launcher"
+
+
+class _JitteredRetry(Retry):
+    """
+    バックオフの間隔を [間隔/2, 間隔] の範囲でランダムにする Retry。
+    サーバーが落ちたときに、多数のランチャーが同じタイミングで再接続しないようにする。
+    """
+
+    def get_backoff_time(self) -> float:
+        backoff = min(super().get_backoff_time(), BACKOFF_MAX)
+        return random.uniform(backoff / 2, backoff) if backoff > 0 else 0
+
+
+def create_session(pool_maxsize: int = POOL_MAXSIZE, max_retries: int = MAX_RETRIES) -> requests.Session:
+    """
+    接続の再利用・再試行・gzipを設定したセッションを作る。
+    複数のスレッドから同時に使ってよい (リクエストごとに接続プールから空いている接続を使う)。
+
+    :param pool_maxsize: 1つのホストに同時に張る接続の数
+    :param max_retries: 再試行の回数
+    """
+    retry = _JitteredRetry(
+        total=max_retries,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        respect_retry_after_header=True,
+        # 再試行しても失敗した場合は最後の応答を返し、呼び出し側の raise_for_status で扱う
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip", "User-Agent": USER_AGENT})
+    return session
@@ -0,0 +1,308 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Iterable, Optional, Tuple
+
+from PySide6.QtCore import QObject, Qt, Signal, Slot
+from PySide6.QtGui import QImage, QPixmap
+
+# --- アプリのアイコンのキャッシュ ---
+# 一覧にアイコンを表示するたびにサーバーから取得・デコードしていると、スクロールがもたつく。
+# そこで2段のキャッシュを持つ。
+#   メモリ: デコード済みの QPixmap を、最近使った順に ICON_MEMORY_CACHE_SIZE 個まで (IconLoader)
+#   ディスク: 取得した画像を URL ごとに APPDATA/Cat-box/icons/ に、合計 ICON_DISK_CACHE_MAX_SIZE まで (IconDiskCache)
+# 一覧の data() はメモリのキャッシュを見るだけで、まだ読み込んでいなければ透明なプレースホルダーを返す。
+# 画像の読み込み (ディスク、なければサーバー) とデコードは RequestScheduler のスレッドで行い、
+# 終わったら icon_ready で知らせる。表示中の行と、その前後 ICON_PREFETCH_MARGIN 行のアイコンは
+# スクロールされる前に先読みする。同時に読み込むのは ICON_CONCURRENCY 件まで (一覧の同期などを待たせないため)。
+#
+# サーバーが生成したアイコン (server/icons.py) のURLは画像の内容から決まり、immutable として配信されるので、
+# ディスクにあればそのまま使う。それ以外のURLは、ICON_REVALIDATE_AFTER 秒ごとにETag付きの条件付きリクエストで確認する。
+ICONS_DIR = os.path.join(os.getenv('APPDATA', os.path.expanduser('~')), 'Cat-box', 'icons')
+ICON_DISK_CACHE_MAX_SIZE = 64 * 1024 * 1024
+ICON_MEMORY_CACHE_SIZE = 512
+ICON_CONCURRENCY = 4
+ICON_PREFETCH_MARGIN = 30
+ICON_REVALIDATE_AFTER = 24 * 60 * 60
+# 読み込めなかったアイコンを、もう一度読み込むまでの秒数
+ICON_RETRY_AFTER = 60
+LIST_ICON_SIZE = 32          # 一覧に表示する大きさ (論理ピクセル)
+MAX_ICON_BYTES = 1024 * 1024
+REQUEST_TIMEOUT = (10, 30)
+
+# サーバーのアイコンのURL。サイズ部分を差し替えると別の解像度になる
+_ICON_URL_RE = re.compile(r"^(?P<base>.*/icons/[0-9a-f]{64})/\d+\.webp$")
+_SERVER_ICON_SIZES = (32, 64, 128, 256)
+
+
+def icon_variant_url(url: str, pixels: int) -> str:
+    """サーバーのアイコンなら、pixels 以上で最も小さい解像度のURLにする (それ以外のURLはそのまま)"""
+    match = _ICON_URL_RE.match(url)
+    if not match:
+        return url
+    size = next((size for size in _SERVER_ICON_SIZES if size >= pixels), _SERVER_ICON_SIZES[-1])
+    return f"{match.group('base')}/{size}.webp"
+
+
+class IconDiskCache:
+    """
+    取得したアイコン画像を、URLごとに1つのファイルで保存する。複数のスレッドから使ってよい。
+    ファイルの1行目は {"url", "etag", "immutable", "validated_at"} のJSONで、2行目以降が画像そのもの。
+    合計サイズが上限を超えたら、最後に使った (更新時刻の) 古いファイルから削除する。
+
+    :param cache_dir: キャッシュのディレクトリ
+    :param max_size: キャッシュ全体のサイズの上限 (バイト)
+    """
+
+    def __init__(self, cache_dir: str = ICONS_DIR, max_size: int = ICON_DISK_CACHE_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # 合計サイズ (最初に必要になったときにディレクトリを調べる)
+        self._total: Optional[int] = None
+
+    def path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest())
+
+    def get(self, url: str) -> Optional[Tuple[dict, bytes]]:
+        """:return: (ヘッダー, 画像のバイト列)。なければNone"""
+        path = self.path(url)
+        try:
+            with open(path, "rb") as f:
+                header = json.loads(f.readline())
+                data = f.read()
+            # 最後に使った時刻として、ファイルの更新時刻を使う
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        if header.get("url") != url:
+            return None
+        return header, data
+
+    def put(self, url: str, data: bytes, etag: Optional[str] = None, immutable: bool = False):
+        """画像を保存する (確認した時刻は今にする)。上限を超えたら古いものを削除する"""
+        header = {"url": url, "etag": etag, "immutable": immutable, "validated_at": time.time()}
+        content = json.dumps(header).encode("utf-8") + b"\n" + data
+        path = self.path(url)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            with self._lock:
+                total = self._scan_total()
+                total -= _file_size(path)
+                os.replace(temp_path, path)
+                self._total = total + len(content)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        if self._total > self.max_size:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        キャッシュが上限を超えていれば、上限の9割になるまで最後に使った時刻の古いものから削除する。
+        :return: 削除したファイルの数
+        """
+        removed = 0
+        with self._lock:
+            total = self._scan_total()
+            if total <= self.max_size:
+                return 0
+            entries = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            for _, size, path in sorted(entries):
+                if total <= self.max_size * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            self._total = total
+        return removed
+
+    def size(self) -> int:
+        with self._lock:
+            return self._scan_total()
+
+    def _scan_total(self) -> int:
+        """(self._lock を持った状態で呼ぶ)"""
+        if self._total is None:
+            try:
+                self._total = sum(
+                    entry.stat().st_size for entry in os.scandir(self.cache_dir)
+                    if entry.is_file() and not entry.name.endswith(".tmp")
+                )
+            except FileNotFoundError:
+                self._total = 0
+        return self._total
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _read_limited(response, limit: int) -> bytes:
+    """
+    (stream=True で送ったリクエストの) 応答の本文を読む。
+    :raises ValueError: limit バイトを超える場合 (超えた時点で受信をやめる)
+    """
+    if int(response.headers.get("Content-Length") or 0) > limit:
+        raise ValueError("アイコンが大きすぎます。")
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        size += len(chunk)
+        if size > limit:
+            raise ValueError("アイコンが大きすぎます。")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+class IconLoader(QObject):
+    """
+    一覧のアイコンを読み込み、デコード済みの QPixmap をメモリにキャッシュする。メインスレッドで作成して使う。
+
+    :param scheduler: 読み込みを実行する RequestScheduler
+    :param session: アイコンの取得に使うセッション (ApiClient の接続を使い回す)
+    :param disk_cache: ディスクのキャッシュ (省略時は ICONS_DIR)
+    :param device_pixel_ratio: 画面の拡大率。高DPIの画面では、その分大きな画像を読み込む
+    """
+    # アイコンを読み込んだ (pixmap(url) で取得できるようになった)
+    icon_ready = Signal(str)
+
+    def __init__(self, scheduler, session, disk_cache: Optional[IconDiskCache] = None,
+                 device_pixel_ratio: float = 1.0, memory_size: int = ICON_MEMORY_CACHE_SIZE,
+                 concurrency: int = ICON_CONCURRENCY, parent=None):
+        super().__init__(parent)
+        self.scheduler = scheduler
+        self.session = session
+        self.disk_cache = disk_cache or IconDiskCache()
+        self.device_pixel_ratio = device_pixel_ratio
+        self.memory_size = memory_size
+        self.concurrency = concurrency
+        self._pixels = round(LIST_ICON_SIZE * device_pixel_ratio)
+        self._pixmaps: "OrderedDict[str, QPixmap]" = OrderedDict()
+        # 読み込み待ちのURL (先頭から読み込む) と、読み込み中のURL
+        self._pending = deque()
+        self._queued = set()
+        self._in_flight = set()
+        # 読み込めなかったURL -> 時刻
+        self._failed: Dict[str, float] = {}
+        self._stopped = False
+        self.placeholder = QPixmap(self._pixels, self._pixels)
+        self.placeholder.fill(Qt.transparent)
+        self.placeholder.setDevicePixelRatio(device_pixel_ratio)
+
+    def pixmap(self, url: str) -> QPixmap:
+        """読み込み済みならそのアイコン、まだならプレースホルダーを返す (ここでは読み込まない)"""
+        pixmap = self._pixmaps.get(url)
+        if pixmap is None:
+            return self.placeholder
+        self._pixmaps.move_to_end(url)
+        return pixmap
+
+    def prefetch(self, urls: Iterable[Optional[str]]):
+        """
+        これらのURLのアイコンを、この順に読み込む。
+        前回の prefetch で読み込み待ちだったものは取り消す (スクロールして見えなくなった行のアイコンは読み込まない)。
+        """
+        self._pending.clear()
+        self._queued.clear()
+        now = time.monotonic()
+        for url in urls:
+            if not url or url in self._pixmaps or url in self._in_flight or url in self._queued:
+                continue
+            if now - self._failed.get(url, -ICON_RETRY_AFTER) < ICON_RETRY_AFTER:
+                continue
+            self._queued.add(url)
+            self._pending.append(url)
+        self._dispatch()
+
+    def shutdown(self):
+        """読み込み待ちのアイコンを取り消し、以降は読み込まない"""
+        self._stopped = True
+        self._pending.clear()
+        self._queued.clear()
+
+    def _dispatch(self):
+        while self._pending and len(self._in_flight) < self.concurrency and not self._stopped:
+            url = self._pending.popleft()
+            self._queued.discard(url)
+            self._in_flight.add(url)
+            task = self.scheduler.submit(self._load, url, name=url)
+            task.succeeded.connect(self._on_loaded)
+            task.failed.connect(self._on_failed)
+
+    def _load(self, url: str) -> QImage:
+        """
+        (RequestScheduler のスレッドで実行) アイコンをディスクかサーバーから読み込み、表示する大きさにデコードする。
+        QPixmap はメインスレッドでしか作れないので、QImage で返す。
+        """
+        fetch_url = icon_variant_url(url, self._pixels)
+        cached = self.disk_cache.get(fetch_url)
+        if cached is not None:
+            header, data = cached
+            if header.get("immutable") or time.time() - header.get("validated_at", 0) < ICON_REVALIDATE_AFTER:
+                return self._decode(data)
+
+        etag = cached[0].get("etag") if cached is not None else None
+        # 大きすぎる画像を最後まで受信しないよう、少しずつ受け取って上限を超えたら打ち切る
+        with self.session.get(
+            fetch_url, headers={"If-None-Match": etag} if etag else {}, timeout=REQUEST_TIMEOUT, stream=True
+        ) as response:
+            if response.status_code == 304 and cached is not None:
+                data = cached[1]
+            else:
+                response.raise_for_status()
+                data = _read_limited(response, MAX_ICON_BYTES)
+                etag = response.headers.get("ETag")
+            immutable = "immutable" in response.headers.get("Cache-Control", "")
+        image = self._decode(data)
+        # 画像として読み込めたものだけを保存する
+        self.disk_cache.put(fetch_url, data, etag, immutable)
+        return image
+
+    def _decode(self, data: bytes) -> QImage:
+        if len(data) > MAX_ICON_BYTES:
+            raise ValueError("アイコンが大きすぎます。")
+        image = QImage.fromData(data)
+        if image.isNull():
+            raise ValueError("アイコンを画像として読み込めません。")
+        if image.width() != self._pixels or image.height() != self._pixels:
+            image = image.scaled(self._pixels, self._pixels, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        return image
+
+    @Slot(object)
+    def _on_loaded(self, image):
+        url = self.sender().name
+        self._in_flight.discard(url)
+        pixmap = QPixmap.fromImage(image)
+        pixmap.setDevicePixelRatio(self.device_pixel_ratio)
+        self._pixmaps[url] = pixmap
+        while len(self._pixmaps) > self.memory_size:
+            self._pixmaps.popitem(last=False)
+        self.icon_ready.emit(url)
+        self._dispatch()
+
+    @Slot(str)
+    def _on_failed(self, error_message):
+        url = self.sender().name
+        self._in_flight.discard(url)
+        self._failed[url] = time.monotonic()
+        self._dispatch()
@@ -0,0 +1,451 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import zipfile
+from typing import Callable, List, Optional, Tuple
+
+from download_manager import HASH_READ_SIZE, file_sha256
+from env_pool import env_pool, env_python
+from zygote import ZygoteError, zygote_pool
+
+# --- アプリのインストール処理 ---
+# ダウンロードしたパッケージ (zip) から、アプリを起動できる状態にするまでを段階に分けて実行する。
+#   verify (検証) → extract (展開) → create_env (仮想環境の作成) → install_deps (ライブラリのインストール) → launch (起動)
+# 画面を止めないよう、ワーカースレッドから呼び出す。各段階は進捗を通知し、途中でキャンセルできる。
+#
+# インストール先は APPDATA/Cat-box/apps/アプリ名/バージョン/。仮想環境は env_pool で共有し、
+# 使っている環境のパスをインストール先の ENV_FILE に記録する。
+# すべての段階が成功したときに完了の印 (INSTALLED_MARKER) を書き込み、印のないディレクトリは
+# インストール途中のものとして扱う。失敗・キャンセル時はディレクトリごと削除する (ロールバック)。
+#
+# 同じアプリの別バージョンがインストール済みなら、パッケージ全体の代わりに差分パッケージ
+# (変わったファイルと新しいバージョンのマニフェストだけのzip) を受け取り、展開の段階で
+# 変わっていないファイルをインストール済みのバージョンからハードリンクする。
+# 結果はマニフェスト (パス・サイズ・SHA-256) と照合し、一致しなければ失敗として扱う。
+APPS_DIR = os.path.join(os.getenv('APPDATA', os.path.expanduser('~')), 'Cat-box', 'apps')
+INSTALLED_MARKER = '.catbox-installed'
+# zipの中の構造に依存 (展開した直下の 'dummy_app' フォルダにある run.py を実行するルール)
+ENTRY_POINT = os.path.join('dummy_app', 'run.py')
+REQUIREMENTS_FILE = os.path.join('dummy_app', 'requirements.txt')
+# 起動を速くするために事前にimportしておくモジュール (1行に1つ、# 以降はコメント)。
+# このファイルがあるアプリは zygote (zygote.py) から起動する
+PRELOAD_FILE = os.path.join('dummy_app', 'preload.txt')
+ENV_FILE = '.catbox-env'
+# 環境を共有する前のインストールで使っていた、アプリ専用の仮想環境
+LEGACY_ENV_DIR_NAME = '.venv'
+# 差分パッケージの中で、新しいバージョンのマニフェストが入っているファイル (サーバーの packages.py と同じ)
+DELTA_MANIFEST_NAME = '.catbox-delta.json'
+
+STAGES = ("verify", "extract", "create_env", "install_deps", "launch")
+STAGE_LABELS = {
+    "verify": "検証",
+    "extract": "展開",
+    "create_env": "仮想環境の作成",
+    "install_deps": "ライブラリのインストール",
+    "launch": "起動",
+}
+
+# (段階, 進捗(%)、不明な場合は-1, メッセージ)
+ProgressCallback = Callable[[str, int, str], None]
+
+# コンソールウィンドウを出さずにサブプロセスを実行する (Windowsのみ)
+_NO_WINDOW = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+
+
+class InstallError(Exception):
+    """インストールに失敗した場合の例外"""
+
+
+class InstallCancelled(InstallError):
+    """インストールがキャンセルされた場合の例外"""
+
+
+def app_install_dir(app_name: str, app_version: str) -> str:
+    return os.path.join(APPS_DIR, app_name, app_version)
+
+
+def is_installed(app_dir: str) -> bool:
+    """すべての段階が完了したインストールかどうか"""
+    return os.path.exists(os.path.join(app_dir, INSTALLED_MARKER))
+
+
+def app_env_dir(app_dir: str) -> str:
+    """アプリが使う仮想環境のディレクトリ"""
+    try:
+        with open(os.path.join(app_dir, ENV_FILE), encoding='utf-8') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return os.path.join(app_dir, LEGACY_ENV_DIR_NAME)
+
+
+def installed_package_sha256(app_dir: str) -> Optional[str]:
+    """インストール済みのパッケージのSHA-256 (完了の印に記録してある)。分からなければNone"""
+    try:
+        with open(os.path.join(app_dir, INSTALLED_MARKER), encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def version_key(version: str):
+    """バージョン文字列を比較用のキーに変換する (サーバーの crud.version_key と同じ規則)"""
+    parts = re.split(r"[.\-+_]", version.strip().lstrip("vV"))
+    return tuple((0, int(part), "") if part.isdigit() else (1, 0, part) for part in parts if part)
+
+
+def installed_apps() -> List[Tuple[str, str]]:
+    """
+    インストールが完了しているアプリの (名前, バージョン) のリスト。
+    同じアプリの複数のバージョンがある場合は、最も新しいバージョンだけを返す。
+    """
+    if not os.path.isdir(APPS_DIR):
+        return []
+    result = []
+    for app_name in os.listdir(APPS_DIR):
+        app_root = os.path.join(APPS_DIR, app_name)
+        if not os.path.isdir(app_root):
+            continue
+        versions = [version for version in os.listdir(app_root) if is_installed(os.path.join(app_root, version))]
+        if versions:
+            result.append((app_name, max(versions, key=version_key)))
+    return result
+
+
+def find_delta_base(app_data: dict) -> Optional[Tuple[str, str]]:
+    """
+    差分パッケージの元にできる、同じアプリの別バージョンのインストールを探す (最後にインストールしたもの)。
+    :return: (インストール先, パッケージのSHA-256)。見つからなければNone
+    """
+    target_sha256 = app_data.get('package_sha256')
+    app_root = os.path.join(APPS_DIR, app_data['name'])
+    if not target_sha256 or not os.path.isdir(app_root):
+        return None
+    candidates = []
+    for version in os.listdir(app_root):
+        app_dir = os.path.join(app_root, version)
+        sha256 = installed_package_sha256(app_dir)
+        if version != app_data['version'] and sha256 and sha256 != target_sha256:
+            candidates.append((os.path.getmtime(os.path.join(app_dir, INSTALLED_MARKER)), app_dir, sha256))
+    if not candidates:
+        return None
+    _, app_dir, sha256 = max(candidates)
+    return app_dir, sha256
+
+
+def delta_url(download_url: str, base_sha256: str, target_sha256: str) -> str:
+    """パッケージのURL (.../packages/<sha256>.zip) から、差分パッケージのURLを作る"""
+    return f"{download_url.rsplit('/', 1)[0]}/deltas/{base_sha256}/{target_sha256}.zip"
+
+
+def preload_modules(app_dir: str) -> List[str]:
+    """アプリが PRELOAD_FILE で宣言している、事前にimportしておくモジュール"""
+    try:
+        with open(os.path.join(app_dir, PRELOAD_FILE), encoding='utf-8') as f:
+            lines = [line.split('#', 1)[0].strip() for line in f]
+    except (OSError, UnicodeDecodeError):
+        return []
+    return [line for line in lines if line]
+
+
+def prewarm_app(app_dir: str):
+    """インストール済みのアプリの zygote を、起動される前に用意しておく (宣言がなければ何もしない)"""
+    modules = preload_modules(app_dir)
+    if not modules or not is_installed(app_dir):
+        return
+    try:
+        zygote_pool.prewarm(env_python(app_env_dir(app_dir)), modules)
+    except ZygoteError:
+        pass
+
+
+def launch_app(app_dir: str, app_name: str):
+    """
+    インストール済みのアプリを、専用の仮想環境のPythonで起動する。
+    事前にimportするモジュールが宣言されていて、その zygote の準備ができていれば zygote から起動する。
+    準備中の場合は待たずに通常どおり起動する (画面を止めないため。zygote は次回の起動から使われる)。
+    :return: subprocess.Popen (zygote から起動した場合は zygote.ZygoteProcess)
+    """
+    executable_path = os.path.join(app_dir, ENTRY_POINT)
+    if not os.path.exists(executable_path):
+        raise InstallError(f"実行ファイルが見つかりません: {executable_path}")
+    python_executable = env_python(app_env_dir(app_dir))
+    modules = preload_modules(app_dir)
+    if modules and zygote_pool.enabled:
+        try:
+            return zygote_pool.launch(python_executable, modules, [executable_path, app_name], wait=False)
+        except ZygoteError:
+            pass
+    creationflags = subprocess.CREATE_NEW_CONSOLE if sys.platform == "win32" else 0
+    return subprocess.Popen([python_executable, executable_path, app_name], creationflags=creationflags)
+
+
+class InstallJob:
+    """
+    1つのアプリのインストール。run() は完了するまでブロックするので、ワーカースレッドで呼ぶこと。
+
+    :param app_data: アプリ情報 (name, version, package_sha256 を使う)
+    :param zip_path: ダウンロードしたパッケージ (base_dir を指定した場合は差分パッケージ) のパス
+    :param progress: 進捗を受け取る関数 (run() を呼んだスレッドから呼ばれる)
+    :param launch: 最後にアプリを起動するか
+    :param base_dir: 差分パッケージの元になる、インストール済みのバージョンのディレクトリ
+    """
+
+    def __init__(self, app_data: dict, zip_path: str, progress: Optional[ProgressCallback] = None,
+                 launch: bool = True, base_dir: Optional[str] = None):
+        self.app_data = app_data
+        self.app_name = app_data['name']
+        self.zip_path = zip_path
+        self.base_dir = base_dir
+        self._delta_manifest = None
+        self.app_dir = app_install_dir(self.app_name, app_data['version'])
+        self.requirements_path = os.path.join(self.app_dir, REQUIREMENTS_FILE)
+        self.progress = progress
+        self.launch = launch
+        self.stage: Optional[str] = None
+        self._last_percent = None
+        self._cancelled = threading.Event()
+        self._process: Optional[subprocess.Popen] = None
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """インストールを中断する。実行中のサブプロセス (venv, pip) も終了させる"""
+        self._cancelled.set()
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                self._process.terminate()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def run(self) -> str:
+        """
+        すべての段階を順に実行する。
+        :return: インストール先のディレクトリ
+        :raises InstallError: 失敗またはキャンセルされた場合 (インストール途中のファイルは削除される)
+        """
+        try:
+            if os.path.exists(self.app_dir):
+                # 前回のインストールが途中で終わっていた場合は、最初からやり直す
+                env_pool.release(self.app_dir)
+                shutil.rmtree(self.app_dir)
+            self._begin("verify")
+            self._verify()
+            self._begin("extract")
+            self._extract()
+            # 環境の作成とライブラリのインストールの間は、同じ要件の環境を他のインストールと同時に作らない
+            with env_pool.lease(self.requirements_path, self.app_dir) as lease:
+                self._begin("create_env")
+                self._create_env(lease)
+                self._begin("install_deps")
+                self._install_deps(lease)
+                self._check_cancelled()
+                lease.commit()
+                # ここまで成功したら、インストール完了として印を付ける
+                with open(os.path.join(self.app_dir, ENV_FILE), 'w', encoding='utf-8') as f:
+                    f.write(lease.env_dir)
+                with open(os.path.join(self.app_dir, INSTALLED_MARKER), 'w', encoding='utf-8') as f:
+                    f.write(self.app_data.get('package_sha256') or '')
+        except BaseException as e:
+            self._rollback()
+            if self.cancelled:
+                raise InstallCancelled("インストールがキャンセルされました。") from e
+            if isinstance(e, InstallError):
+                raise
+            raise InstallError(f"{STAGE_LABELS.get(self.stage, self.stage)}に失敗しました: {e}") from e
+
+        if self.launch:
+            self._begin("launch")
+            launch_app(self.app_dir, self.app_name)
+            self._report(100, f"'{self.app_name}' のプロセスを起動しました。")
+        return self.app_dir
+
+    # --- 各段階 ---
+    def _verify(self):
+        """パッケージのSHA-256と、zipとして読めることを確認する"""
+        if self.base_dir is not None:
+            self._verify_delta()
+            return
+        expected = self.app_data.get('package_sha256')
+        if expected:
+            sha256 = hashlib.sha256()
+            total = os.path.getsize(self.zip_path) or 1
+            done = 0
+            with open(self.zip_path, 'rb') as f:
+                while True:
+                    self._check_cancelled()
+                    chunk = f.read(HASH_READ_SIZE)
+                    if not chunk:
+                        break
+                    sha256.update(chunk)
+                    done += len(chunk)
+                    self._report(done * 100 // total)
+            if sha256.hexdigest() != expected.lower():
+                raise InstallError("パッケージのSHA-256が一致しません。もう一度ダウンロードしてください。")
+        if not zipfile.is_zipfile(self.zip_path):
+            raise InstallError("パッケージがzipファイルではありません。")
+        self._report(100)
+
+    def _verify_delta(self):
+        """差分パッケージが、インストール済みのバージョンから目的のバージョンへのものであることを確認する"""
+        if not zipfile.is_zipfile(self.zip_path):
+            raise InstallError("差分パッケージがzipファイルではありません。")
+        with zipfile.ZipFile(self.zip_path, 'r') as zip_ref:
+            try:
+                manifest = json.loads(zip_ref.read(DELTA_MANIFEST_NAME))
+            except (KeyError, ValueError) as e:
+                raise InstallError(f"差分パッケージのマニフェストを読み込めません: {e}")
+        if manifest.get("base") != installed_package_sha256(self.base_dir) or \
+                manifest.get("target") != (self.app_data.get('package_sha256') or '').lower():
+            raise InstallError("差分パッケージのバージョンが一致しません。")
+        for entry in manifest["files"]:
+            _safe_relative_path(entry["path"])
+        self._delta_manifest = manifest
+        self._report(100)
+
+    def _extract(self):
+        """zipファイルを1ファイルずつ展開する (展開したサイズで進捗を通知する)"""
+        if self.base_dir is not None:
+            self._apply_delta()
+            return
+        os.makedirs(self.app_dir, exist_ok=True)
+        with zipfile.ZipFile(self.zip_path, 'r') as zip_ref:
+            members = zip_ref.infolist()
+            total = sum(member.file_size for member in members) or 1
+            done = 0
+            for member in members:
+                self._check_cancelled()
+                # ZipFile.extract は ".." や絶対パスを取り除いてから展開する
+                zip_ref.extract(member, self.app_dir)
+                done += member.file_size
+                self._report(done * 100 // total)
+
+    def _apply_delta(self):
+        """
+        差分パッケージに入っているファイルを展開し、それ以外はインストール済みのバージョンからリンクする。
+        最後にすべてのファイルをマニフェストと照合する (進捗は展開・リンクで半分、照合で半分)。
+        """
+        files = self._delta_manifest["files"]
+        total = sum(entry["size"] for entry in files) * 2 or 1
+        done = 0
+        os.makedirs(self.app_dir, exist_ok=True)
+        with zipfile.ZipFile(self.zip_path, 'r') as zip_ref:
+            changed = set(zip_ref.namelist())
+            for entry in files:
+                self._check_cancelled()
+                path = os.path.join(self.app_dir, _safe_relative_path(entry["path"]))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if entry["path"] in changed:
+                    with zip_ref.open(entry["path"]) as src, open(path, 'wb') as dst:
+                        shutil.copyfileobj(src, dst, HASH_READ_SIZE)
+                else:
+                    _link_or_copy(os.path.join(self.base_dir, _safe_relative_path(entry["path"])), path)
+                done += entry["size"]
+                self._report(done * 100 // total)
+
+        for entry in files:
+            self._check_cancelled()
+            path = os.path.join(self.app_dir, _safe_relative_path(entry["path"]))
+            if os.path.getsize(path) != entry["size"] or file_sha256(path) != entry["sha256"]:
+                raise InstallError(f"差分を適用したファイルがマニフェストと一致しません: {entry['path']}")
+            done += entry["size"]
+            self._report(done * 100 // total)
+        changed_count = len(changed - {DELTA_MANIFEST_NAME})
+        self._report(100, f"差分を適用しました。(変更 {changed_count}件、流用 {len(files) - changed_count}件)")
+
+    def _create_env(self, lease):
+        """共有の仮想環境を用意する (同じ要件の環境があれば再利用し、なければ複製・作成する)"""
+        lease.create(self._run_process)
+        if lease.reused:
+            message = "同じライブラリ構成の仮想環境を再利用します。"
+        elif lease.cloned_from:
+            message = "既存の仮想環境を複製しました。"
+        else:
+            message = "仮想環境を作成しました。"
+        self._report(100, message)
+
+    def _install_deps(self, lease):
+        """requirements.txt に書かれたライブラリのうち、環境に足りないものをインストールする"""
+        if not os.path.exists(self.requirements_path):
+            self._report(100, "'requirements.txt' が見つかりませんでした。スキップします。")
+            return
+        if lease.reused:
+            self._report(100, "ライブラリはインストール済みです。")
+            return
+        offline = lease.install(self._run_process)
+        self._report(100, "キャッシュ済みのライブラリからインストールしました。" if offline else "")
+
+    # --- 補助 ---
+    def _run_process(self, args, check: bool = True) -> int:
+        """
+        サブプロセスを実行し、出力を1行ずつ進捗メッセージとして通知する。
+        :param check: Trueの場合、失敗したら InstallError を送出する (Falseなら終了コードを返す)
+        :return: 終了コード
+        """
+        with self._lock:
+            self._check_cancelled()
+            self._process = subprocess.Popen(
+                args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, creationflags=_NO_WINDOW
+            )
+        output = []
+        try:
+            for line in self._process.stdout:
+                line = line.rstrip()
+                if line:
+                    output.append(line)
+                    self._report(-1, line)
+            returncode = self._process.wait()
+        finally:
+            with self._lock:
+                self._process = None
+        self._check_cancelled()
+        if check and returncode != 0:
+            detail = "\n".join(output[-20:])
+            raise InstallError(f"{STAGE_LABELS[self.stage]}に失敗しました (終了コード {returncode}):\n{detail}")
+        return returncode
+
+    def _begin(self, stage: str):
+        self._check_cancelled()
+        self.stage = stage
+        self._report(0, f"{STAGE_LABELS[stage]}を開始します...")
+
+    def _report(self, percent: int, message: str = ""):
+        # ファイル数の多いzipなどで通知が多くなりすぎないよう、進捗(%)が変わったときだけ通知する
+        if not message and percent == self._last_percent:
+            return
+        self._last_percent = percent
+        if self.progress is not None:
+            self.progress(self.stage, percent, message)
+
+    def _check_cancelled(self):
+        if self._cancelled.is_set():
+            raise InstallCancelled("インストールがキャンセルされました。")
+
+    def _rollback(self):
+        """インストール途中のファイルを削除する (作りかけの仮想環境は env_pool が削除する)"""
+        env_pool.release(self.app_dir)
+        shutil.rmtree(self.app_dir, ignore_errors=True)
+
+
+def _safe_relative_path(path: str) -> str:
+    """マニフェストのパスを、インストール先の外を指さないことを確かめてからOSのパスに変換する"""
+    parts = path.replace('\\', '/').split('/')
+    if not path or path.startswith('/') or ':' in parts[0] or any(part in ('', '.', '..') for part in parts):
+        raise InstallError(f"マニフェストに不正なパスがあります: {path}")
+    return os.path.join(*parts)
+
+
+def _link_or_copy(src: str, dst: str):
+    """ハードリンクを作る。できない場合 (別のドライブなど) はコピーする"""
+    try:
+        os.link(src, dst)
+    except FileNotFoundError:
+        raise InstallError(f"インストール済みのバージョンにファイルがありません: {src}")
+    except OSError:
+        shutil.copy2(src, dst)
+
@@ -1,85 +1,261 @@
-import sys, subprocess, os, zipfile, venv
-import requests
+import sys, os, time
+# 起動からアプリ一覧を表示するまでの時間を計測するため、最初に記録しておく
+LAUNCHER_STARTED_AT = time.perf_counter()
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget,
-    QHBoxLayout, QVBoxLayout, QListWidget, QListWidgetItem,
-    QTextEdit, QLabel, QPushButton, QSplitter
+    QHBoxLayout, QVBoxLayout, QListView, QLineEdit,
+    QTextEdit, QLabel, QPushButton, QSplitter, QProgressBar
 )
-from PySide6.QtCore import Qt, QThread, QObject, Signal, Slot
+from PySide6.QtCore import Qt, QThread, QObject, QModelIndex, QPoint, QSize, QTimer, Signal, Slot
 
 # 作成したAPIクライアントと認証ダイアログをインポート
 from api_client import ApiClient
 from auth_dialog import AuthDialog # この行を追記
+from app_list_model import AppFilterProxyModel, AppIdRole, AppListModel
+from catalog_cache import CatalogCache
+from download_manager import download_manager
+from icon_cache import ICON_PREFETCH_MARGIN, LIST_ICON_SIZE, IconLoader
+from request_scheduler import RequestScheduler
+from zygote import zygote_pool
+import installer
+
+# 一覧全体を取得するときの、1ページの件数
+CATALOG_PAGE_SIZE = 500
+# 検索欄の入力が止まってから絞り込むまでの時間 (ミリ秒)
+FILTER_DELAY_MS = 150
+# スクロールが止まってからアイコンを先読みするまでの時間 (ミリ秒)
+ICON_PREFETCH_DELAY_MS = 50
 
 # --- バックグラウンドでAPI通信を行うワーカークラス ---
 class ApiWorker(QObject):
-    """API通信を別スレッドで実行するためのワーカー"""
-    # シグナルの定義: 成功時にアプリリスト(list)、失敗時にエラーメッセージ(str)を渡す
-    succeeded = Signal(list)
-    failed = Signal(str)
-
-    def __init__(self, api_client):
+    """
+    アプリ一覧の同期を行うワーカー。fetch_app_list は RequestScheduler のスレッドで実行し、
+    結果は RequestTask のシグナルで受け取る。
+    """
+    # 一覧全体の取得中に、キャッシュの (after_id, last_id] の範囲を置き換えるたびに通知する
+    page_synced = Signal(int, object)
+
+    def __init__(self, api_client, catalog_cache):
         super().__init__()
         self.api_client = api_client
+        self.catalog_cache = catalog_cache
 
-    @Slot()
     def fetch_app_list(self):
-        """アプリリストを取得するタスク"""
-        try:
-            apps = self.api_client.get_app_list()
-            self.succeeded.emit(apps)
-        except Exception as e:
-            self.failed.emit(str(e))
+        """
+        キャッシュ済みのアプリ一覧をサーバーと同期するタスク。
+        カーソルがあれば差分だけを取得し、なければ (古すぎる場合も) ETag付きで一覧全体を取得する。
+        :return: 同期結果 {"upserts": 追加・更新されたアプリ, "deletes": 削除されたアプリID, "full": 一覧全体か}
+                 (一覧全体を取得した場合は、upserts の代わりに件数 "count" を入れ、内容は page_synced で通知する)
+        """
+        cursor = self.catalog_cache.cursor
+        if cursor:
+            changes = self._fetch_changes(cursor)
+            if changes is not None:
+                return changes
+
+        return self._fetch_all(if_none_match=self.catalog_cache.etag if cursor else None)
+
+    def _fetch_all(self, if_none_match):
+        """一覧全体をID順のページで取得し、ページごとにキャッシュの同じ範囲を置き換える"""
+        after_id, total = 0, 0
+        cursor, etag = 0, None
+        while True:
+            first_page = after_id == 0
+            apps = self.api_client.get_app_list(
+                after_id=after_id, limit=CATALOG_PAGE_SIZE, if_none_match=if_none_match if first_page else None
+            )
+            if apps is None:
+                # キャッシュと同じ一覧だった
+                return {"upserts": [], "deletes": [], "full": False}
+            if first_page:
+                # 最初のページの時点のカーソルを使う (取得中の変更は、次の差分同期で受け取る)
+                cursor, etag = self.api_client.catalog_cursor, self.api_client.catalog_etag
+            last_id = apps[-1]["id"] if len(apps) == CATALOG_PAGE_SIZE else None
+            self.catalog_cache.replace_range(after_id, last_id, apps)
+            self.page_synced.emit(after_id, last_id)
+            total += len(apps)
+            if last_id is None:
+                break
+            after_id = last_id
+        self.catalog_cache.set_sync_state(cursor, etag)
+        self.api_client.catalog_cursor = cursor
+        return {"upserts": [], "deletes": [], "full": True, "count": total}
+
+    def _fetch_changes(self, cursor):
+        """カーソル以降の差分をすべて取得し、キャッシュに反映する。差分を取得できない場合はNone"""
+        upserts, deletes = {}, set()
+        while True:
+            changes = self.api_client.get_app_changes(since=cursor)
+            if changes is None:
+                return None
+            self.catalog_cache.apply_changes(changes["upserts"], changes["deletes"], changes["cursor"])
+            for app in changes["upserts"]:
+                upserts[app["id"]] = app
+                deletes.discard(app["id"])
+            for app_id in changes["deletes"]:
+                upserts.pop(app_id, None)
+                deletes.add(app_id)
+            cursor = changes["cursor"]
+            if not changes["has_more"]:
+                return {"upserts": list(upserts.values()), "deletes": sorted(deletes), "full": False}
+
+    def check_updates(self):
+        """
+        インストール済みアプリの更新を確認するタスク (アプリ一覧の同期の後に実行する)。
+        インストール先 (APPS_DIR/アプリ名/バージョン) をキャッシュの一覧と照らし合わせてアプリIDを求め、
+        まとめてサーバーに問い合わせる。一覧にないアプリ (非公開になったものなど) は確認しない。
+        :return: 新しいバージョンがあるアプリの情報のリスト
+        """
+        app_ids = self.catalog_cache.find_app_ids(installer.installed_apps())
+        installed = [{"id": app_id, "version": version} for (_, version), app_id in app_ids.items()]
+        if not installed:
+            return []
+        return self.api_client.check_updates(installed)
 
 # --- バックグラウンドでダウンロードを行うワーカークラス ---
 class DownloadWorker(QObject):
-    """ファイルをダウンロードするためのワーカー"""
-    progress = Signal(int)       # 進捗(%)を通知
+    """
+    ファイルをダウンロードするためのワーカー。
+    実際のダウンロード (分割・再開・SHA-256の照合) は download_manager が行い、
+    このワーカーは完了を待って結果をシグナルで通知する。
+    """
+    progress = Signal(object, object)  # 進捗 (ダウンロード済みバイト数, 全体のバイト数) を通知
     finished = Signal(str)       # 完了時に保存先パスを通知
     failed = Signal(str)         # 失敗時にエラーメッセージを通知
 
-    def __init__(self, url, save_path):
+    def __init__(self, url, save_path, sha256=None):
         super().__init__()
         self.url = url
         self.save_path = save_path
+        self.sha256 = sha256
+        self.task = None
 
     @Slot()
     def run(self):
-        """ダウンロードを実行する"""
+        """ダウンロードを実行する (順番待ちの間もこのスレッドで待つ)"""
         try:
-            response = requests.get(self.url, stream=True, timeout=60)
-            response.raise_for_status()
-
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded_size = 0
-            
-            # 保存先ディレクトリがなければ作成
-            os.makedirs(os.path.dirname(self.save_path), exist_ok=True)
-
-            with open(self.save_path, 'wb') as f:
-                # データを少しずつ（チャンクごと）に書き込む
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-                    downloaded_size += len(chunk)
-                    if total_size > 0:
-                        # 進捗を計算してシグナルで通知
-                        percentage = int((downloaded_size / total_size) * 100)
-                        self.progress.emit(percentage)
-            
-            # 100%を確実に通知
-            self.progress.emit(100)
-            self.finished.emit(self.save_path)
+            self.task = download_manager.submit(
+                self.url, self.save_path, sha256=self.sha256, progress=self.progress.emit
+            )
+            self.finished.emit(self.task.future.result())
+        except Exception as e:
+            self.failed.emit(str(e))
+
+    def cancel(self):
+        """ダウンロードを中断する (次回は続きから再開する)"""
+        if self.task is not None:
+            self.task.cancel()
+
+# --- バックグラウンドでインストールを行うワーカークラス ---
+class InstallWorker(QObject):
+    """インストールの各段階 (検証→展開→仮想環境→ライブラリ→起動) を別スレッドで実行するワーカー"""
+    progress = Signal(str, int, str)   # (段階, 進捗(%)、不明な場合は-1, メッセージ) を通知
+    finished = Signal(str)             # 完了時にインストール先を通知
+    failed = Signal(str)               # 失敗・キャンセル時にエラーメッセージを通知
 
+    def __init__(self, app_data, zip_path, base_dir=None):
+        super().__init__()
+        self.job = installer.InstallJob(app_data, zip_path, progress=self.progress.emit, base_dir=base_dir)
+
+    @Slot()
+    def run(self):
+        """インストールを実行する"""
+        try:
+            self.finished.emit(self.job.run())
         except Exception as e:
             self.failed.emit(str(e))
 
+    def cancel(self):
+        """インストールを中断する (途中までのファイルは削除される)"""
+        self.job.cancel()
+
+# --- カタログの変更通知を受信するワーカークラス ---
+class CatalogEventWorker(QObject):
+    """
+    サーバーからのカタログ変更イベント (SSE) を受信し続けるワーカー。
+    接続が切れた場合は待ち時間を延ばしながら再接続し、切れている間の変更は差分同期で補う。
+    """
+    event_received = Signal(dict)   # {"seq", "op", "app"} を通知
+    log_message = Signal(str)       # ログに表示するメッセージ
+
+    def __init__(self, api_client, catalog_cache, since=0):
+        super().__init__()
+        self.api_client = api_client
+        self.catalog_cache = catalog_cache
+        self.last_seq = since
+        self._stopped = False
+        self._response = None
+
+    @Slot()
+    def run(self):
+        """受信ループ"""
+        backoff = 1
+        while not self._stopped:
+            try:
+                self._response = self.api_client.open_catalog_events()
+                # 接続していなかった間の変更を取得する
+                self._catch_up()
+                backoff = 1
+                for event in self.api_client.read_catalog_events(self._response):
+                    self._emit(event)
+            except Exception as e:
+                if self._stopped:
+                    break
+                self.log_message.emit(f"更新通知の接続が切れました。{backoff}秒後に再接続します: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+            finally:
+                if self._response is not None:
+                    self._response.close()
+                    self._response = None
+
+    def stop(self):
+        """受信を停止する (受信待ちの接続を閉じて中断する)"""
+        self._stopped = True
+        if self._response is not None:
+            self._response.close()
+
+    def _catch_up(self):
+        """最後に受け取ったイベント以降の変更を、差分同期APIで取得して通知する"""
+        while True:
+            changes = self.api_client.get_app_changes(since=self.last_seq)
+            if changes is None:
+                # 差分が残っていない場合は、次回のアプリ一覧の取得に任せる
+                return
+            for app in changes["upserts"]:
+                self._emit({"seq": changes["cursor"], "op": "upsert", "app": app})
+            for app_id in changes["deletes"]:
+                self._emit({"seq": changes["cursor"], "op": "delete", "app": {"id": app_id}})
+            self.last_seq = changes["cursor"]
+            if not changes["has_more"]:
+                return
+
+    def _emit(self, event):
+        self.last_seq = max(self.last_seq, event["seq"])
+        # 次回の起動時にも反映されているよう、キャッシュにも書き込む
+        self.catalog_cache.apply_event(event)
+        self.event_received.emit(event)
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Cat-box Launcher")
         self.resize(800, 600)
 
-        self.apps_data = [] # APIから取得したアプリの全データを保持するリスト
+        # アプリ一覧のキャッシュ。一覧の表示も、選択したアプリの情報もここから読み込む
+        self.catalog_cache = CatalogCache()
+        # ダウンロード・インストール中のアプリ (アプリID -> 状態)。複数のアプリを同時に進められる
+        self.installs = {}
+        # 実行中のワーカースレッド (スレッド -> ワーカー)。終了するまで参照を保持する
+        self._worker_threads = {}
+        # サーバーとの通信。接続を使い回すクライアントを1つだけ作り、リクエストは共有のスレッドプールで実行する
+        self.api_client = ApiClient()
+        self.request_scheduler = RequestScheduler(parent=self)
+        # 一覧のアイコン。読み込みとデコードは request_scheduler のスレッドで行う
+        self.icon_loader = IconLoader(
+            self.request_scheduler, self.api_client.session, device_pixel_ratio=self.devicePixelRatioF(), parent=self
+        )
+        self.icon_loader.icon_ready.connect(self._on_icon_ready)
 
         # --- UIウィジェットのセットアップ (ステップ2-3とほぼ同じ) ---
         central_widget = QWidget()
@@ -101,10 +277,42 @@ class MainWindow(QMainWindow):
         # メインのスプリッター
         top_splitter = QSplitter(Qt.Horizontal)
 
-        # 左側: アプリ一覧
-        self.app_list_widget = QListWidget()
-        self.app_list_widget.currentItemChanged.connect(self._on_app_selection_changed) # アイテム選択時の処理を接続
-        top_splitter.addWidget(self.app_list_widget)
+        # 左側: 検索欄とアプリ一覧
+        app_list_panel = QWidget()
+        app_list_layout = QVBoxLayout(app_list_panel)
+        app_list_layout.setContentsMargins(0, 0, 0, 0)
+        self.search_line_edit = QLineEdit()
+        self.search_line_edit.setPlaceholderText("アプリを検索")
+        self.search_line_edit.setClearButtonEnabled(True)
+        self.search_line_edit.textChanged.connect(self._on_search_text_changed)
+        # 入力のたびに絞り込まないよう、入力が止まってから絞り込む
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(FILTER_DELAY_MS)
+        self.filter_timer.timeout.connect(self._apply_filter)
+
+        self.app_model = AppListModel(self.catalog_cache, icon_loader=self.icon_loader, parent=self)
+        self.app_proxy_model = AppFilterProxyModel(self)
+        self.app_proxy_model.setSourceModel(self.app_model)
+        self.app_list_view = QListView()
+        # 行の高さを揃えると、行数が多くてもスクロールのたびに全行の大きさを計算しない
+        self.app_list_view.setUniformItemSizes(True)
+        self.app_list_view.setIconSize(QSize(LIST_ICON_SIZE, LIST_ICON_SIZE))
+        self.app_list_view.setModel(self.app_proxy_model)
+        # 表示中の行が変わったら (スクロール・行の追加・絞り込み・ウィンドウの大きさの変更)、その付近のアイコンを先読みする
+        self.icon_prefetch_timer = QTimer(self)
+        self.icon_prefetch_timer.setSingleShot(True)
+        self.icon_prefetch_timer.setInterval(ICON_PREFETCH_DELAY_MS)
+        self.icon_prefetch_timer.timeout.connect(self._prefetch_icons)
+        self.app_list_view.verticalScrollBar().valueChanged.connect(self._schedule_icon_prefetch)
+        self.app_list_view.verticalScrollBar().rangeChanged.connect(self._schedule_icon_prefetch)
+        self.app_proxy_model.rowsInserted.connect(self._schedule_icon_prefetch)
+        self.app_proxy_model.layoutChanged.connect(self._schedule_icon_prefetch)
+        self.app_proxy_model.dataChanged.connect(self._schedule_icon_prefetch)
+        self.app_list_view.selectionModel().currentChanged.connect(self._on_app_selection_changed) # アイテム選択時の処理を接続
+        app_list_layout.addWidget(self.search_line_edit)
+        app_list_layout.addWidget(self.app_list_view)
+        top_splitter.addWidget(app_list_panel)
 
         # 右側: アプリ詳細
         app_details_widget = QWidget()
@@ -117,10 +325,21 @@ class MainWindow(QMainWindow):
         self.launch_button = QPushButton("起動")
         self.launch_button.setEnabled(False)
         self.launch_button.clicked.connect(self._on_launch_button_clicked)
+        # インストールの進捗 (選択中のアプリがインストール中の場合だけ表示)
+        self.install_status_label = QLabel("")
+        self.install_status_label.setWordWrap(True)
+        self.install_progress_bar = QProgressBar()
+        self.install_progress_bar.setVisible(False)
+        self.cancel_button = QPushButton("キャンセル")
+        self.cancel_button.setVisible(False)
+        self.cancel_button.clicked.connect(self._on_cancel_button_clicked)
         details_layout.addWidget(self.app_name_label)
         details_layout.addWidget(self.app_version_label)
         details_layout.addWidget(self.app_description_label)
         details_layout.addStretch()
+        details_layout.addWidget(self.install_status_label)
+        details_layout.addWidget(self.install_progress_bar)
+        details_layout.addWidget(self.cancel_button)
         details_layout.addWidget(self.launch_button)
         top_splitter.addWidget(app_details_widget)
         top_splitter.setSizes([200, 600])
@@ -137,15 +356,17 @@ class MainWindow(QMainWindow):
         main_layout.addWidget(self.log_text_edit)
 
         # --- 非同期処理のセットアップ ---
-        self.setup_api_worker()
         self.log("ランチャーを起動しました。")
+        # 前回の一覧をすぐに表示し、サーバーとの同期はバックグラウンドで行う
+        self.show_cached_apps()
+        self.setup_api_worker()
         self.fetch_apps() # ランチャー起動時にアプリ取得を開始
 
     # --- open_auth_dialog メソッドの追加 ---
     @Slot()
     def open_auth_dialog(self):
         """アカウントダイアログを開く"""
-        dialog = AuthDialog(self)
+        dialog = AuthDialog(self, api_client=self.api_client)
         # ダイアログがどのように閉じられたかによって処理を分岐することも可能
         # if dialog.exec():
         #     self.log("認証に成功しました。")
@@ -154,301 +375,421 @@ class MainWindow(QMainWindow):
         dialog.exec() # ダイアログを実行
 
     def setup_api_worker(self):
-        """ワーカースレッドとシグナル・スロットを設定する"""
-        self.thread = QThread()
-        api_client = ApiClient()
-        self.worker = ApiWorker(api_client)
-        self.worker.moveToThread(self.thread)
-
-        # シグナルとスロットを接続
-        self.worker.succeeded.connect(self._on_fetch_success)
-        self.worker.failed.connect(self._on_fetch_failure)
-        self.thread.started.connect(self.worker.fetch_app_list)
-        self.worker.succeeded.connect(self.thread.quit)
-        self.worker.failed.connect(self.thread.quit)
-        
-        # メモリリークを防ぐため、スレッド終了後にオブジェクトを削除
-        self.thread.finished.connect(self.worker.deleteLater)
-        self.thread.finished.connect(self.thread.deleteLater)
-        
+        """一覧の同期を行うワーカーと、シグナル・スロットを設定する (実行は fetch_apps で)"""
+        self.worker = ApiWorker(self.api_client, self.catalog_cache)
+        self.worker.page_synced.connect(self._on_page_synced)
+
+    def show_cached_apps(self):
+        """キャッシュに保存されているアプリ一覧の最初のページを表示する (サーバーの応答を待たない)"""
+        self.app_model.fetchMore(QModelIndex())
+        if self.app_model.rowCount():
+            elapsed_ms = (time.perf_counter() - LAUNCHER_STARTED_AT) * 1000
+            self.log(f"前回のアプリリストを表示しました。(起動から {elapsed_ms:.0f} ms)")
+
     def fetch_apps(self):
-        """アプリリストの取得を開始する"""
-        self.app_list_widget.clear()
-        self.log("アプリリストを取得中...")
-        self.thread.start()
+        """アプリリストの同期を開始する"""
+        self.log("アプリリストを同期中...")
+        self._fetch_started_at = time.perf_counter()
+        self._sync_changed = 0
+        task = self.request_scheduler.submit(self.worker.fetch_app_list)
+        task.succeeded.connect(self._on_fetch_success)
+        task.failed.connect(self._on_fetch_failure)
 
     def log(self, message):
         """ログエリアにメッセージを追記する"""
         self.log_text_edit.append(message)
 
     # --- スロット (シグナルによって呼び出されるメソッド) ---
-    @Slot(list)
-    def _on_fetch_success(self, apps):
-        """アプリ取得成功時の処理"""
-        self.log(f"正常にアプリリストを取得しました。({len(apps)}件)")
-        self.apps_data = apps
-        self.app_list_widget.clear()
-        for app_data in self.apps_data:
-            # QListWidgetItemに表示名だけでなく、辞書データ全体を関連付ける
-            item = QListWidgetItem(app_data['name'])
-            item.setData(Qt.UserRole, app_data) # UserRoleにデータを保存
-            self.app_list_widget.addItem(item)
+    @Slot(object)
+    def _on_fetch_success(self, result):
+        """アプリ一覧の同期に成功したときに、変わった分だけを一覧に反映する"""
+        self._sync_changed += sum(1 for app_data in result["upserts"] if self.app_model.upsert(app_data))
+        self._sync_changed += sum(1 for app_id in result["deletes"] if self.app_model.remove(app_id))
+        self._fetch_more_if_visible()
+        elapsed_ms = (time.perf_counter() - self._fetch_started_at) * 1000
+        total = f"全{result['count']}件、" if result["full"] else ""
+        self.log(f"アプリリストを同期しました。({total}表示中の変更 {self._sync_changed}件、{elapsed_ms:.0f} ms)")
+
+        # 以降の変更はサーバーからの通知で受け取る
+        self.start_catalog_events(self.api_client.catalog_cursor)
+        self.check_updates()
+
+    def check_updates(self):
+        """インストール済みアプリの更新確認を開始する (起動中に1回だけ)"""
+        if getattr(self, "_updates_checked", False):
+            return
+        self._updates_checked = True
+        task = self.request_scheduler.submit(self.worker.check_updates)
+        task.succeeded.connect(self._on_updates_checked)
+        task.failed.connect(self._on_update_check_failure)
+
+    @Slot(object)
+    def _on_updates_checked(self, updates):
+        """更新があるアプリをログに表示する"""
+        for update in updates:
+            self.log(f"更新があります: {update['name']} {update['version']}")
+        if updates:
+            self.log(f"{len(updates)}件のアプリに新しいバージョンがあります。")
+
+    @Slot(str)
+    def _on_update_check_failure(self, error_message):
+        self.log(f"更新の確認に失敗しました: {error_message}")
+
+    def start_catalog_events(self, since):
+        """カタログ変更通知の受信を開始する (起動中に1回だけ)"""
+        if getattr(self, "event_thread", None) is not None:
+            return
+        self.event_thread = QThread()
+        # 受信中は接続を1本使い続けるので、一覧の同期などとは別のクライアント (接続) を使う
+        self.event_worker = CatalogEventWorker(ApiClient(), self.catalog_cache, since)
+        self.event_worker.moveToThread(self.event_thread)
+        self.event_thread.started.connect(self.event_worker.run)
+        self.event_worker.event_received.connect(self._on_catalog_event)
+        self.event_worker.log_message.connect(self.log)
+        self.event_thread.start()
+
+    def closeEvent(self, event):
+        """ウィンドウを閉じるときに、通知の受信スレッドと、実行中のダウンロード・インストールを止める"""
+        if getattr(self, "event_thread", None) is not None:
+            self.event_worker.stop()
+            self.event_thread.quit()
+            self.event_thread.wait(2000)
+        # インストールは中断してロールバックし、ダウンロードは次回の起動時に続きから再開する
+        for state in self.installs.values():
+            state["cancelled"] = True
+            state["worker"].cancel()
+        self.icon_loader.shutdown()
+        self.request_scheduler.shutdown()
+        download_manager.shutdown()
+        zygote_pool.shutdown()
+        for thread in list(self._worker_threads):
+            thread.wait(5000)
+        super().closeEvent(event)
+
+    @Slot(int, object)
+    def _on_page_synced(self, after_id, last_id):
+        """一覧全体の取得中に、置き換えられた範囲のうち表示中の行だけを更新する"""
+        self._sync_changed += self.app_model.reload_range(after_id, last_id)
+        self._fetch_more_if_visible()
+
+    def _fetch_more_if_visible(self):
+        """
+        一覧の最後の行が見えていて、キャッシュにまだ続きがあれば読み込む。
+        (新しいアプリが届いても、ビューは次にスクロールされるまで fetchMore を呼ばないため)
+        """
+        root = QModelIndex()
+        if not self.app_proxy_model.canFetchMore(root):
+            return
+        last_row = self.app_proxy_model.rowCount() - 1
+        if last_row < 0 or self.app_list_view.viewport().rect().intersects(
+                self.app_list_view.visualRect(self.app_proxy_model.index(last_row, 0))):
+            self.app_proxy_model.fetchMore(root)
+
+    def _schedule_icon_prefetch(self, *args):
+        # シグナルの引数は使わない (QTimer.start に渡すと、待ち時間として扱われてしまう)
+        self.icon_prefetch_timer.start()
+
+    def _prefetch_icons(self):
+        """表示中の行と、その前後 ICON_PREFETCH_MARGIN 行のアイコンを読み込む (表示中の行から先に)"""
+        row_count = self.app_proxy_model.rowCount()
+        if not row_count:
+            return
+        viewport = self.app_list_view.viewport()
+        first = max(self.app_list_view.indexAt(QPoint(0, 0)).row(), 0)
+        last = self.app_list_view.indexAt(QPoint(0, viewport.height() - 1)).row()
+        if last < 0:
+            last = row_count - 1
+        below = range(last + 1, min(last + ICON_PREFETCH_MARGIN, row_count - 1) + 1)
+        above = range(first - 1, max(first - ICON_PREFETCH_MARGIN, 0) - 1, -1)
+        urls = []
+        for row in [*range(first, last + 1), *below, *above]:
+            source_row = self.app_proxy_model.mapToSource(self.app_proxy_model.index(row, 0)).row()
+            urls.append(self.app_model.icon_url(source_row))
+        self.icon_loader.prefetch(urls)
+
+    @Slot(str)
+    def _on_icon_ready(self, url):
+        """
+        アイコンを読み込んだら一覧を描き直す。
+        (同じアイコンの行を探して dataChanged を送る代わりに、見えている範囲だけを描き直す。
+         続けて届いても、描き直しは Qt がまとめて1回にする)
+        """
+        self.app_list_view.viewport().update()
+
+    @Slot(dict)
+    def _on_catalog_event(self, event):
+        """カタログ変更通知を受け取ったときに、一覧の該当アプリだけを更新する"""
+        # 受信スレッドがキャッシュに反映 (保存済みの情報にマージ) したものを使う
+        app_data = event["app"]
+        if event["op"] != "delete":
+            app_data = self.catalog_cache.get(app_data["id"]) or app_data
+        row = self.app_model.row_for_id(app_data["id"])
+
+        if event["op"] == "delete":
+            if row is not None:
+                name = self.app_model.index(row).data()
+                self.app_model.remove(app_data["id"])
+                self.log(f"'{name}' が公開停止になりました。")
+            return
+
+        self.app_model.upsert(app_data)
+        self._fetch_more_if_visible()
+        if row is None:
+            self.log(f"新しいアプリ '{app_data['name']}' が追加されました。")
+        else:
+            self.log(f"'{app_data['name']}' が v{app_data['version']} に更新されました。")
+        if app_data["id"] == self._current_app_id():
+            self._show_app_details(self._current_app())
 
     @Slot(str)
     def _on_fetch_failure(self, error_message):
         """アプリ取得失敗時の処理"""
         self.log(f"エラー: {error_message}")
 
-    @Slot(QListWidgetItem)
-    def _on_app_selection_changed(self, current_item):
+    @Slot(QModelIndex, QModelIndex)
+    def _on_app_selection_changed(self, current, previous):
         """アプリ一覧で選択項目が変わった時の処理"""
-        if not current_item:
+        app_data = self._current_app()
+        if app_data is None:
+            return
+        self._show_app_details(app_data)
+        self._refresh_install_status()
+        # 起動ボタンが押される前に、インストール済みのアプリの zygote を用意しておく
+        installer.prewarm_app(installer.app_install_dir(app_data['name'], app_data['version']))
+
+    def _show_app_details(self, app_data):
+        """右側にアプリの詳細を表示する"""
+        if app_data is None:
             return
-
-        # アイテムに保存しておいたアプリデータを取得
-        app_data = current_item.data(Qt.UserRole)
         self.app_name_label.setText(f"アプリ名: {app_data.get('name', 'N/A')}")
         self.app_version_label.setText(f"バージョン: {app_data.get('version', 'N/A')}")
         self.app_description_label.setText(f"説明: {app_data.get('description', 'N/A')}")
-        self.launch_button.setEnabled(True)
-        
+
+    def _current_app_id(self):
+        """選択中のアプリのID。選択されていなければNone"""
+        index = self.app_list_view.currentIndex()
+        return index.data(AppIdRole) if index.isValid() else None
+
+    def _current_app(self):
+        """選択中のアプリの情報 (一覧には名前とバージョンしかないので、キャッシュから読み込む)"""
+        app_id = self._current_app_id()
+        return self.catalog_cache.get(app_id) if app_id is not None else None
+
+    @Slot(str)
+    def _on_search_text_changed(self, text):
+        self.filter_timer.start()
+
     @Slot()
+    def _apply_filter(self):
+        """検索欄の文字列で一覧を絞り込む (読み込み済みの行が対象。足りなければビューが続きを読み込む)"""
+        self.app_proxy_model.set_filter_text(self.search_line_edit.text())
+        self._fetch_more_if_visible()
+
+    def _refresh_install_status(self):
+        """選択中のアプリのインストール状況に合わせて、進捗とボタンの表示を更新する"""
+        app_id = self._current_app_id()
+        state = self.installs.get(app_id) if app_id is not None else None
+        installing = state is not None
+        self.launch_button.setEnabled(app_id is not None and not installing)
+        self.cancel_button.setVisible(installing)
+        self.install_progress_bar.setVisible(installing)
+        self.install_status_label.setText(state["status"] if installing else "")
+        if installing:
+            if state["percent"] < 0:
+                # 進捗が分からない段階 (pip など) は、動いていることだけを表示する
+                self.install_progress_bar.setRange(0, 0)
+            else:
+                self.install_progress_bar.setRange(0, 100)
+                self.install_progress_bar.setValue(state["percent"])
+
     @Slot()
     def _on_launch_button_clicked(self):
         """「起動」ボタンが押されたときのメインロジック"""
-        current_item = self.app_list_widget.currentItem()
-        if not current_item:
+        app_data = self._current_app()
+        if app_data is None:
             return
 
-        app_data = current_item.data(Qt.UserRole)
         app_name = app_data['name']
-        app_version = app_data['version']
-        
-        # 実行すべきアプリのパスを決定
-        base_dir = os.path.join(os.getenv('APPDATA'), 'Cat-box', 'apps')
-        app_dir = os.path.join(base_dir, app_name, app_version)
-        entry_point_relative = os.path.join('dummy_app', 'run.py') # zipの中の構造に依存
-        executable_path = os.path.join(app_dir, entry_point_relative)
-
-        # 既に展開済みのアプリが存在するかチェック
-        if os.path.exists(executable_path):
+        if app_data.get('id') in self.installs:
+            return
+
+        # インストール済み (すべての段階が完了している) なら、そのまま起動する
+        app_dir = installer.app_install_dir(app_name, app_data['version'])
+        if installer.is_installed(app_dir):
             self.log(f"'{app_name}' は既に存在します。直接起動します。")
             try:
-                # 存在するアプリを直接実行
-                creationflags = 0
-                if sys.platform == "win32":
-                    creationflags = subprocess.CREATE_NEW_CONSOLE
-                subprocess.Popen([sys.executable, executable_path, app_name], creationflags=creationflags)
+                installer.launch_app(app_dir, app_name)
             except Exception as e:
                 self.log(f"既存アプリの起動中にエラー: {e}")
-        else:
-            # 存在しない場合はダウンロードを開始
-            self.log(f"'{app_name}' が見つかりません。ダウンロードを開始します。")
-            download_url = app_data.get('download_url')
-            if not download_url:
-                self.log("エラー: このアプリにはダウンロードURLがありません。")
-                return
-            self._start_download(app_data)
-    def _start_download(self, app_data):
-        """ダウンロードスレッドを開始する"""
+            return
+
+        # 存在しない場合はダウンロードを開始
+        self.log(f"'{app_name}' が見つかりません。ダウンロードを開始します。")
+        if not app_data.get('download_url'):
+            self.log("エラー: このアプリにはダウンロードURLがありません。")
+            return
+        self._start_download(app_data)
+
+    @Slot()
+    def _on_cancel_button_clicked(self):
+        """選択中のアプリのダウンロード・インストールを中断する"""
+        state = self.installs.get(self._current_app_id())
+        if state is not None:
+            self.log(f"'{state['app']['name']}' をキャンセルしています...")
+            state["cancelled"] = True
+            state["worker"].cancel()
+
+    def _start_worker(self, worker):
+        """ワーカーを専用のスレッドで実行する。終了したらスレッドとワーカーを破棄する"""
+        thread = QThread()
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.finished.connect(thread.quit)
+        worker.failed.connect(thread.quit)
+        thread.finished.connect(self._on_worker_thread_finished)
+        self._worker_threads[thread] = worker
+        thread.start()
+
+    @Slot()
+    def _on_worker_thread_finished(self):
+        self._worker_threads.pop(self.sender(), None)
+
+    def _state_for_sender(self):
+        """シグナルを送ったワーカーに対応するインストール状態を探す"""
+        worker = self.sender()
+        for state in self.installs.values():
+            if state["worker"] is worker:
+                return state
+        return None
+
+    def _start_download(self, app_data, use_delta=True):
+        """
+        ダウンロードスレッドを開始する。
+        :param use_delta: 別のバージョンがインストール済みなら、差分パッケージだけをダウンロードする
+        """
         download_url = app_data['download_url']
         app_name = app_data['name']
-        
+
         # 一時的な保存先パスを決定
         # APPDATA環境変数を使い、安全な場所に保存する
         temp_dir = os.path.join(os.getenv('APPDATA'), 'Cat-box', 'temp')
         save_path = os.path.join(temp_dir, os.path.basename(download_url))
+        sha256 = app_data.get('package_sha256')
+
+        delta_base = installer.find_delta_base(app_data) if use_delta else None
+        if delta_base is not None:
+            base_dir, base_sha256 = delta_base
+            download_url = installer.delta_url(download_url, base_sha256, sha256)
+            save_path = os.path.join(temp_dir, f"{base_sha256}-{sha256}.zip")
+            # 差分パッケージ自体のSHA-256は分からないので、展開後にマニフェストで検証する
+            sha256 = None
+            self.log(f"'{app_name}' の差分をダウンロードします。(元のバージョン: {os.path.basename(base_dir)})")
 
         self.log(f"'{app_name}'のダウンロードを開始します...")
         self.log(f"URL: {download_url}")
         self.log(f"保存先: {save_path}")
 
-        # UIをロックして二重クリックなどを防ぐ
-        self.launch_button.setEnabled(False)
-
-        self.download_thread = QThread()
-        self.download_worker = DownloadWorker(download_url, save_path)
-        self.download_worker.moveToThread(self.download_thread)
-
-        # シグナルとスロットを接続
-        self.download_thread.started.connect(self.download_worker.run)
-        self.download_worker.progress.connect(self.on_download_progress)
-        self.download_worker.failed.connect(self.on_download_failed)
-        self.download_worker.finished.connect(self.on_download_finished)
-
-        # スレッドが終了したらクリーンアップ
-        self.download_worker.finished.connect(self.download_thread.quit)
-        self.download_worker.failed.connect(self.download_thread.quit)
-        self.download_thread.finished.connect(self.download_worker.deleteLater)
-        self.download_thread.finished.connect(self.download_thread.deleteLater)
-        
-        self.download_thread.start()
+        worker = DownloadWorker(download_url, save_path, sha256=sha256)
+        worker.progress.connect(self.on_download_progress)
+        worker.failed.connect(self.on_download_failed)
+        worker.finished.connect(self.on_download_finished)
+        self.installs[app_data['id']] = {
+            "app": app_data, "worker": worker, "status": "ダウンロードの順番を待っています...",
+            "percent": 0, "last_step": None, "delta_base": delta_base[0] if delta_base else None,
+        }
+        self._start_worker(worker)
+        self._refresh_install_status()
 
     # --- ダウンロード関連のスロット ---
-    @Slot(int)
-    def on_download_progress(self, percentage):
+    @Slot(object, object)
+    def on_download_progress(self, downloaded, total):
         """ダウンロード進捗の更新"""
-        # ログが流れすぎないように、10%ごとか100%の時だけ表示
-        if percentage % 10 == 0 or percentage == 100:
-            self.log(f"ダウンロード中... {percentage}%")
+        state = self._state_for_sender()
+        if state is None or not total:
+            return
+        percentage = downloaded * 100 // total
+        state["percent"] = percentage
+        state["status"] = f"ダウンロード中... {downloaded / 1024 / 1024:.1f} / {total / 1024 / 1024:.1f} MB"
+        # ログが流れすぎないように、10%ごとに表示
+        step = percentage // 10 * 10
+        if step != state["last_step"]:
+            state["last_step"] = step
+            self.log(f"'{state['app']['name']}' をダウンロード中... {step}%")
+        self._refresh_install_status()
 
     @Slot(str)
     def on_download_failed(self, error_message):
         """ダウンロード失敗時の処理"""
-        self.log(f"ダウンロード失敗: {error_message}")
-        self.launch_button.setEnabled(True) # ボタンを再度有効化
+        state = self._state_for_sender()
+        if state is None:
+            return
+        self.log(f"'{state['app']['name']}' のダウンロード失敗: {error_message}")
+        self.installs.pop(state["app"]["id"], None)
+        self._fall_back_to_full_download(state)
+        self._refresh_install_status()
 
     @Slot(str)
     def on_download_finished(self, file_path):
-        """ダウンロード完了時の処理"""
-        self.log(f"ダウンロード完了: {file_path}")
-        
-        current_item = self.app_list_widget.currentItem()
-        if not current_item:
-            self.log("エラー: アプリ情報が見つかりません。")
-            self.launch_button.setEnabled(True)
+        """ダウンロード完了時の処理。続けてインストールを別スレッドで開始する"""
+        state = self._state_for_sender()
+        if state is None:
             return
+        self.log(f"ダウンロード完了: {file_path}")
 
-        app_data = current_item.data(Qt.UserRole)
-        
-        try:
-            # zipファイルを展開し、実行する
-            self._unzip_and_execute(file_path, app_data)
-        except Exception as e:
-            self.log(f"アプリの展開または実行中にエラー: {e}")
-        finally:
-            # 成功・失敗にかかわらずボタンを再度有効化
-            self.launch_button.setEnabled(True)
-        
-        # 次のステップ: ここでzip展開と実行を行う
-        self.log("次のステップで、このファイルを展開・実行します。")
-
-    # MainWindowクラスの中に追加
-    # 古い _unzip_and_execute をこれで置き換える
-    def _unzip_and_execute(self, zip_path, app_data):
-        """zipファイルを展開し、専用の仮想環境を構築してアプリを実行する"""
-        app_name = app_data['name']
-        app_version = app_data['version']
-
-        # 1. アプリケーションデータディレクトリを決定
-        base_dir = os.path.join(os.getenv('APPDATA'), 'Cat-box', 'apps')
-        app_dir = os.path.join(base_dir, app_name, app_version)
-        
-        self.log(f"'{app_name}' を '{app_dir}' に展開します...")
-        os.makedirs(app_dir, exist_ok=True)
-
-        # 2. Zipファイルを展開
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(app_dir)
-        self.log("展開が完了しました。")
-
-        # 3. 専用の仮想環境(venv)を構築 (ステップ3-5の核心)
-        venv_dir = os.path.join(app_dir, '.venv')
-        self.log(f"専用の仮想環境を '{venv_dir}' に作成します...")
-        try:
-            # venv.create(venv_dir, with_pip=True)
-            # 上記はブロッキングなので、subprocessで非同期に実行する方がUIに優しい
-            # ここではシンプルさのためにブロッキングで実装するが、将来的にはこれもスレッド化の候補
-            venv.create(venv_dir, with_pip=True)
-            self.log("仮想環境の作成が完了しました。")
-        except Exception as e:
-            self.log(f"仮想環境の作成に失敗しました: {e}")
-            raise
-
-        # 4. 依存ライブラリをインストール
-        requirements_path = os.path.join(app_dir, 'dummy_app', 'requirements.txt') # zip内の構造に依存
-        
-        # OSによってpipとpythonのパスが異なるため、パスを正しく解決
-        if sys.platform == "win32":
-            pip_executable = os.path.join(venv_dir, 'Scripts', 'pip.exe')
-            python_executable = os.path.join(venv_dir, 'Scripts', 'python.exe')
-        else: # macOS, Linux
-            pip_executable = os.path.join(venv_dir, 'bin', 'pip')
-            python_executable = os.path.join(venv_dir, 'bin', 'python')
-
-        if os.path.exists(requirements_path):
-            self.log(f"'requirements.txt' に基づいてライブラリをインストールします...")
-            try:
-                # subprocess.runで同期的にコマンドを実行し、完了を待つ
-                result = subprocess.run(
-                    [pip_executable, 'install', '-r', requirements_path],
-                    capture_output=True, text=True, check=True
-                )
-                self.log("ライブラリのインストールが完了しました。")
-                # 詳細なログが必要な場合は以下を有効化
-                # self.log(f"pip output:\n{result.stdout}")
-            except subprocess.CalledProcessError as e:
-                self.log(f"ライブラリのインストールに失敗しました。")
-                self.log(f"pip error:\n{e.stderr}")
-                raise
+        worker = InstallWorker(state["app"], file_path, base_dir=state["delta_base"])
+        worker.progress.connect(self.on_install_progress)
+        worker.failed.connect(self.on_install_failed)
+        worker.finished.connect(self.on_install_finished)
+        state.update(worker=worker, status="インストールを開始します...", percent=0)
+        self._start_worker(worker)
+        self._refresh_install_status()
+
+    # --- インストール関連のスロット ---
+    @Slot(str, int, str)
+    def on_install_progress(self, stage, percent, message):
+        """インストールの各段階の進捗の更新"""
+        state = self._state_for_sender()
+        if state is None:
+            return
+        label = installer.STAGE_LABELS[stage]
+        state["percent"] = percent
+        if percent < 0:
+            # pip などの出力は、最新の1行だけを表示する
+            state["status"] = f"{label}中... {message}"
         else:
-            self.log("'requirements.txt' が見つかりませんでした。スキップします。")
-
-        # 5. アプリの実行
-        entry_point_relative = os.path.join('dummy_app', 'run.py')
-        executable_path = os.path.join(app_dir, entry_point_relative)
-        self.log(f"'{executable_path}' を実行します...")
+            state["status"] = f"{label}中... {percent}%"
+            if message:
+                self.log(f"'{state['app']['name']}': {message}")
+        self._refresh_install_status()
 
-        if not os.path.exists(executable_path):
-            self.log(f"エラー: 実行ファイルが見つかりません: {executable_path}")
+    @Slot(str)
+    def on_install_failed(self, error_message):
+        """インストール失敗時の処理 (途中までのファイルは削除済み)"""
+        state = self._state_for_sender()
+        if state is None:
             return
-        
-        try:
-            creationflags = 0
-            if sys.platform == "win32":
-                creationflags = subprocess.CREATE_NEW_CONSOLE
-            
-            # 【重要】作成した仮想環境のPythonを使ってスクリプトを実行する
-            subprocess.Popen([python_executable, executable_path, app_name], creationflags=creationflags)
-            self.log(f"'{app_name}' のプロセスを起動しました。")
-        except Exception as e:
-            self.log(f"アプリの起動中に予期せぬエラーが発生しました: {e}")
-            raise
-        """zipファイルを展開し、アプリを実行する"""
-        app_name = app_data['name']
-        app_version = app_data['version']
-
-        # 1. アプリケーションデータディレクトリを決定 (ステップ3-5)
-        # APPDATA/Cat-box/apps/アプリ名/バージョン/
-        base_dir = os.path.join(os.getenv('APPDATA'), 'Cat-box', 'apps')
-        app_dir = os.path.join(base_dir, app_name, app_version)
-        
-        self.log(f"'{app_name}' を '{app_dir}' に展開します...")
-        os.makedirs(app_dir, exist_ok=True)
-
-        # 2. Zipファイルを展開 (ステップ3-6)
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(app_dir)
-        
-        self.log("展開が完了しました。")
-
-        # 3. 実行ロジック (ステップ3-6)
-        # 【重要】zipファイル内のどのファイルを実行するかを決める必要がある
-        # 今回は、zipを展開した直下にある 'run.py' を実行するルールとする
-        # dummy_app.zipを展開すると、'dummy_app'フォルダができるので、その中の'run.py'を指定
-        entry_point_relative = os.path.join('dummy_app', 'run.py')
-        executable_path = os.path.join(app_dir, entry_point_relative)
-
-        self.log(f"実行ファイルパス: {executable_path}")
-
-        if not os.path.exists(executable_path):
-            self.log(f"エラー: 実行ファイルが見つかりません: {executable_path}")
+        self.log(f"'{state['app']['name']}' のインストールを中止しました: {error_message}")
+        self.installs.pop(state["app"]["id"], None)
+        self._fall_back_to_full_download(state)
+        self._refresh_install_status()
+
+    def _fall_back_to_full_download(self, state):
+        """差分パッケージでの更新に失敗した場合は、パッケージ全体をダウンロードし直す (キャンセル時を除く)"""
+        if state["delta_base"] is None or state.get("cancelled"):
             return
+        self.log(f"'{state['app']['name']}' の差分を適用できなかったため、パッケージ全体をダウンロードします。")
+        self._start_download(state["app"], use_delta=False)
+
+    @Slot(str)
+    def on_install_finished(self, app_dir):
+        """インストール完了時の処理"""
+        state = self._state_for_sender()
+        if state is None:
+            return
+        self.log(f"'{state['app']['name']}' のインストールが完了しました: {app_dir}")
+        self.installs.pop(state["app"]["id"], None)
+        self._refresh_install_status()
 
-        try:
-            self.log(f"'{app_name}' を起動します...")
-            
-            creationflags = 0
-            if sys.platform == "win32":
-                creationflags = subprocess.CREATE_NEW_CONSOLE
-
-            # 展開されたアプリを実行する
-            subprocess.Popen([sys.executable, executable_path, app_name], creationflags=creationflags)
-            
-            self.log(f"'{app_name}' のプロセスを起動しました。")
-        except Exception as e:
-            self.log(f"アプリの起動中に予期せぬエラーが発生しました: {e}")
-            raise # エラーを呼び出し元に伝播させる
 def main():
     app = QApplication(sys.argv)
     window = MainWindow()
@@ -0,0 +1,103 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Optional, Set
+
+from PySide6.QtCore import QObject, Signal, Slot
+
+from http_client import POOL_MAXSIZE
+
+# --- 通信の実行 ---
+# サーバーへのリクエスト (アプリ一覧の同期、アイコン、更新確認など) を、共有のスレッドプールで並行に実行し、
+# 結果を Qt のシグナルで画面側 (メインスレッド) に届ける。リクエストごとに QThread とワーカーを作らずに済む。
+#
+# 結果はメインスレッドで RequestTask の succeeded / failed として通知するので、
+# 接続先のスロットでそのままウィジェットを操作してよい。
+# スレッド数は、共有セッションの接続数 (http_client.POOL_MAXSIZE) と揃える。
+REQUEST_WORKERS = POOL_MAXSIZE
+
+
+class RequestTask(QObject):
+    """
+    RequestScheduler.submit で実行を予約したリクエスト。
+    終わったら、成功なら succeeded に戻り値を、失敗なら failed にエラーメッセージを渡す (メインスレッドで)。
+    """
+    succeeded = Signal(object)
+    failed = Signal(str)
+    # (プールのスレッドから) 実行結果を RequestScheduler に渡す
+    _completed = Signal(bool, object)
+
+    def __init__(self, name: str, parent=None):
+        super().__init__(parent)
+        self.name = name
+        self.cancelled = False
+        self.future: Optional[Future] = None
+
+    def cancel(self):
+        """結果を通知しないようにする。まだ始まっていなければ実行もしない"""
+        self.cancelled = True
+        if self.future is not None:
+            self.future.cancel()
+
+
+class RequestScheduler(QObject):
+    """
+    リクエストを共有のスレッドプールで実行する。メインスレッドで作成し、メインスレッドから submit する。
+
+    :param max_workers: 同時に実行するリクエストの数
+    """
+
+    def __init__(self, max_workers: int = REQUEST_WORKERS, parent=None):
+        super().__init__(parent)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="catbox-request")
+        # 結果を通知するまで、RequestTask の参照を保持する
+        self._tasks: Set[RequestTask] = set()
+
+    def submit(self, fn: Callable, *args, name: Optional[str] = None, **kwargs) -> RequestTask:
+        """
+        fn(*args, **kwargs) をプールのスレッドで実行する。
+        fn は戻り値を返すか、失敗したら例外を送出する (途中経過を通知したい場合は、fn の中からシグナルを送る)。
+        :param name: ログなどに使うリクエストの名前
+        :return: 結果を通知する RequestTask (シグナルは返されたあとに接続してよい)
+        """
+        task = RequestTask(name or getattr(fn, "__name__", "request"))
+        task._completed.connect(self._on_task_completed)
+        self._tasks.add(task)
+        task.future = self._executor.submit(self._run, task, fn, args, kwargs)
+        task.future.add_done_callback(partial(self._on_future_done, task))
+        return task
+
+    def shutdown(self):
+        """待っているリクエストを取り消す (実行中のリクエストは、終わるのを待たない)"""
+        for task in list(self._tasks):
+            task.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _run(task: RequestTask, fn: Callable, args, kwargs):
+        """(プールのスレッドで実行)"""
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            task._completed.emit(False, str(e))
+        else:
+            task._completed.emit(True, result)
+
+    @staticmethod
+    def _on_future_done(task: RequestTask, future: Future):
+        # 始まる前に取り消された場合は _run が呼ばれないので、ここで片付ける
+        if future.cancelled():
+            task._completed.emit(False, None)
+
+    @Slot(bool, object)
+    def _on_task_completed(self, ok, value):
+        """(メインスレッドで実行) 結果を通知し、参照を手放す"""
+        task = self.sender()
+        if task not in self._tasks:
+            return
+        self._tasks.discard(task)
+        if not task.cancelled:
+            if ok:
+                task.succeeded.emit(value)
+            else:
+                task.failed.emit(value)
+        task.deleteLater()
@@ -0,0 +1,194 @@
+import glob
+import html
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List
+
+from download_manager import file_sha256
+
+# --- ライブラリ (wheel) のローカルキャッシュ ---
+# アプリごとに requirements.txt が違っても、よく使われるライブラリは共通していることが多い。
+# インストール中にダウンロード・ビルドした wheel を APPDATA/Cat-box/wheels/ に保存しておき、
+# 次からのインストールでは、まずこのキャッシュだけで (--no-index で) インストールを試みる。
+# すべて揃っていれば、ネットワークにつながっていなくても、ビルドし直すこともなくインストールできる。
+#
+# wheel は内容のSHA-256ごとのディレクトリ (blobs/<sha256>/<ファイル名>) に保存し、
+# pip には一覧の index.html を --find-links で渡す (リンクに #sha256= を付けるので、pip が内容を検証する)。
+# キャッシュ全体が WHEEL_CACHE_MAX_SIZE を超えたら、最後に使った時刻の古い wheel から削除する。
+WHEELS_DIR = os.path.join(os.getenv('APPDATA', os.path.expanduser('~')), 'Cat-box', 'wheels')
+WHEEL_CACHE_MAX_SIZE = 2 * 1024 * 1024 * 1024
+INDEX_JSON = 'index.json'
+INDEX_HTML = 'index.html'
+
+PIP_INSTALL = ['-m', 'pip', 'install', '--disable-pip-version-check']
+PIP_WHEEL = ['-m', 'pip', 'wheel', '--disable-pip-version-check']
+
+# (コマンド, check) -> 終了コード。check=True の場合は失敗時に例外を送出する
+RunProcess = Callable[..., int]
+
+
+def _normalize_name(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def _wheel_name_version(filename: str):
+    """wheel のファイル名 (name-version-...-tag.whl) からパッケージ名とバージョンを取り出す"""
+    parts = filename[:-len(".whl")].split("-")
+    return _normalize_name(parts[0]), parts[1]
+
+
+def installed_distributions(env_dir: str) -> set:
+    """仮想環境にインストールされているパッケージの (名前, バージョン) の集合 (*.dist-info から読む)"""
+    patterns = [
+        os.path.join(env_dir, 'lib', 'python*', 'site-packages', '*.dist-info'),
+        os.path.join(env_dir, 'Lib', 'site-packages', '*.dist-info'),
+    ]
+    result = set()
+    for pattern in patterns:
+        for path in glob.glob(pattern):
+            name, _, version = os.path.basename(path)[:-len(".dist-info")].rpartition("-")
+            result.add((_normalize_name(name), version))
+    return result
+
+
+class WheelCache:
+    """
+    インストールで使った wheel を保存し、次回以降のインストールで再利用する。
+
+    :param cache_dir: キャッシュのディレクトリ
+    :param max_size: キャッシュ全体のサイズの上限 (バイト)
+    """
+
+    def __init__(self, cache_dir: str = WHEELS_DIR, max_size: int = WHEEL_CACHE_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.index_path = os.path.join(cache_dir, INDEX_HTML)
+        self._lock = threading.Lock()
+        # 実行中のインストールの数。0のときだけ wheel を削除する (使用中の index.html から消さないため)
+        self._active = 0
+
+    def install(self, run: RunProcess, python: str, env_dir: str, requirements_path: str) -> bool:
+        """
+        requirements.txt のライブラリを、キャッシュを使って仮想環境にインストールする。
+        :param run: コマンドを実行する関数
+        :param python: 仮想環境のPython
+        :param env_dir: 仮想環境のディレクトリ (使った wheel を記録するため)
+        :return: キャッシュだけでインストールできた (ネットワークを使わなかった) 場合はTrue
+        """
+        with self._lock:
+            self._active += 1
+        try:
+            if os.path.exists(self.index_path):
+                returncode = run(
+                    [python, *PIP_INSTALL, '--no-index', '--find-links', self.index_path, '-r', requirements_path],
+                    check=False,
+                )
+                if returncode == 0:
+                    self.touch(installed_distributions(env_dir))
+                    return True
+
+            # 足りない wheel をダウンロード・ビルドしてキャッシュに加えてから、キャッシュだけでインストールする
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with tempfile.TemporaryDirectory(prefix="build-", dir=self.cache_dir) as wheel_dir:
+                args = [python, *PIP_WHEEL, '--wheel-dir', wheel_dir, '-r', requirements_path]
+                if os.path.exists(self.index_path):
+                    args[-2:-2] = ['--find-links', self.index_path]
+                run(args)
+                self.add_directory(wheel_dir)
+            run([python, *PIP_INSTALL, '--no-index', '--find-links', self.index_path, '-r', requirements_path])
+            self.touch(installed_distributions(env_dir))
+            return False
+        finally:
+            with self._lock:
+                self._active -= 1
+            self.evict()
+
+    def add_directory(self, wheel_dir: str):
+        """ディレクトリ内の wheel をキャッシュに加える (同じ内容の wheel は1つだけ保存する)"""
+        with self._lock:
+            index = self._load_index()
+            now = time.time()
+            for filename in os.listdir(wheel_dir):
+                if not filename.endswith(".whl"):
+                    continue
+                path = os.path.join(wheel_dir, filename)
+                digest = file_sha256(path)
+                entry = index.get(digest)
+                if entry is None:
+                    blob_dir = os.path.join(self.cache_dir, "blobs", digest)
+                    os.makedirs(blob_dir, exist_ok=True)
+                    shutil.move(path, os.path.join(blob_dir, filename))
+                    name, version = _wheel_name_version(filename)
+                    entry = index[digest] = {
+                        "filename": filename, "name": name, "version": version,
+                        "size": os.path.getsize(os.path.join(blob_dir, filename)),
+                    }
+                entry["last_used"] = now
+            self._save_index(index)
+
+    def touch(self, distributions: set):
+        """インストールされたパッケージに対応する wheel の最終使用時刻を更新する (LRU用)"""
+        with self._lock:
+            index = self._load_index()
+            now = time.time()
+            for entry in index.values():
+                if (entry["name"], entry["version"]) in distributions:
+                    entry["last_used"] = now
+            self._save_index(index)
+
+    def evict(self) -> List[str]:
+        """
+        キャッシュが上限を超えていれば、最後に使った時刻の古い wheel から削除する。
+        :return: 削除した wheel のファイル名
+        """
+        removed = []
+        with self._lock:
+            if self._active:
+                return removed
+            index = self._load_index()
+            total = sum(entry["size"] for entry in index.values())
+            for digest, entry in sorted(index.items(), key=lambda item: item[1].get("last_used", 0)):
+                if total <= self.max_size:
+                    break
+                shutil.rmtree(os.path.join(self.cache_dir, "blobs", digest), ignore_errors=True)
+                total -= entry["size"]
+                removed.append(entry["filename"])
+                del index[digest]
+            if removed:
+                self._save_index(index)
+        return removed
+
+    def size(self) -> int:
+        return sum(entry["size"] for entry in self._load_index().values())
+
+    # --- index.json と index.html ---
+    def _load_index(self) -> Dict[str, dict]:
+        try:
+            with open(os.path.join(self.cache_dir, INDEX_JSON), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self, index: Dict[str, dict]):
+        """一覧を保存し、pip の --find-links 用の index.html も作り直す"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        links = [
+            f'<a href="blobs/{digest}/{html.escape(entry["filename"])}#sha256={digest}">'
+            f'{html.escape(entry["filename"])}</a><br>'
+            for digest, entry in sorted(index.items(), key=lambda item: item[1]["filename"])
+        ]
+        page = "<!DOCTYPE html>\n<html><body>\n" + "\n".join(links) + "\n</body></html>\n"
+        for name, content in ((INDEX_JSON, json.dumps(index, ensure_ascii=False, indent=1)), (INDEX_HTML, page)):
+            path = os.path.join(self.cache_dir, name)
+            temp_path = f"{path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(temp_path, path)
+
+
+wheel_cache = WheelCache()
@@ -0,0 +1,267 @@
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# --- アプリ起動の高速化 (zygote) ---
+# アプリを起動するたびに仮想環境のPythonを新しく起動すると、重いライブラリ (PySide6 など) の
+# import に毎回数秒かかる。アプリが事前にimportしてほしいモジュールを宣言している場合は、
+# 仮想環境ごとにそれらをimport済みの常駐プロセス (zygote_server.py) を用意しておき、
+# 起動のたびにそこから fork して、argv・カレントディレクトリ・標準入出力だけを設定して実行する。
+#
+# fork を使うため Linux でのみ有効。CATBOX_ZYGOTE=0 で無効にでき、無効な場合や
+# zygote が使えない場合は、これまでどおり subprocess.Popen で起動する。
+# しばらく使われていない zygote (ZYGOTE_IDLE_TIMEOUT 秒) は終了させる。
+ZYGOTE_ENABLED = sys.platform.startswith("linux") and os.getenv("CATBOX_ZYGOTE", "1") != "0"
+ZYGOTE_IDLE_TIMEOUT = float(os.getenv("CATBOX_ZYGOTE_IDLE_TIMEOUT", "600"))
+# zygote のimportが終わるまで待つ時間の上限 (秒)
+ZYGOTE_READY_TIMEOUT = 60
+ZYGOTE_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "zygote_server.py")
+MAX_MESSAGE_SIZE = 64 * 1024
+
+
+class ZygoteError(Exception):
+    """zygote からアプリを起動できなかった場合の例外 (呼び出し元は通常の起動に切り替える)"""
+
+
+class ZygoteProcess:
+    """
+    zygote から起動したアプリのプロセス。
+    ランチャーの子プロセスではないので終了コードは取得できず、subprocess.Popen の一部だけを持つ。
+    """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+
+    def poll(self) -> Optional[int]:
+        """実行中ならNone、終了していれば0を返す"""
+        try:
+            os.kill(self.pid, 0)
+        except ProcessLookupError:
+            return 0
+        except PermissionError:
+            pass
+        return None
+
+    def terminate(self):
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+class Zygote:
+    """
+    1つの仮想環境のPythonで動く zygote。作成するとすぐに起動し、importの完了は最初の起動要求のときに待つ。
+
+    :param python: 仮想環境のPython
+    :param modules: 事前にimportするモジュール
+    """
+
+    def __init__(self, python: str, modules: Sequence[str]):
+        self.python = python
+        self.modules = list(modules)
+        self.last_used = time.monotonic()
+        self.preloaded: Optional[List[str]] = None
+        self._lock = threading.Lock()
+        self._sock, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            self.process = subprocess.Popen(
+                [python, ZYGOTE_SERVER, str(child.fileno()), *self.modules],
+                pass_fds=[child.fileno()], stdin=subprocess.DEVNULL,
+            )
+        except BaseException:
+            self._sock.close()
+            raise
+        finally:
+            child.close()
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    @property
+    def ready(self) -> bool:
+        """importが終わっているか (待たずに確認する)"""
+        with self._lock:
+            if self.preloaded is None:
+                self._sock.settimeout(0)
+                try:
+                    self.preloaded = self._receive()["preloaded"]
+                except (OSError, ValueError, KeyError, ZygoteError):
+                    # まだ届いていない (BlockingIOError) か、zygote が異常終了している
+                    return False
+            return True
+
+    def spawn(self, argv: Sequence[str], cwd: str, stdio: Sequence[int]) -> int:
+        """
+        アプリのプロセスを fork させる。
+        :param argv: スクリプトのパスと引数
+        :param stdio: 子プロセスの標準入力・標準出力・標準エラー出力にするfd
+        :return: 子プロセスのPID
+        :raises ZygoteError: zygote が応答しない場合
+        """
+        with self._lock:
+            try:
+                if self.preloaded is None:
+                    self._sock.settimeout(ZYGOTE_READY_TIMEOUT)
+                    self.preloaded = self._receive()["preloaded"]
+                self._sock.settimeout(10)
+                message = json.dumps({"argv": list(argv), "cwd": cwd}).encode("utf-8")
+                socket.send_fds(self._sock, [message], list(stdio))
+                pid = self._receive()["pid"]
+            except (OSError, ValueError, KeyError) as e:
+                raise ZygoteError(f"zygote からの起動に失敗しました: {e}") from e
+            self.last_used = time.monotonic()
+            return pid
+
+    def close(self):
+        """zygote を終了させる (起動済みのアプリには影響しない)"""
+        self._sock.close()
+        if self.alive:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def _receive(self) -> dict:
+        data = self._sock.recv(MAX_MESSAGE_SIZE)
+        if not data:
+            raise ZygoteError("zygote が終了しました。")
+        return json.loads(data)
+
+
+class ZygotePool:
+    """
+    (Python, 事前にimportするモジュール) ごとの zygote を管理する。
+
+    :param enabled: Falseの場合は zygote を使わない (launch は ZygoteError を送出する)
+    :param idle_timeout: この秒数使われなかった zygote を終了させる
+    """
+
+    def __init__(self, enabled: bool = ZYGOTE_ENABLED, idle_timeout: float = ZYGOTE_IDLE_TIMEOUT):
+        self.enabled = enabled
+        self.idle_timeout = idle_timeout
+        self._zygotes: Dict[Tuple[str, Tuple[str, ...]], Zygote] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._reaper: Optional[threading.Thread] = None
+
+    def prewarm(self, python: str, modules: Sequence[str]):
+        """zygote がなければ起動しておく (importの完了は待たない)"""
+        if self.enabled:
+            self._get(python, modules, create=True)
+
+    def launch(self, python: str, modules: Sequence[str], argv: Sequence[str], cwd: Optional[str] = None,
+               stdio: Optional[Sequence[int]] = None, wait: bool = True) -> ZygoteProcess:
+        """
+        zygote からアプリを起動する。zygote がなければ起動する。
+        :param stdio: 子プロセスの標準入出力にするfd (省略時はランチャーと同じ)
+        :param wait: Falseの場合、importが終わっていなければ待たずに ZygoteError を送出する
+                     (zygote はそのまま用意を続けるので、次の起動から使える)
+        :raises ZygoteError: zygote を使えない場合
+        """
+        if not self.enabled:
+            raise ZygoteError("zygote は無効です。")
+        zygote = self._get(python, modules, create=True)
+        if not wait and not zygote.ready:
+            raise ZygoteError("zygote の準備ができていません。")
+        opened = []
+        if stdio is None:
+            stdio, opened = _inherited_stdio()
+        try:
+            pid = zygote.spawn(argv, cwd or os.getcwd(), stdio)
+        except ZygoteError:
+            self._discard(zygote)
+            raise
+        finally:
+            for fd in opened:
+                os.close(fd)
+        return ZygoteProcess(pid)
+
+    def is_warm(self, python: str, modules: Sequence[str]) -> bool:
+        """起動済みの zygote があるか (importが終わっていない場合も含む)"""
+        return self.enabled and self._get(python, modules, create=False) is not None
+
+    def evict_idle(self) -> int:
+        """
+        しばらく使われていない zygote と、終了してしまった zygote を片付ける。
+        :return: 片付けた数
+        """
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                key for key, zygote in self._zygotes.items()
+                if not zygote.alive or now - zygote.last_used > self.idle_timeout
+            ]
+            zygotes = [self._zygotes.pop(key) for key in expired]
+        for zygote in zygotes:
+            zygote.close()
+        return len(zygotes)
+
+    def shutdown(self):
+        """すべての zygote を終了させる (ランチャーの終了時に呼ぶ)"""
+        self._stop.set()
+        with self._lock:
+            zygotes = list(self._zygotes.values())
+            self._zygotes.clear()
+        for zygote in zygotes:
+            zygote.close()
+
+    def _get(self, python: str, modules: Sequence[str], create: bool) -> Optional[Zygote]:
+        key = (os.path.abspath(python), tuple(modules))
+        with self._lock:
+            zygote = self._zygotes.get(key)
+            if zygote is not None and not zygote.alive:
+                del self._zygotes[key]
+                zygote = None
+            if zygote is None and create:
+                try:
+                    zygote = self._zygotes[key] = Zygote(python, modules)
+                except OSError as e:
+                    raise ZygoteError(f"zygote を起動できません: {e}") from e
+                self._start_reaper()
+        return zygote
+
+    def _discard(self, zygote: Zygote):
+        with self._lock:
+            for key, value in list(self._zygotes.items()):
+                if value is zygote:
+                    del self._zygotes[key]
+        zygote.close()
+
+    def _start_reaper(self):
+        """(self._lock を持った状態で呼ぶ) 使われていない zygote を定期的に片付けるスレッドを起動する"""
+        if self._reaper is not None:
+            return
+        self._reaper = threading.Thread(target=self._reap_loop, name="zygote-reaper", daemon=True)
+        self._reaper.start()
+
+    def _reap_loop(self):
+        while not self._stop.wait(min(self.idle_timeout, 30)):
+            self.evict_idle()
+
+
+def _inherited_stdio() -> Tuple[List[int], List[int]]:
+    """
+    ランチャーの標準入出力のfd。閉じられている場合は代わりに /dev/null を開く。
+    :return: (標準入出力のfd, 開いたので送信後に閉じるfd)
+    """
+    fds, opened = [], []
+    for fd in (0, 1, 2):
+        try:
+            os.fstat(fd)
+            fds.append(fd)
+        except OSError:
+            opened.append(os.open(os.devnull, os.O_RDWR))
+            fds.append(opened[-1])
+    return fds, opened
+
+
+zygote_pool = ZygotePool()
@@ -0,0 +1,103 @@
+"""
+アプリの仮想環境のPythonで実行される、起動高速化用の常駐プロセス (zygote)。
+ランチャーの zygote.py から起動され、ランチャーのモジュールには依存しない (仮想環境には入っていないため)。
+
+    python zygote_server.py <ソケットのfd> <事前にimportするモジュール>...
+
+起動時に指定されたモジュールをimportしておき、ランチャーからの起動要求ごとに fork して、
+子プロセスで argv・カレントディレクトリ・標準入出力を設定してからアプリのスクリプトを実行する。
+子プロセスはimport済みの状態を引き継ぐので、重いライブラリのimportを待たずに起動できる。
+
+通信は SOCK_SEQPACKET のソケットで、1メッセージ = 1つのJSON。
+    zygote → ランチャー: {"ready": true, "preloaded": [...], "failed": [...]}  (importが終わったとき)
+    ランチャー → zygote: {"argv": [...], "cwd": "..."}  (標準入出力の3つのfdを SCM_RIGHTS で添付)
+    zygote → ランチャー: {"pid": 子プロセスのPID}
+ランチャーがソケットを閉じたら終了する。
+"""
+import importlib
+import json
+import os
+import runpy
+import signal
+import socket
+import sys
+import traceback
+
+MAX_MESSAGE_SIZE = 64 * 1024
+
+
+def _send(sock, message):
+    sock.send(json.dumps(message).encode("utf-8"))
+
+
+def _run_child(sock, request, fds):
+    """(fork した子プロセスで実行) 起動要求の内容でアプリのスクリプトを実行し、そのまま終了する"""
+    code = 1
+    try:
+        sock.close()
+        # ランチャーや zygote が終了しても、アプリは動き続けるようにする
+        os.setsid()
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+        for fd in fds:
+            if fd > 2:
+                os.close(fd)
+        os.chdir(request["cwd"])
+        script = request["argv"][0]
+        sys.argv = list(request["argv"])
+        # python script.py で起動したときと同じく、スクリプトのディレクトリを import の検索先にする
+        sys.path[0] = os.path.dirname(os.path.abspath(script))
+        runpy.run_path(script, run_name="__main__")
+        code = 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            code = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+        os._exit(code)
+
+
+def main():
+    sock = socket.socket(fileno=int(sys.argv[1]))
+    preloaded, failed = [], []
+    for name in sys.argv[2:]:
+        try:
+            importlib.import_module(name)
+            preloaded.append(name)
+        except Exception as e:
+            # import できないモジュールがあっても、アプリ側で改めて import されるだけなので続ける
+            failed.append(f"{name}: {e}")
+    # 終了した子プロセスを自動で回収する (子プロセスでは元に戻す)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    _send(sock, {"ready": True, "preloaded": preloaded, "failed": failed})
+
+    while True:
+        try:
+            data, fds, _, _ = socket.recv_fds(sock, MAX_MESSAGE_SIZE, 3)
+        except OSError:
+            break
+        if not data:
+            break
+        request = json.loads(data)
+        # fork の前に出力を書き出しておかないと、子プロセスにも同じ内容が残る
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            _run_child(sock, request, fds)
+        for fd in fds:
+            os.close(fd)
+        _send(sock, {"pid": pid})
+
+
+if __name__ == "__main__":
+    main()
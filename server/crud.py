@@ -1,7 +1,13 @@
-from sqlalchemy.orm import Session
+import re
+from datetime import datetime
+from typing import Tuple
+from sqlalchemy import and_, case, func
+from sqlalchemy.orm import Session, aliased
 
 # 同じディレクトリの models と security をインポート
 from . import models, security
+from .fragment_cache import invalidate_catalog, invalidate_user
+from .events import notify_catalog_change
 
 def get_user_by_email(db: Session, email: str):
     """メールアドレスでユーザーを検索する"""
@@ -11,11 +17,17 @@ def get_user_by_username(db: Session, username: str):
     """ユーザー名でユーザーを検索する"""
     return db.query(models.User).filter(models.User.username == username).first()
 
-def get_apps(db: Session, skip: int = 0, limit: int = 100):
+def get_apps(db: Session, skip: int = 0, limit: int = 100, after_id: int = 0):
     """
-    アプリケーションのリストをデータベースから取得する
+    公開中のアプリケーションのリストをID順にデータベースから取得する。
+    (非公開・通報で停止中のアプリは、差分同期 (/api/v1/apps/changes) では削除として扱うので、一覧にも含めない)
+    after_id を指定すると、そのIDより後のアプリから取得する (キーセット方式のページング。
+    OFFSET と違い、後ろのページでも読み飛ばす行が増えない)
     """
-    return db.query(models.App).offset(skip).limit(limit).all()
+    query = db.query(models.App).filter(models.App.status == 'public')
+    if after_id:
+        query = query.filter(models.App.id > after_id)
+    return query.order_by(models.App.id).offset(skip).limit(limit).all()
 
 def create_user(db: Session, user: models.UserCreate):
     """新しいユーザーを作成する"""
@@ -41,10 +53,198 @@ def create_app_for_user(db: Session, app_data: dict, user_id: int):
         version=app_data['version'],
         description=app_data.get('description'),
         download_url=app_data['download_url'], # 将来的にはS3のURLが入る
+        icon_url=app_data.get('icon_url'),
+        package_sha256=app_data.get('package_sha256'),
+        package_size=app_data.get('package_size'),
         owner_id=user_id
-        # icon_url, app_type, status などはデフォルト値が使われる
+        # app_type, status などはデフォルト値が使われる
     )
     db.add(db_app)
+    db.flush() # app.id を採番させる
+    # 変更履歴もアプリと同じトランザクションで書き込む
+    record_catalog_change(db, db_app, "upsert")
     db.commit()
     db.refresh(db_app)
-    return db_app
\ No newline at end of file
+    # キャッシュ済みのアプリ一覧 (トップページ・マイページ) を無効化する
+    invalidate_catalog()
+    invalidate_user(user_id)
+    return db_app
+
+def update_app_status(db: Session, app_id: int, status: str):
+    """
+    アプリの公開状態を変更する (非公開化・通報による停止など)。
+    公開中でなくなったアプリは、変更履歴に 'delete' として記録する。
+    """
+    db_app = db.query(models.App).filter(models.App.id == app_id).first()
+    if db_app is None:
+        return None
+    db_app.status = status
+    record_catalog_change(db, db_app, "upsert" if status == "public" else "delete")
+    db.commit()
+    db.refresh(db_app)
+    invalidate_catalog()
+    invalidate_user(db_app.owner_id)
+    return db_app
+
+def record_catalog_change(db: Session, db_app: models.App, op: str):
+    """
+    カタログの変更履歴を追加し、接続中のランチャーへの通知を予約する。
+    コミットは呼び出し元のトランザクションで行う (通知もコミット時に配信される)。
+    :param op: 'upsert' (追加・更新) または 'delete' (削除・非公開化)
+    """
+    change = models.CatalogChange(app_id=db_app.id, op=op, created_at=datetime.utcnow())
+    db.add(change)
+    db.flush() # seq を採番させる
+    notify_catalog_change(db, change.seq, op, db_app)
+
+def get_catalog_changes(db: Session, since: int, limit: int, created_before: datetime):
+    """
+    カーソル (seq) より後の変更履歴を古い順に取得する。
+    created_before より新しい変更は、まだコミットされていない可能性のある
+    より小さい seq を飛ばさないよう、次回の取得に回す。
+    """
+    return db.query(models.CatalogChange).filter(
+        models.CatalogChange.seq > since,
+        models.CatalogChange.created_at < created_before
+    ).order_by(models.CatalogChange.seq).limit(limit).all()
+
+def get_catalog_change_bounds(db: Session):
+    """
+    変更履歴に残っている最小と最大の seq を返す。履歴が空なら (None, None)。
+    """
+    return db.query(func.min(models.CatalogChange.seq), func.max(models.CatalogChange.seq)).one()
+
+def get_catalog_cursor_bounds(db: Session, created_before: datetime) -> Tuple[int, int]:
+    """
+    アプリ一覧と一緒に返すカーソルのために、(最大の seq, 確定した seq) を1回のクエリで返す。
+    確定した seq は、created_before より前に記録された変更のうち最大のもの (get_catalog_changes と同じ基準)。
+    そのような変更がなければ、履歴の最小の seq の1つ前。履歴が空ならどちらも0。
+    """
+    min_seq, max_seq, settled_seq = db.query(
+        func.min(models.CatalogChange.seq),
+        func.max(models.CatalogChange.seq),
+        func.max(case((models.CatalogChange.created_at < created_before, models.CatalogChange.seq))),
+    ).one()
+    if settled_seq is None:
+        settled_seq = min_seq - 1 if min_seq is not None else 0
+    return max_seq or 0, settled_seq
+
+def prune_catalog_changes(db: Session, before_seq: int):
+    """
+    古い変更履歴を削除する。これより前のカーソルを持つランチャーは全件の再同期が必要になる。
+    (最新の履歴は残すため、before_seq は最大の seq 以下に制限する)
+    """
+    _, max_seq = get_catalog_change_bounds(db)
+    if max_seq is None:
+        return 0
+    deleted = db.query(models.CatalogChange).filter(
+        models.CatalogChange.seq < min(before_seq, max_seq)
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+def get_apps_by_ids(db: Session, app_ids):
+    """IDのリストで公開中のアプリをまとめて取得する"""
+    if not app_ids:
+        return []
+    return db.query(models.App).filter(models.App.id.in_(app_ids), models.App.status == 'public').all()
+
+def is_same_app_packages(db: Session, base_sha256: str, target_sha256: str) -> bool:
+    """
+    2つのパッケージが、同じ開発者の同名アプリ (= 同じアプリの別バージョン) のものかどうか。
+    差分パッケージを、関係のないパッケージの組み合わせで作らせないために使う。
+    """
+    base = aliased(models.App)
+    target = aliased(models.App)
+    return db.query(base.id).join(
+        target,
+        and_(target.owner_id == base.owner_id, target.name == base.name)
+    ).filter(
+        base.package_sha256 == base_sha256,
+        target.package_sha256 == target_sha256,
+        target.status == 'public'
+    ).first() is not None
+
+def version_key(version: str):
+    """
+    バージョン文字列を比較用のキーに変換する ("1.10.0" > "1.9.2" となるように数字は数値として比較)。
+    """
+    parts = re.split(r"[.\-+_]", version.strip().lstrip("vV"))
+    return tuple((0, int(part), "") if part.isdigit() else (1, 0, part) for part in parts if part)
+
+def get_latest_versions(db: Session, app_ids):
+    """
+    指定したアプリIDそれぞれについて、同じ開発者の同名アプリ (= 同じアプリの別バージョン) のうち
+    公開中で最も新しいバージョンを1回のクエリで取得する。
+    :return: {指定したアプリID: 最新バージョンのAppモデル}
+    """
+    if not app_ids:
+        return {}
+    installed = aliased(models.App)
+    candidate = aliased(models.App)
+    rows = db.query(installed.id, candidate).join(
+        candidate,
+        and_(candidate.owner_id == installed.owner_id, candidate.name == installed.name)
+    ).filter(
+        installed.id.in_(app_ids),
+        candidate.status == 'public'
+    ).all()
+
+    latest = {}
+    for installed_id, app in rows:
+        current = latest.get(installed_id)
+        if current is None or version_key(app.version) > version_key(current.version):
+            latest[installed_id] = app
+    return latest
+
+def update_user_password_hash(db: Session, user: models.User, hashed_password: str):
+    """
+    ユーザーのパスワードハッシュを更新する。
+    ログイン時に、古いコストで保存されたハッシュを新しいコストに引き上げるために使う。
+    """
+    user.hashed_password = hashed_password
+    db.commit()
+    return user
+
+def create_user_session(db: Session, user_id: int, token_hash: str, family_id: str, created_at, expires_at):
+    """リフレッシュトークンに対応するセッションを作成する"""
+    db_session = models.UserSession(
+        user_id=user_id,
+        token_hash=token_hash,
+        family_id=family_id,
+        created_at=created_at,
+        expires_at=expires_at,
+        revoked=False
+    )
+    db.add(db_session)
+    db.commit()
+    db.refresh(db_session)
+    return db_session
+
+def get_user_session_by_token_hash(db: Session, token_hash: str):
+    """トークンのハッシュでセッションを検索する"""
+    return db.query(models.UserSession).filter(models.UserSession.token_hash == token_hash).first()
+
+def revoke_user_session(db: Session, session_id: int) -> bool:
+    """
+    セッションを無効化する。
+    既に無効化されていた場合はFalseを返す (同じトークンが2回使われたことを検出するため、
+    読み込みと更新を1つの条件付きUPDATEで行う)。
+    """
+    updated = db.query(models.UserSession).filter(
+        models.UserSession.id == session_id,
+        models.UserSession.revoked == False  # noqa: E712
+    ).update({"revoked": True}, synchronize_session=False)
+    db.commit()
+    return updated == 1
+
+def revoke_session_family(db: Session, family_id: str):
+    """
+    同じログインから派生したセッションをすべて無効化する
+    :return: 無効化したセッションIDのリスト
+    """
+    query = db.query(models.UserSession).filter(models.UserSession.family_id == family_id)
+    session_ids = [row.id for row in query.with_entities(models.UserSession.id)]
+    query.update({"revoked": True}, synchronize_session=False)
+    db.commit()
+    return session_ids
@@ -1,7 +1,10 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
+import threading
+from typing import Optional
 from dotenv import load_dotenv
 
 # .envファイルから環境変数を読み込む
@@ -9,12 +12,41 @@ load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-# データベースエンジンを作成
+# データベースエンジンは、インポート時ではなく init_engine() で作成する (通常はワーカーの lifespan から呼ぶ)。
+# gunicorn --preload でマスタープロセスが server.main をインポートしても、接続プールは作られず、
+# fork した各ワーカーがそれぞれ自分のエンジンを作る。
 # 'check_same_thread'はSQLiteの場合のみ必要。PostgreSQLでは不要。
-engine = create_engine(DATABASE_URL)
+_engine: Optional[Engine] = None
+_engine_lock = threading.Lock()
 
-# データベースセッションを作成するためのクラス
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# データベースセッションを作成するためのクラス (接続先は init_engine() で設定する)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+
+
+def init_engine() -> Engine:
+    """
+    このプロセスのエンジンを返す。まだなければ作成し、SessionLocal の接続先にする。
+    何度呼んでも、作成するのは1回だけ。
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = create_engine(DATABASE_URL)
+            SessionLocal.configure(bind=_engine)
+        return _engine
+
+
+def dispose_engine():
+    """エンジンの接続プールを閉じる (作成していなければ何もしない)"""
+    if _engine is not None:
+        _engine.dispose()
+
+
+def __getattr__(name):
+    # database.engine は、初めて参照されたときにエンジンを作成する (ベンチマークやマイグレーションなどのスクリプト用)
+    if name == "engine":
+        return init_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # モデルクラス（テーブル定義）が継承するためのベースクラス
 Base = declarative_base()
\ No newline at end of file
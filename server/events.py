@@ -0,0 +1,257 @@
+import asyncio
+import json
+import os
+import select
+import threading
+import time
+from typing import Optional, Set
+
+from sqlalchemy import event as sa_event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+from . import database, models
+from .database import SessionLocal
+from .logs import get_logger
+
+logger = get_logger(__name__)
+
+# --- カタログ変更のプッシュ通知 ---
+# ランチャーは /api/v1/events/catalog (Server-Sent Events) に接続したまま待機し、
+# アプリの追加・更新・非公開化をリアルタイムに受け取る。
+#
+# 構成:
+#   書き込み (crud) --notify--> リレー --> 各ワーカーのブローカー --> 接続中の各ランチャー
+# リレーは PostgreSQL の LISTEN/NOTIFY を使う (全ワーカーに届く)。
+# PostgreSQL以外 (SQLiteでの開発など) では、同じプロセス内だけに配信するメモリ上のリレーを使う。
+#
+# リレーで送るのは {"seq", "op", "id"} だけにする (pg_notify のペイロードは8000バイトまでのため)。
+# アプリの情報は、各ワーカーのブローカーがイベントごとに1回だけデータベースから読み込み、
+# /api/v1/apps/ と同じ形 (AppSchema) にしてから全購読者に配る。
+CATALOG_CHANNEL = "catalog_changes"
+# 接続ごとの送信待ちキューの上限。溢れた (読むのが遅い) 接続は切断する。
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "64"))
+# 無通信の接続がプロキシに切られないよう、この間隔でコメント行を送る
+HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+
+# ハートビートを表す特別な値
+HEARTBEAT = object()
+
+
+class Subscriber:
+    """1つのSSE接続に対応する購読者"""
+
+    def __init__(self, maxsize: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        # 送信が追いつかずに切断された場合にTrue
+        self.dropped = False
+
+
+class Broker:
+    """
+    ワーカープロセス内のpub/sub。イベントループ上でだけ操作する。
+    ハートビートはブローカーが全購読者へまとめて配るので、接続数が増えてもタイマーは1つで済む。
+    """
+
+    def __init__(self):
+        self.subscribers: Set[Subscriber] = set()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        # リレーから届いた通知 ({"seq", "op", "id"})。届いた順にアプリ情報を読み込んで配る
+        self._notifications: Optional[asyncio.Queue] = None
+        self._dispatch_task: Optional[asyncio.Task] = None
+
+    def ensure_started(self):
+        """初回の購読時に、ハートビートとリレーの受信を開始する"""
+        if self.loop is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self._notifications = asyncio.Queue()
+        self._heartbeat_task = self.loop.create_task(self._heartbeat())
+        self._dispatch_task = self.loop.create_task(self._dispatch())
+        relay.start(self)
+
+    def subscribe(self) -> Subscriber:
+        self.ensure_started()
+        subscriber = Subscriber()
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, item):
+        """全購読者にイベントを配る。キューが満杯の購読者は切断扱いにする"""
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber.queue.put_nowait(item)
+            except asyncio.QueueFull:
+                subscriber.dropped = True
+                self.subscribers.discard(subscriber)
+
+    def publish_threadsafe(self, notification: dict):
+        """(イベントループ以外のスレッドから) リレーが受け取った通知を、アプリ情報を読み込んでから配る"""
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._notifications.put_nowait, notification)
+
+    async def _dispatch(self):
+        """通知を届いた順に1件ずつイベントにして配る (データベースの読み込みはスレッドで行う)"""
+        while True:
+            notification = await self._notifications.get()
+            if not self.subscribers:
+                continue
+            try:
+                event = await asyncio.to_thread(load_event, notification)
+            except Exception as e:
+                # 配れなかった変更は、ランチャーが次の差分同期で受け取る
+                logger.warning("カタログ変更の通知を配信できませんでした", extra={"error": str(e), "seq": notification.get("seq")})
+                continue
+            self.publish(event)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            self.publish(HEARTBEAT)
+
+    def stop(self):
+        """ハートビートとリレーを停止する"""
+        for task in (self._heartbeat_task, self._dispatch_task):
+            if task is not None:
+                task.cancel()
+        self._heartbeat_task = self._dispatch_task = None
+        relay.stop()
+        self.loop = None
+
+
+class MemoryRelay:
+    """
+    同じプロセス内だけにイベントを配るリレー (開発・テスト用)。
+    トランザクション中に通知されたイベントはセッションに溜めておき、コミット後に配信する。
+    """
+
+    def __init__(self):
+        self.broker: Optional[Broker] = None
+        sa_event.listen(SessionLocal, "after_commit", self._after_commit)
+        sa_event.listen(SessionLocal, "after_rollback", self._after_rollback)
+
+    def start(self, broker: Broker):
+        self.broker = broker
+
+    def stop(self):
+        self.broker = None
+
+    def notify(self, db: Session, payload: dict):
+        db.info.setdefault("pending_events", []).append(payload)
+
+    def _after_commit(self, db: Session):
+        pending = db.info.pop("pending_events", None)
+        if pending and self.broker is not None:
+            for payload in pending:
+                self.broker.publish_threadsafe(payload)
+
+    def _after_rollback(self, db: Session):
+        db.info.pop("pending_events", None)
+
+
+class PostgresRelay:
+    """
+    PostgreSQL の LISTEN/NOTIFY で全ワーカーにイベントを配るリレー。
+    通知は書き込みと同じトランザクションで発行するので、コミットされた変更だけが届く。
+    受信は専用の接続とスレッドで行う。
+    """
+
+    def __init__(self):
+        self.broker: Optional[Broker] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def start(self, broker: Broker):
+        self.broker = broker
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._listen_forever, name="catalog-event-relay", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self.broker = None
+
+    def notify(self, db: Session, payload: dict):
+        db.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": CATALOG_CHANNEL, "payload": json.dumps(payload, separators=(",", ":"))}
+        )
+
+    def _listen_forever(self):
+        """接続が切れても再接続しながら通知を待ち受ける"""
+        backoff = 1
+        while not self._stopping.is_set():
+            try:
+                self._listen()
+                backoff = 1
+            except Exception as e:
+                logger.warning("イベントリレーの接続が切れました。再接続します", extra={"error": str(e), "retry_in": backoff})
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def _listen(self):
+        connection = database.init_engine().raw_connection()
+        try:
+            dbapi_connection = connection.driver_connection
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {CATALOG_CHANNEL}")
+            while not self._stopping.is_set():
+                # 1秒ごとに停止要求を確認する
+                if select.select([dbapi_connection], [], [], 1.0) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notification = dbapi_connection.notifies.pop(0)
+                    if self.broker is not None:
+                        self.broker.publish_threadsafe(json.loads(notification.payload))
+        finally:
+            connection.invalidate()
+
+
+def _create_relay():
+    # エンジンを作らずに済むよう、接続先のURLから判定する
+    backend = make_url(database.DATABASE_URL).get_backend_name() if database.DATABASE_URL else ""
+    name = os.getenv("EVENT_RELAY", "postgres" if backend == "postgresql" else "memory")
+    return PostgresRelay() if name == "postgres" else MemoryRelay()
+
+
+relay = _create_relay()
+broker = Broker()
+
+
+def notify_catalog_change(db: Session, seq: int, op: str, app):
+    """
+    カタログの変更を通知する。書き込みと同じトランザクションの中で呼ぶこと。
+    通知には変更履歴の seq・操作・アプリIDだけを入れる (アプリの情報は配信時に load_event で読み込む)。
+    """
+    relay.notify(db, {"seq": seq, "op": op, "id": app.id})
+
+
+def load_event(notification: dict) -> dict:
+    """
+    通知 ({"seq", "op", "id"}) を、ランチャーに配るイベント ({"seq", "op", "app"}) にする。
+    追加・更新の場合は、アプリの情報を /api/v1/apps/ と同じ形で読み込む。
+    その間にアプリが削除されていた場合は、削除として配る (変更履歴の差分同期と同じ扱い)。
+    """
+    app = None
+    if notification["op"] != "delete":
+        with SessionLocal() as db:
+            db_app = db.get(models.App, notification["id"])
+            if db_app is not None:
+                app = models.AppSchema.model_validate(db_app, from_attributes=True).model_dump(mode="json")
+    if app is None:
+        return {"seq": notification["seq"], "op": "delete", "app": {"id": notification["id"]}}
+    return {"seq": notification["seq"], "op": notification["op"], "app": app}
+
+
+def format_sse(item) -> str:
+    """イベントをSSEの形式に変換する"""
+    if item is HEARTBEAT:
+        return ": ping\n\n"
+    data = json.dumps(item, ensure_ascii=False, separators=(",", ":"))
+    return f"id: {item['seq']}\nevent: catalog\ndata: {data}\n\n"
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, NamedTuple
+
+# --- レンダリング済みHTML断片のキャッシュ ---
+# トップページのアプリ一覧や、マイページの「あなたのアプリ」一覧は、
+# アプリが登録されるまで内容が変わらないので、描画結果をメモリに保持して使い回す。
+# キャッシュキーには「カタログ/ユーザーのバージョン」を含め、create_app_for_user で
+# バージョンを上げることで古い断片が使われないようにする。
+# バージョンはワーカーごとのメモリにあるため、他のワーカーでの登録は TTL 経過後に反映される。
+FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", "1024"))
+FRAGMENT_CACHE_TTL = float(os.getenv("FRAGMENT_CACHE_TTL", "30"))
+
+
+class Fragment(NamedTuple):
+    """描画済みのHTMLと、その内容から計算したETag"""
+    html: str
+    etag: str
+    expires_at: float
+
+
+def make_etag(content: str) -> str:
+    """HTMLの内容からETagを作る (内容が同じならどのワーカーでも同じ値になる)"""
+    return '"' + hashlib.sha1(content.encode("utf-8")).hexdigest() + '"'
+
+
+class FragmentCache:
+    """キー -> 描画済みHTML断片 の上限付きLRUキャッシュ"""
+
+    def __init__(self, maxsize: int = FRAGMENT_CACHE_SIZE, ttl: float = FRAGMENT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items: "OrderedDict[Hashable, Fragment]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key: Hashable, render: Callable[[], str]) -> Fragment:
+        """
+        キャッシュに有効な断片があればそれを返し、なければ render() で描画して保存する。
+        """
+        now = time.monotonic()
+        with self._lock:
+            fragment = self._items.get(key)
+            if fragment is not None and fragment.expires_at > now:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return fragment
+            self.misses += 1
+
+        # 描画 (DBアクセスを含む) はロックの外で行う
+        html = render()
+        fragment = Fragment(html, make_etag(html), now + self.ttl)
+        with self._lock:
+            self._items[key] = fragment
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return fragment
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+fragment_cache = FragmentCache()
+
+# --- バージョン管理 ---
+_catalog_version = 0
+_user_versions: Dict[int, int] = {}
+_version_lock = threading.Lock()
+
+
+def catalog_version() -> int:
+    """アプリ一覧 (カタログ) の現在のバージョン"""
+    return _catalog_version
+
+
+def user_version(user_id: int) -> int:
+    """指定ユーザーの所有アプリ一覧の現在のバージョン"""
+    return _user_versions.get(user_id, 0)
+
+
+def invalidate_catalog():
+    """カタログが変わったときに呼ぶ。カタログを含む断片はすべて描画し直しになる"""
+    global _catalog_version
+    with _version_lock:
+        _catalog_version += 1
+
+
+def invalidate_user(user_id: int):
+    """ユーザーの所有アプリが変わったときに呼ぶ"""
+    with _version_lock:
+        _user_versions[user_id] = _user_versions.get(user_id, 0) + 1
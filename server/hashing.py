@@ -0,0 +1,102 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from . import security
+
+# --- パスワードハッシュ専用プールの設定 ---
+# bcryptは意図的に遅いハッシュなので、リクエスト処理と同じスレッドで実行すると
+# ログインが集中したときに全ワーカーが埋まってしまう。
+# そこで、専用のプロセスプールで実行し、待ち行列の長さも制限する。
+# PASSWORD_HASH_WORKERS=0 の場合はプロセスを作らず、スレッドプールで実行する (開発・Windows向け)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# 実行中 + 待機中のハッシュ処理の上限。これを超えたリクエストは429で拒否する。
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 8 or 8)))
+# 429を返すときにクライアントへ伝える再試行までの秒数
+PASSWORD_HASH_RETRY_AFTER = 1
+
+
+class HashingBusyError(Exception):
+    """ハッシュ処理の待ち行列が満杯で、新しい処理を受け付けられない場合の例外"""
+
+
+def _verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    (プールのワーカー側で実行される)
+    パスワードを検証し、保存済みハッシュが現在の設定より古ければ新しいハッシュも返す。
+    """
+    if not security.verify_password(plain_password, hashed_password):
+        return False, None
+    if security.pwd_context.needs_update(hashed_password):
+        return True, security.get_password_hash(plain_password)
+    return True, None
+
+
+class PasswordHasher:
+    """
+    bcryptの検証・ハッシュ化をリクエスト処理から切り離して実行するサービス。
+    受付数 (実行中 + 待機中) が上限に達している場合は HashingBusyError を送出する。
+    """
+
+    def __init__(self, max_workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        """プロセスプールを初回利用時に作成する。workers=0ならNone (スレッドプールを使う)"""
+        if self.max_workers <= 0:
+            return None
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def _acquire(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise HashingBusyError("Too many password hashing requests")
+            self._pending += 1
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+    async def _submit(self, func, *args):
+        self._acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self._release()
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        パスワードを検証する。
+        :return: (検証結果, 再ハッシュが必要な場合は新しいハッシュ / 不要ならNone)
+        """
+        return await self._submit(_verify_and_update, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        """平文のパスワードをプール上でハッシュ化する"""
+        return await self._submit(security.get_password_hash, password)
+
+    @property
+    def pending(self) -> int:
+        """現在受け付けているハッシュ処理の数"""
+        return self._pending
+
+    def shutdown(self):
+        """プロセスプールを停止する"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+# アプリ全体で共有するインスタンス
+password_hasher = PasswordHasher()
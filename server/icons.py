@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import io
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+# --- アイコンのサムネイル生成 ---
+# 開発者がアップロードしたアイコン画像 (またはパッケージ内の .png/.jpg) を
+# 決まったサイズの正方形WebPに縮小して保存する。
+# 保存先は元画像のSHA-256で決まる (コンテンツアドレス) ため、同じ画像は一度しか処理せず、
+# URLの内容が変わることもないので、ブラウザやランチャーに永続キャッシュさせられる。
+#
+# URL: {PUBLIC_BASE_URL}/icons/<sha256>/<サイズ>.webp
+# サイズ部分を差し替えるだけで別の解像度になるため、srcset をそのまま組み立てられる。
+ICON_SIZES = (32, 64, 128, 256)
+DEFAULT_ICON_SIZE = 128
+ICON_DIR = os.path.join("uploads", "icons")
+MAX_ICON_BYTES = 5 * 1024 * 1024  # 元画像の上限 5 MB
+MAX_ICON_PIXELS = 4096 * 4096  # 展開後のピクセル数上限 (画像爆弾対策)
+ICON_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://127.0.0.1:8000").rstrip("/")
+# 0 の場合はプロセスを作らず、スレッドプールで実行する
+ICON_WORKERS = int(os.getenv("ICON_WORKERS", "1"))
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+_ICON_URL_RE = re.compile(r"^(?P<base>.*/icons/[0-9a-f]{64})/\d+\.webp$")
+
+
+class InvalidIconError(Exception):
+    """画像として読み込めない、または大きすぎるアイコンの場合の例外"""
+
+
+def _render_variants(data: bytes) -> Dict[int, bytes]:
+    """
+    (プールのワーカー側で実行される)
+    画像を中央で正方形に切り抜き、ICON_SIZES の各サイズのWebPにエンコードする。
+    """
+    # Pillow の読み込みは重いので、サーバーの起動時ではなく初めて使うときに読み込む
+    from PIL import Image, ImageOps
+
+    largest = max(ICON_SIZES)
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # Image.open はヘッダーを読むだけなので、展開する前にピクセル数を確認する
+            # (Pillow の MAX_IMAGE_PIXELS は上限の2倍までは警告しか出さないため、自分で判定する)
+            if image.width * image.height > MAX_ICON_PIXELS:
+                raise InvalidIconError(
+                    f"アイコン画像の解像度が大きすぎます ({image.width}x{image.height}、上限 {MAX_ICON_PIXELS} ピクセル)"
+                )
+            # JPEGは縮小しながらデコードできるので、必要な解像度だけ展開する
+            image.draft("RGB", (largest * 2, largest * 2))
+            image = ImageOps.exif_transpose(image).convert("RGBA")
+    except (OSError, Image.DecompressionBombError) as e:
+        raise InvalidIconError(f"アイコン画像を読み込めません: {e}")
+
+    side = min(image.size)
+    left = (image.width - side) // 2
+    top = (image.height - side) // 2
+    square = image.crop((left, top, left + side, top + side))
+
+    variants = {}
+    for size in sorted(ICON_SIZES, reverse=True):
+        # 大きいサイズから順に縮小し、次のサイズの元画像として使い回す
+        square = square.resize((size, size), Image.LANCZOS) if square.width != size else square
+        buffer = io.BytesIO()
+        square.save(buffer, format="WEBP", quality=85, method=4)
+        variants[size] = buffer.getvalue()
+    return variants
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> Optional[ProcessPoolExecutor]:
+    global _executor
+    if ICON_WORKERS <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=ICON_WORKERS)
+    return _executor
+
+
+def shutdown():
+    """アイコン処理用のプロセスプールを停止する"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+
+def icon_path(digest: str, size: int) -> str:
+    """保存先のファイルパス (先頭2文字でディレクトリを分ける)"""
+    return os.path.join(ICON_DIR, digest[:2], digest, f"{size}.webp")
+
+
+def icon_url(digest: str, size: int = DEFAULT_ICON_SIZE) -> str:
+    """アイコンの公開URL"""
+    return f"{PUBLIC_BASE_URL}/icons/{digest}/{size}.webp"
+
+
+def is_valid_digest(digest: str) -> bool:
+    return bool(_DIGEST_RE.match(digest))
+
+
+def icon_srcset(url: Optional[str]) -> str:
+    """
+    アイコンURLから、img要素の srcset 属性値を組み立てる (Jinjaのフィルターとして使う)。
+    このパイプラインで作ったURLでなければ、元のURLをそのまま返す。
+    """
+    if not url:
+        return ""
+    match = _ICON_URL_RE.match(url)
+    if not match:
+        return url
+    return ", ".join(f"{match.group('base')}/{size}.webp {size}w" for size in ICON_SIZES)
+
+
+def find_icon_in_zip(zip_path: str) -> Optional[bytes]:
+    """
+    パッケージ内からアイコンにする画像を探す。
+    ファイル名が icon で始まるものを優先し、なければ最も浅い階層の画像を使う。
+    """
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            candidates = [
+                info for info in zip_ref.infolist()
+                if not info.is_dir()
+                and os.path.splitext(info.filename)[1].lower() in ICON_EXTENSIONS
+                and info.file_size <= MAX_ICON_BYTES
+            ]
+            if not candidates:
+                return None
+            candidates.sort(key=lambda info: (
+                not os.path.basename(info.filename).lower().startswith("icon"),
+                info.filename.count("/"),
+                info.filename,
+            ))
+            return zip_ref.read(candidates[0])
+    except zipfile.BadZipFile:
+        return None
+
+
+def _lookup(data: bytes):
+    """画像のSHA-256と、そのサムネイルがすべて保存済みかどうかを返す"""
+    digest = hashlib.sha256(data).hexdigest()
+    return digest, all(os.path.exists(icon_path(digest, size)) for size in ICON_SIZES)
+
+
+def _store_variants(digest: str, variants: Dict[int, bytes]):
+    """生成したサムネイルをファイルに保存する (一時ファイル経由で、途中の状態が見えないようにする)"""
+    for size, data in variants.items():
+        path = icon_path(digest, size)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+
+async def ingest_icon(data: bytes) -> str:
+    """
+    アイコン画像を取り込み、サムネイルを生成・保存して、既定サイズのURLを返す。
+    同じ画像が既に取り込まれていれば、何もせずにURLだけを返す。
+    ハッシュ計算・ファイルの確認と書き込みもスレッドで行い、イベントループを止めない。
+    :raises InvalidIconError: 画像として不正、または大きすぎる場合
+    """
+    if len(data) > MAX_ICON_BYTES:
+        raise InvalidIconError(f"アイコン画像が大きすぎます (上限 {MAX_ICON_BYTES // 1024 // 1024} MB)")
+
+    digest, stored = await asyncio.to_thread(_lookup, data)
+    if stored:
+        return icon_url(digest)
+
+    loop = asyncio.get_running_loop()
+    variants = await loop.run_in_executor(_get_executor(), _render_variants, data)
+    await asyncio.to_thread(_store_variants, digest, variants)
+    return icon_url(digest)
@@ -0,0 +1,73 @@
+import json
+import logging
+import os
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+# --- 構造化ログ ---
+# サーバーのログは1行1件のJSONで出力し、処理中のリクエストのIDを必ず含める。
+# リクエストIDは InstrumentationMiddleware (metrics.py) がリクエストごとに設定する。
+# contextvars を使うので、スレッドプールで実行される同期エンドポイントからも同じIDが見える。
+#
+# LOG_FORMAT=text にすると、開発時に読みやすい1行テキスト形式になる。
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+# LogRecord が標準で持つ属性 (これ以外の属性は extra で渡されたフィールドとして出力する)
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def _extra_fields(record: logging.LogRecord) -> dict:
+    return {key: value for key, value in vars(record).items() if key not in _STANDARD_ATTRS}
+
+
+class JsonFormatter(logging.Formatter):
+    """ログを1行のJSONに変換する"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": request_id_var.get(),
+            "msg": record.getMessage(),
+        }
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """開発用の読みやすい形式"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(f"{key}={value}" for key, value in _extra_fields(record).items())
+        line = f"{record.levelname:<7} [{request_id_var.get()}] {record.name}: {record.getMessage()}"
+        if fields:
+            line = f"{line} {fields}"
+        if record.exc_info:
+            line = f"{line}\n{self.formatException(record.exc_info)}"
+        return line
+
+
+def setup_logging():
+    """server パッケージのロガーに出力先を設定する (何度呼んでも1回だけ設定される)"""
+    logger = logging.getLogger("server")
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    # uvicorn などのルートロガーに二重に出力しない
+    logger.propagate = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    """モジュール用のロガーを返す (例: get_logger(__name__))"""
+    setup_logging()
+    return logging.getLogger(name)
@@ -1,22 +1,33 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request, Form, Response
-from fastapi.responses import HTMLResponse, RedirectResponse # Response を HTMLResponse に変更しても良い
+from fastapi import FastAPI, APIRouter, File, UploadFile, HTTPException, Depends, Request, Form, Response
+from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse, StreamingResponse # Response を HTMLResponse に変更しても良い
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm 
+from fastapi.concurrency import run_in_threadpool
 from datetime import timedelta, datetime
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import shutil
 import os
 import zipfile # zipファイル操作のため
 import subprocess # 将来のウイルススキャン連携用
 import hashlib # ハッシュ値計算のため
+import uuid
+import gzip
+import json
+import time
+from contextlib import asynccontextmanager
 
 # SQLAlchemyのセッション型をインポート
 from sqlalchemy.orm import Session
 
 # 作成したモジュールをインポート
-from . import crud, models, security
-from .database import SessionLocal, engine
+from . import crud, models, security, sessions, icons, events, packages, metrics, query_profiler, sampling_profiler
+from . import database
+from .database import SessionLocal
+from .hashing import password_hasher, HashingBusyError, PASSWORD_HASH_RETRY_AFTER
+from .ratelimit import RateLimitMiddleware, RateLimitPolicy, MemoryBackend, DatabaseBackend
+from .fragment_cache import fragment_cache, catalog_version, user_version, make_etag
+from .logs import get_logger
 
 # 同じディレクトリにあるmodels.pyからAppモデルをインポート
 #from .models import App
@@ -31,23 +42,60 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/token")
 # --- 定数を定義 ---
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50 MB
 MAX_FILES_IN_ZIP = 100 # zip内のファイル数上限
+# 展開後の合計サイズと圧縮率の上限 (zip爆弾対策。マニフェストの作成で全ファイルを展開するため)
+MAX_UNCOMPRESSED_SIZE = 200 * 1024 * 1024  # 200 MB
+MAX_COMPRESSION_RATIO = 100
 ALLOWED_EXTENSIONS = {'.py', '.txt', '.md', '.json', '.ui', '.qss', '.png', '.jpg', '.jpeg', '.gif'} # 許可する拡張子
 UPLOAD_DIR = "uploads"
+# 差分同期 (/api/v1/apps/changes) の1回あたりの件数
+CATALOG_CHANGES_DEFAULT_LIMIT = 1000
+CATALOG_CHANGES_MAX_LIMIT = 5000
+# 書き込み中のトランザクションが先に採番した seq を飛ばさないよう、直近この秒数の変更は次回に回す
+CATALOG_CHANGES_SETTLE_SECONDS = 2
+# 更新確認 (versions:batchGet) で1回に指定できるアプリ数の上限
+VERSION_BATCH_MAX_ITEMS = 500
+# これより大きいJSONレスポンスは、クライアントが対応していればgzip圧縮して返す
+GZIP_MINIMUM_SIZE = 1024
+
+# /metrics へのアクセスに必要なトークン (未設定なら誰でも取得できる。本番では設定すること)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+logger = get_logger(__name__)
 
 # ダミーのブラックリストDB (本来はデータベースやファイルで管理)
+# MALWARE_HASHES_FILE を指定すると、そのファイル (1行に1つのSHA-256) の内容も追加される。
+# 読み込みは create_app() で1回だけ行う。
+MALWARE_HASHES_FILE = os.getenv("MALWARE_HASHES_FILE")
 KNOWN_MALWARE_HASHES = {
     "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855" # 空ファイルのSHA-256ハッシュ (テスト用)
 }
-
-# サーバー起動時にアップロード用ディレクトリを作成
-os.makedirs(UPLOAD_DIR, exist_ok=True)
 # --- 定数ここまで ---
 
-# FastAPIアプリケーションのインスタンスを作成
-app = FastAPI(title="Cat-box API")
+# ルートはこのルーターに登録し、create_app() でアプリに組み込む
+router = APIRouter()
 
 # テンプレート設定 ---
-templates = Jinja2Templates(directory="server/templates")
+# 起動したディレクトリに関係なく読み込めるよう、このファイルからの絶対パスで指定する
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+# create_app() で作成する
+templates: Optional[Jinja2Templates] = None
+
+# --- レート制限 ---
+# bcrypt・ハッシュ計算・zip検査などCPUを多く使うエンドポイントに、
+# 1クライアントあたりの上限を設ける。(rate: 1秒あたりの回復数, burst: 連続で許可する回数)
+# key="ip" の接続元IPは、ASGIサーバーから見た接続元。リバースプロキシの後ろで動かす場合は、
+# プロキシのアドレスを TRUSTED_PROXIES に設定すること (X-Forwarded-For からクライアントIPを取り出す)。
+# 設定しないと、全クライアントがプロキシのIPとして同じバケットを共有する。
+RATE_LIMIT_POLICIES = {
+    ("POST", "/api/v1/token"): RateLimitPolicy("token", rate=10 / 60, burst=10, key="ip"),
+    ("POST", "/api/v1/token/refresh"): RateLimitPolicy("refresh", rate=30 / 60, burst=30, key="ip"),
+    ("POST", "/login"): RateLimitPolicy("login", rate=10 / 60, burst=10, key="ip"),
+    ("POST", "/api/v1/users/"): RateLimitPolicy("register", rate=5 / 60, burst=5, key="ip"),
+    ("POST", "/api/v1/apps/upload"): RateLimitPolicy("upload", rate=5 / 60, burst=5, key="user"),
+    ("POST", "/mypage/apps/upload"): RateLimitPolicy("upload", rate=5 / 60, burst=5, key="user"),
+}
+# RATE_LIMIT_BACKEND=database にすると、全ワーカーでDB上のバケットを共有する (既定はワーカーごとのメモリ)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
 
 # --- CORS設定 ---
 # 開発中にローカルのフロントエンドやランチャーからアクセスできるようにするため、
@@ -59,18 +107,7 @@ origins = [
     # 必要に応じて、将来のWebサイトのドメインなどもここに追加する
 ]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"], # 全てのHTTPメソッドを許可 (GET, POST, etc.)
-    allow_headers=["*"], # 全てのヘッダーを許可
-)
-# --- CORS設定ここまで ---
-
 # --- DBセッション管理 ---
-from .database import SessionLocal
-
 def get_db():
     """
     APIリフクエストのライフサイクル中にデータベースセッションを提供する依存性。
@@ -122,83 +159,186 @@ async def get_current_user_from_cookie(request: Request, db: Session = Depends(g
     user = crud.get_user_by_email(db, email=email)
     return user
 
+async def authenticate_user(db: Session, email: str, password: str) -> Optional[models.User]:
+    """
+    メールアドレスとパスワードでユーザーを認証する。
+    bcryptの検証は専用のハッシュプールで行い、保存済みハッシュのコストが
+    現在の設定より低ければ、その場で新しいハッシュに置き換える。
+    プールが混雑している場合は HashingBusyError を送出する。
+    """
+    user = crud.get_user_by_email(db, email=email)
+    if not user:
+        return None
+
+    verified, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+    if not verified:
+        return None
+    if new_hash:
+        crud.update_user_password_hash(db, user, new_hash)
+    return user
+
+def issue_tokens(db: Session, user: models.User):
+    """
+    パスワード認証に成功したユーザーに、アクセストークンとリフレッシュトークンを発行する。
+    :return: (アクセストークン, リフレッシュトークン)
+    """
+    refresh_token, session_id = sessions.start_session(db, user)
+    access_token_expires = timedelta(minutes=security.ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = security.create_access_token(
+        data={"sub": user.email, "sid": session_id}, expires_delta=access_token_expires
+    )
+    return access_token, refresh_token
+
+def set_auth_cookies(response: Response, access_token: str, refresh_token: str):
+    """Webブラウザ向けに、トークンをCookieへセットする"""
+    response.set_cookie(key="access_token", value=f"Bearer {access_token}", httponly=True)
+    response.set_cookie(
+        key="refresh_token", value=refresh_token, httponly=True,
+        max_age=security.REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
+    )
+
 #  Webページ表示用エンドポイント ---
 
-@app.get("/", response_class=HTMLResponse)
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match ヘッダーが指定のETagと一致するか (弱いETag・複数指定にも対応)"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates or "*" in candidates
+
+def conditional_html_response(request: Request, html: str, etag: str, cache_control: str) -> Response:
+    """
+    ETag付きでHTMLを返す。ブラウザが同じETagを持っていれば、本文なしの304を返す。
+    """
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(content=html, headers=headers)
+
+def render_app_grid(db: Session) -> str:
+    """トップページのアプリ一覧 (キャッシュ済みの断片) を返す"""
+    fragment = fragment_cache.get_or_render(
+        ("app_grid", catalog_version()),
+        lambda: templates.get_template("partials/app_grid.html").render(apps=crud.get_apps(db))
+    )
+    return fragment.html
+
+def render_my_apps(user: models.User) -> str:
+    """マイページの所有アプリ一覧 (キャッシュ済みの断片) を返す"""
+    fragment = fragment_cache.get_or_render(
+        ("my_apps", user.id, user_version(user.id)),
+        lambda: templates.get_template("partials/my_apps.html").render(apps=user.apps)
+    )
+    return fragment.html
+
+@router.get("/", response_class=HTMLResponse)
 def read_root(request: Request, db: Session = Depends(get_db)):
     """
     トップページ (アプリ一覧) を表示する。
+    ページ全体がカタログの内容だけで決まるので、描画済みのHTMLをそのままキャッシュから返す。
     """
-    # データベースからアプリ一覧を取得
-    apps = crud.get_apps(db)
-    
-    # テンプレートに渡すデータを準備
-    context = {
-        "request": request,
-        "apps": apps
-    }
-    # テンプレートを使ってHTMLを生成して返す
-    return templates.TemplateResponse("index.html", context)
+    page = fragment_cache.get_or_render(
+        ("index", catalog_version()),
+        lambda: templates.get_template("index.html").render(app_grid=render_app_grid(db))
+    )
+    return conditional_html_response(request, page.html, page.etag, "public, no-cache")
 
-@app.get("/login", response_class=HTMLResponse)
+@router.get("/login", response_class=HTMLResponse)
 def login_page(request: Request):
     """ログインページを表示する"""
     return templates.TemplateResponse("login.html", {"request": request})
 
-@app.post("/login", response_class=HTMLResponse)
+@router.post("/login", response_class=HTMLResponse)
 async def handle_login(request: Request, db: Session = Depends(get_db), username: str = Form(), password: str = Form()):
     """ログインフォームからの送信を処理する"""
     try:
         # トークン発行APIを呼び出すのと同じロジック
-        user = crud.get_user_by_email(db, email=username)
-        if not user or not security.verify_password(password, user.hashed_password):
+        user = await authenticate_user(db, username, password)
+        if not user:
             raise Exception("メールアドレスまたはパスワードが間違っています。")
 
         # ログイン成功
-        access_token_expires = timedelta(minutes=security.ACCESS_TOKEN_EXPIRE_MINUTES)
-        access_token = security.create_access_token(
-            data={"sub": user.email}, expires_delta=access_token_expires
-        )
+        access_token, refresh_token = issue_tokens(db, user)
         
         # トークンをCookieにセットしてトップページにリダイレクト
         response = templates.TemplateResponse("redirect.html", {"request": request, "message": "ログインに成功しました！", "redirect_url": "/"})
-        response.set_cookie(key="access_token", value=f"Bearer {access_token}", httponly=True)
+        set_auth_cookies(response, access_token, refresh_token)
         return response
 
+    except HashingBusyError:
+        # ハッシュプールが混雑している
+        return templates.TemplateResponse(
+            "login.html",
+            {"request": request, "error": "ただいま混み合っています。しばらくしてから再度お試しください。"},
+            status_code=429,
+            headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER)},
+        )
     except Exception as e:
         # ログイン失敗
         return templates.TemplateResponse("login.html", {"request": request, "error": str(e)})
 
 # 新しく追加するCRUD関数をインポート
-from . import crud, models, security
-
-@app.get("/mypage", response_class=HTMLResponse)
+@router.get("/mypage", response_class=HTMLResponse)
 async def mypage(request: Request, current_user: Optional[models.User] = Depends(get_current_user_from_cookie)):
     """
     マイページを表示する。
     ログインしていない場合はログインページにリダイレクトする。
     """
     if current_user is None:
+        # アクセストークンが期限切れでも、リフレッシュトークンがあればパスワードなしで再発行する
+        if request.cookies.get("refresh_token"):
+            return RedirectResponse(url="/refresh?next=/mypage", status_code=302)
         # ログインしていない場合、ログインページへリダイレクト
         return RedirectResponse(url="/login", status_code=302)
 
     # ログインしている場合、ユーザー情報をテンプレートに渡して表示
     context = {
         "request": request,
-        "current_user": current_user
+        "current_user": current_user,
+        "my_apps": render_my_apps(current_user)
     }
-    return templates.TemplateResponse("mypage.html", context)
+    html = templates.get_template("mypage.html").render(context)
+    return conditional_html_response(request, html, make_etag(html), "private, no-cache")
+
+@router.get("/refresh")
+def refresh_web_session(request: Request, next: str = "/", db: Session = Depends(get_db)):
+    """
+    Cookieのリフレッシュトークンを使ってアクセストークンを再発行し、元のページに戻す。
+    リフレッシュトークンが無効な場合はログインページへリダイレクトする。
+    """
+    # オープンリダイレクトを防ぐため、サイト内のパスだけを許可する
+    if not next.startswith("/") or next.startswith("//"):
+        next = "/"
+
+    refresh_token = request.cookies.get("refresh_token")
+    rotated = sessions.rotate_session(db, refresh_token) if refresh_token else None
+    if rotated is None:
+        response = RedirectResponse(url="/login", status_code=302)
+        response.delete_cookie(key="access_token")
+        response.delete_cookie(key="refresh_token")
+        return response
 
-@app.post("/logout")
-async def logout(response: Response):
+    email, new_refresh_token, session_id = rotated
+    access_token = security.create_access_token(data={"sub": email, "sid": session_id})
+    response = RedirectResponse(url=next, status_code=302)
+    set_auth_cookies(response, access_token, new_refresh_token)
+    return response
+
+@router.post("/logout")
+async def logout(request: Request, db: Session = Depends(get_db)):
     """
-    ログアウト処理。Cookieを削除してトップページにリダイレクトする。
+    ログアウト処理。サーバー側のセッションを無効化し、Cookieを削除してトップページにリダイレクトする。
     """
+    refresh_token = request.cookies.get("refresh_token")
+    if refresh_token:
+        sessions.end_session(db, refresh_token)
     response = RedirectResponse(url="/", status_code=302)
     response.delete_cookie(key="access_token")
+    response.delete_cookie(key="refresh_token")
     return response
 
-@app.post("/mypage/apps/upload", response_class=HTMLResponse)
+@router.post("/mypage/apps/upload", response_class=HTMLResponse)
 async def handle_app_upload(
     request: Request,
     db: Session = Depends(get_db),
@@ -206,7 +346,8 @@ async def handle_app_upload(
     name: str = Form(),
     version: str = Form(),
     description: Optional[str] = Form(None),
-    app_file: UploadFile = File(...)
+    app_file: UploadFile = File(...),
+    icon_file: Optional[UploadFile] = File(None)
 ):
     """
     マイページのアプリ登録フォームからの送信を処理する。
@@ -218,43 +359,43 @@ async def handle_app_upload(
     context = {"request": request, "current_user": current_user}
 
     try:
-        # 以前作成したアップロード検証ロジックをここで実行
-        # (簡単のため、upload_app関数の中身をここに展開・統合する)
-
-        # 1. Content-Typeの検証
-        if app_file.content_type not in ["application/zip", "application/x-zip-compressed"]:
-            raise ValueError(f"不正なファイル形式です: {app_file.content_type}")
-
-        # 2. 一時ファイルに保存
-        temp_file_path = os.path.join(UPLOAD_DIR, app_file.filename)
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(app_file.file, buffer)
-
-        # 3. ファイルサイズの検証
-        file_size = os.path.getsize(temp_file_path)
-        if file_size > MAX_FILE_SIZE:
-            raise ValueError(f"ファイルサイズが上限 ({MAX_FILE_SIZE / 1024 / 1024} MB) を超えています。")
-        
-        # (zip内部走査、ウイルススキャン、ハッシュチェックなどのロジックもここに統合可能)
-        # ... 今回は簡単のため、主要なチェックのみ実装 ...
+        # アップロードAPI (upload_app) と同じ検証を行う
+        temp_file_path = upload_temp_path(app_file.filename)
+        try:
+            file_size, package_sha256 = await validate_upload(app_file, temp_file_path)
+        except HTTPException as e:
+            raise ValueError(e.detail)
 
-        print("ファイル検証OK")
+        # アイコンのサムネイルを生成する (フォームで指定がなければパッケージ内の画像を使う)
+        icon_url = None
+        if icon_file is not None and icon_file.filename:
+            # 上限を1バイト超えた分まで読めば、大きすぎることは判定できる
+            icon_url = await icons.ingest_icon(await icon_file.read(icons.MAX_ICON_BYTES + 1))
+        else:
+            package_icon = await run_in_threadpool(icons.find_icon_in_zip, temp_file_path)
+            if package_icon:
+                try:
+                    icon_url = await icons.ingest_icon(package_icon)
+                except icons.InvalidIconError as e:
+                    # パッケージ内の画像が使えなくても、アプリの登録は続ける
+                    logger.warning("パッケージ内のアイコンを使用できません", extra={"error": str(e)})
         
-        # 1. (仮)永続ストレージへのアップロードとURL取得
-        # 本来はここでS3などにアップロードし、そのURLを取得する。
-        # 今回はダミーのURLを生成する。
-        # ファイル名を少しユニークにする（本来はUUIDなどが望ましい）
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        unique_filename = f"{timestamp}_{app_file.filename}"
-        dummy_download_url = f"https://cat-box-apps-dummy.s3.amazonaws.com/{unique_filename}"
-        print(f"ダミーのダウンロードURLを生成: {dummy_download_url}")
+        # 1. パッケージを保存し、ダウンロードURLを取得
+        # パッケージは内容のSHA-256で保存し、このサーバーの /packages/ から配信する。
+        # (将来S3などの外部ストレージに移す場合は、ここでアップロードしてそのURLを使う)
+        # (マニフェストの作成で全ファイルを展開・ハッシュ計算するので、スレッドで行う)
+        await run_in_threadpool(packages.store_package, temp_file_path, package_sha256)
+        download_url = packages.package_url(package_sha256)
         
         # 2. データベースに保存するためのデータを準備
         app_data = {
             "name": name,
             "version": version,
             "description": description,
-            "download_url": dummy_download_url
+            "download_url": download_url,
+            "icon_url": icon_url,
+            "package_sha256": package_sha256,
+            "package_size": file_size
         }
         
         # 3. CRUD関数を呼び出してデータベースにアプリ情報を保存
@@ -275,15 +416,233 @@ async def handle_app_upload(
         if 'temp_file_path' in locals() and os.path.exists(temp_file_path):
             os.remove(temp_file_path)
 
+    context["my_apps"] = render_my_apps(context["current_user"])
     return templates.TemplateResponse("mypage.html", context)
 
-@app.get("/api/v1/apps/", response_model=List[models.AppSchema])
-def read_apps(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@router.get("/icons/{digest}/{size}.webp")
+def get_icon(digest: str, size: int):
+    """
+    アイコンのサムネイルを返す。
+    URLは画像の内容から決まり、同じURLの内容が変わることはないので、永続キャッシュを許可する。
+    """
+    if not icons.is_valid_digest(digest) or size not in icons.ICON_SIZES:
+        raise HTTPException(status_code=404, detail="Icon not found")
+
+    path = icons.icon_path(digest, size)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Icon not found")
+
+    return FileResponse(
+        path,
+        media_type="image/webp",
+        headers={"Cache-Control": "public, max-age=31536000, immutable", "ETag": f'"{digest}-{size}"'},
+    )
+
+@router.api_route("/packages/{digest}.zip", methods=["GET", "HEAD"])
+def download_package(digest: str):
+    """
+    アプリのパッケージを返す。
+    Range リクエスト (中断からの再開・分割ダウンロード) と、ETag による条件付きリクエストに対応する。
+    """
+    response = packages.package_response(digest)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Package not found")
+    return response
+
+@router.get("/packages/{digest}.manifest.json")
+def read_package_manifest(digest: str):
+    """パッケージ内のファイルの一覧 (パス・サイズ・SHA-256) を返す"""
+    manifest = packages.load_manifest(digest) if icons.is_valid_digest(digest) else None
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="Package not found")
+    return Response(
+        content=json.dumps(manifest, ensure_ascii=False, separators=(",", ":")),
+        media_type="application/json",
+        headers={"Cache-Control": packages.PACKAGE_CACHE_CONTROL, "ETag": f'"{digest}-manifest"'},
+    )
+
+@router.api_route("/packages/deltas/{base_digest}/{target_digest}.zip", methods=["GET", "HEAD"])
+def download_package_delta(base_digest: str, target_digest: str, db: Session = Depends(get_db)):
+    """
+    同じアプリの2つのバージョン間の差分パッケージ (変わったファイルだけを入れたzip) を返す。
+    差分がパッケージ全体より小さくならない場合も404を返すので、ランチャーは全体をダウンロードする。
+    """
+    if not crud.is_same_app_packages(db, base_digest, target_digest):
+        raise HTTPException(status_code=404, detail="Delta not found")
+    response = packages.delta_response(base_digest, target_digest)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Delta not found")
+    return response
+
+@router.get("/metrics")
+def read_metrics(request: Request):
+    """
+    Prometheus のテキスト形式でメトリクスを返す (値はこのワーカープロセスの分だけ)。
+    METRICS_TOKEN が設定されている場合は、Authorization: Bearer <トークン> が必要。
+    """
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(content=metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def require_admin(request: Request):
+    """
+    管理用エンドポイントの認証。ADMIN_TOKEN が設定されていなければ、エンドポイント自体を存在しないものとして扱う。
+    """
+    if not sampling_profiler.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not sampling_profiler.check_admin_token(request.headers.get("authorization")):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@router.post("/admin/profiler/start", dependencies=[Depends(require_admin)])
+def start_profiler(body: models.ProfilerStartRequest):
+    """
+    このワーカーでサンプリングプロファイルを開始する。
+    結果は終了後に PROFILE_DIR に collapsed stacks 形式で保存される。
+    """
+    try:
+        session = sampling_profiler.profiler.start(
+            duration=body.duration, sample_rate=body.sample_rate, route=body.route, interval=body.interval
+        )
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return session.status()
+
+@router.post("/admin/profiler/stop", dependencies=[Depends(require_admin)])
+def stop_profiler():
+    """実行中のプロファイルを終了する"""
+    session = sampling_profiler.profiler.stop()
+    if session is None:
+        raise HTTPException(status_code=409, detail="No profiling session is running in this worker.")
+    return session.status()
+
+@router.get("/admin/profiler/status", dependencies=[Depends(require_admin)])
+def profiler_status():
+    """実行中 (なければ直前) のプロファイルの状態"""
+    session = sampling_profiler.profiler.session or sampling_profiler.profiler.last_session
+    return {"running": sampling_profiler.profiler.session is not None, "session": session.status() if session else None}
+
+@router.get("/api/v1/apps/", response_model=List[models.AppSchema])
+def read_apps(request: Request, skip: int = 0, limit: int = 100, after_id: int = 0,
+              db: Session = Depends(get_db)):
+    """
+    登録されているアプリケーションのリストを、ID順にデータベースから取得します。
+    続きのページは、前のページの最後のIDを after_id に指定して取得する。
+    X-Catalog-Cursor ヘッダーで、差分同期 (/api/v1/apps/changes) の開始カーソルを返す。
+    カーソルは差分同期と同じく、CATALOG_CHANGES_SETTLE_SECONDS より前の変更までにする
+    (まだコミットされていない小さい seq の変更を、一覧にも差分にも含めずに飛ばさないため)。
+    カタログは変更のたびに変更履歴の seq が進むので、最大の seq をETagにして、
+    変わっていなければ本文なしの304を返す (ランチャーがキャッシュ済みの一覧を確認するため)。
+    """
+    # 一覧より先にカーソルを読むことで、取得中に追加されたアプリも次回の差分で受け取れる
+    settled_before = datetime.utcnow() - timedelta(seconds=CATALOG_CHANGES_SETTLE_SECONDS)
+    max_seq, settled_seq = crud.get_catalog_cursor_bounds(db, settled_before)
+    cursor = str(settled_seq)
+    etag = f'"catalog-{max_seq}-{after_id}-{skip}-{limit}"'
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "X-Catalog-Cursor": cursor})
+    apps = crud.get_apps(db, skip=skip, limit=limit, after_id=after_id)
+    # ランチャーは一覧全体を数百件ずつのページで取得するので、ページごとにgzip圧縮して返す
+    content = [models.AppSchema.model_validate(app, from_attributes=True).model_dump(mode="json") for app in apps]
+    return gzip_json_response(request, content, headers={"X-Catalog-Cursor": cursor, "ETag": etag})
+
+@router.get("/api/v1/apps/changes", response_model=models.CatalogChangesSchema, response_model_exclude_none=True)
+def read_app_changes(since: int = 0, limit: int = CATALOG_CHANGES_DEFAULT_LIMIT, db: Session = Depends(get_db)):
+    """
+    カーソル (since) 以降に追加・更新・非公開化されたアプリだけを返す (ランチャーの差分同期用)。
+    同じアプリに複数の変更があった場合は最新の状態だけを返す。
+    カーソルが古すぎて履歴が残っていない場合は 410 を返すので、全件を取得し直すこと。
+    """
+    limit = max(1, min(limit, CATALOG_CHANGES_MAX_LIMIT))
+    min_seq, max_seq = crud.get_catalog_change_bounds(db)
+    if (min_seq is not None and since < min_seq - 1) or since > (max_seq or 0):
+        raise HTTPException(status_code=410, detail="Cursor is too old. Full resync required.")
+
+    settled_before = datetime.utcnow() - timedelta(seconds=CATALOG_CHANGES_SETTLE_SECONDS)
+    changes = crud.get_catalog_changes(db, since, limit, settled_before)
+
+    # アプリごとに最後の操作だけを残す
+    latest_ops = {}
+    for change in changes:
+        latest_ops[change.app_id] = change.op
+    upsert_ids = [app_id for app_id, op in latest_ops.items() if op == "upsert"]
+    apps = crud.get_apps_by_ids(db, upsert_ids)
+    found_ids = {app.id for app in apps}
+
+    return {
+        "cursor": changes[-1].seq if changes else since,
+        "has_more": len(changes) == limit,
+        "upserts": apps,
+        # 履歴にはあるがアプリ自体が見つからない場合も削除として扱う
+        "deletes": [app_id for app_id, op in latest_ops.items() if op == "delete" or (op == "upsert" and app_id not in found_ids)],
+    }
+
+def gzip_json_response(request: Request, content, headers: Optional[dict] = None) -> Response:
+    """
+    JSONレスポンスを返す。一定サイズ以上で、クライアントがgzipに対応していれば圧縮する。
+    (ダウンロードなど既に圧縮済みのレスポンスまで圧縮しないよう、アプリ全体ではなく個別に適用する)
+    """
+    body = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    headers = {**(headers or {}), "Vary": "Accept-Encoding"}
+    if len(body) >= GZIP_MINIMUM_SIZE and "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@router.post("/api/v1/apps/versions:batchGet", response_model=models.VersionBatchGetResponse)
+def batch_get_app_versions(request: Request, body: models.VersionBatchGetRequest, db: Session = Depends(get_db)):
     """
-    登録されているアプリケーションのリストをデータベースから取得します。
+    インストール済みアプリのバージョンをまとめて確認し、新しいバージョンがあるものだけを返す。
+    ランチャー起動時の更新確認を1回のリクエストで済ませるためのエンドポイント。
     """
-    apps = crud.get_apps(db, skip=skip, limit=limit)
-    return apps
+    if len(body.apps) > VERSION_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many apps in one request. The limit is {VERSION_BATCH_MAX_ITEMS}."
+        )
+
+    installed_versions = {item.id: item.version for item in body.apps}
+    latest = crud.get_latest_versions(db, list(installed_versions))
+
+    updates = []
+    for installed_id, app in latest.items():
+        if crud.version_key(app.version) <= crud.version_key(installed_versions[installed_id]):
+            continue
+        updates.append({
+            "installed_id": installed_id,
+            "id": app.id,
+            "name": app.name,
+            "version": app.version,
+            "download_url": app.download_url,
+            "package_sha256": app.package_sha256,
+            "package_size": app.package_size,
+        })
+    return gzip_json_response(request, {"updates": updates})
+
+@router.get("/api/v1/events/catalog")
+async def stream_catalog_events(request: Request):
+    """
+    カタログの変更 (アプリの追加・更新・非公開化) を Server-Sent Events で配信する。
+    イベントIDは変更履歴の seq なので、再接続したランチャーは
+    /api/v1/apps/changes?since=<最後に受け取ったID> で取りこぼしを補える。
+    送信が追いつかない接続はサーバー側から切断する。
+    """
+    subscriber = events.broker.subscribe()
+
+    async def event_stream():
+        try:
+            # 接続直後にコメントを送り、プロキシにヘッダーを確定させる
+            yield ": connected\n\n"
+            while not subscriber.dropped:
+                item = await subscriber.queue.get()
+                yield events.format_sse(item)
+        finally:
+            events.broker.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # 既存の @app.post("/api/v1/users/", ... ) の前にこのエンドポイントを置く
 
@@ -296,7 +655,7 @@ def run_virus_scan(file_path: str) -> bool:
     :param file_path: スキャン対象のファイルパス
     :return: 安全であればTrue, ウイルスが検出されればFalseを返す
     """
-    print(f"--- Running dummy virus scan on {file_path} ---")
+    logger.info("ダミーのウイルススキャンを実行します", extra={"path": file_path})
     # 【本番実装の例】
     # try:
     #     result = subprocess.run(
@@ -325,44 +684,104 @@ def run_virus_scan(file_path: str) -> bool:
     
     # 【現在のダミー実装】
     # 常に安全であると仮定してTrueを返す
-    print("--- Scan result: OK (Dummy) ---")
+    logger.info("スキャン結果: OK (ダミー)", extra={"path": file_path})
     return True
 
+def calculate_sha256(file_path: str) -> str:
+    """ファイルのSHA-256ハッシュ (16進数) を計算する"""
+    sha256_hash = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        # メモリを効率的に使うため、ファイルをチャンクで読み込む
+        for byte_block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256_hash.update(byte_block)
+    return sha256_hash.hexdigest()
+
 # --- ヘルパー関数に追記 ---
-def check_file_hash(file_path: str) -> bool:
+def check_file_hash(file_path: str, file_hex_hash: Optional[str] = None) -> bool:
     """
     ファイルのSHA-256ハッシュを計算し、ブラックリストに存在しないか確認する。
     
     :param file_path: チェック対象のファイルパス
+    :param file_hex_hash: 計算済みのハッシュ (省略時はここで計算する)
     :return: ブラックリストに含まれていなければTrue, 含まれていればFalse
     """
-    print(f"--- Checking file hash for {file_path} ---")
-    sha256_hash = hashlib.sha256()
     try:
-        with open(file_path, "rb") as f:
-            # メモリを効率的に使うため、ファイルをチャンクで読み込む
-            for byte_block in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(byte_block)
-        
-        file_hex_hash = sha256_hash.hexdigest()
-        print(f"--- File hash (SHA-256): {file_hex_hash} ---")
-
+        if file_hex_hash is None:
+            file_hex_hash = calculate_sha256(file_path)
         if file_hex_hash in KNOWN_MALWARE_HASHES:
-            print("--- HASH MATCH: Known malicious file detected! ---")
+            logger.warning("既知の不正なファイルと一致しました", extra={"path": file_path, "sha256": file_hex_hash})
             return False
         else:
-            print("--- HASH OK: File is not on the blacklist. ---")
+            logger.info("ハッシュチェックOK", extra={"path": file_path, "sha256": file_hex_hash})
             return True
 
     except IOError as e:
-        print(f"--- ERROR: Could not read file for hashing: {e} ---")
+        logger.error("ハッシュ計算のためにファイルを読み込めません", extra={"path": file_path, "error": str(e)})
         return False # ファイルが読めないなど問題があれば安全側に倒す
 
-@app.post("/api/v1/apps/upload")
-async def upload_app(file: UploadFile = File(...)):
+def inspect_zip(file_path: str):
     """
-    アプリケーションのzipファイルをアップロードします。
-    ファイルサイズ、コンテントタイプ、zip内部の検証を追加。
+    アップロードされたzipの中身を検証する (ファイル数・拡張子・展開後のサイズ・圧縮率)。
+    展開はせず、zipの目次 (セントラルディレクトリ) の情報だけで判定する。
+    :raises HTTPException: 条件を満たさない場合 (400)
+    """
+    try:
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            # 1. ファイル数の検証
+            file_list = zip_ref.infolist()
+            if len(file_list) > MAX_FILES_IN_ZIP:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Too many files in zip. Exceeds the limit of {MAX_FILES_IN_ZIP} files."
+                )
+
+            total_size = 0
+            for file_info in file_list:
+                # ディレクトリはスキップ
+                if file_info.is_dir():
+                    continue
+
+                # 2. 拡張子の検証
+                _, extension = os.path.splitext(file_info.filename)
+                if not extension or extension.lower() not in ALLOWED_EXTENSIONS:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Disallowed file type found in zip: {file_info.filename}"
+                    )
+
+                # 3. 展開後のサイズと圧縮率の検証
+                total_size += file_info.file_size
+                if total_size > MAX_UNCOMPRESSED_SIZE:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Uncompressed size exceeds the limit of {MAX_UNCOMPRESSED_SIZE / 1024 / 1024} MB."
+                    )
+                if file_info.file_size > max(file_info.compress_size, 1) * MAX_COMPRESSION_RATIO:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Compression ratio of {file_info.filename} exceeds the limit of {MAX_COMPRESSION_RATIO}."
+                    )
+
+            logger.info("zipファイルの検査OK", extra={"path": file_path, "entries": len(file_list), "uncompressed_size": total_size})
+
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Invalid zip file.")
+
+def upload_temp_path(filename: str) -> str:
+    """
+    アップロードを検証する間の一時ファイルのパス。
+    検証はスレッドで行うので、同じファイル名の同時アップロードが同じファイルを使わないよう、ランダムな接頭辞を付ける
+    """
+    return os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}-{os.path.basename(filename or 'upload.zip')}")
+
+async def validate_upload(file: UploadFile, temp_file_path: str) -> Tuple[int, str]:
+    """
+    アップロードされたzipを一時ファイルに保存し、検証する (Webのフォームとアップロード API で共通)。
+    各段階の時間は metrics.upload_stage で計測する。ファイルを読む段階は、イベントループを止めないようスレッドで行う。
+    一時ファイルの削除は呼び出し元で行う。
+
+    :return: (ファイルサイズ, SHA-256)
+    :raises HTTPException: 検証に失敗した場合 (400 / 413)
     """
     if file.content_type not in ["application/zip", "application/x-zip-compressed"]:
         raise HTTPException(
@@ -370,11 +789,11 @@ async def upload_app(file: UploadFile = File(...)):
             detail=f"Invalid file type: {file.content_type}. Only .zip files are allowed."
         )
 
-    temp_file_path = os.path.join(UPLOAD_DIR, file.filename)
-    try:
+    with metrics.upload_stage("save"):
         with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+            await run_in_threadpool(shutil.copyfileobj, file.file, buffer)
 
+    with metrics.upload_stage("size_check"):
         file_size = os.path.getsize(temp_file_path)
         if file_size > MAX_FILE_SIZE:
             raise HTTPException(
@@ -382,57 +801,47 @@ async def upload_app(file: UploadFile = File(...)):
                 detail=f"File size {file_size / 1024 / 1024:.2f} MB exceeds the limit of {MAX_FILE_SIZE / 1024 / 1024} MB."
             )
 
-        # --- ここからzip内部の検証ロジック ---
-        print(f"Inspecting zip file: {temp_file_path}")
+    logger.info("zipファイルを検査します", extra={"path": temp_file_path})
+    with metrics.upload_stage("zip_inspection"):
+        await run_in_threadpool(inspect_zip, temp_file_path)
+
+    with metrics.upload_stage("virus_scan"):
+        scan_ok = await run_in_threadpool(run_virus_scan, temp_file_path)
+    if not scan_ok:
+        raise HTTPException(
+            status_code=400,
+            detail="A virus was detected in the uploaded file."
+        )
+
+    # ハッシュはパッケージの保存にも使うので、ここで1回だけ計算する
+    with metrics.upload_stage("hash_check"):
         try:
-            with zipfile.ZipFile(temp_file_path, 'r') as zip_ref:
-                # 1. ファイル数の検証
-                file_list = zip_ref.infolist()
-                if len(file_list) > MAX_FILES_IN_ZIP:
-                    raise HTTPException(
-                        status_code=400,
-                        detail=f"Too many files in zip. Exceeds the limit of {MAX_FILES_IN_ZIP} files."
-                    )
-                
-                # 2. 拡張子の検証
-                for file_info in file_list:
-                    # ディレクトリはスキップ
-                    if file_info.is_dir():
-                        continue
-                    
-                    # ファイル名から拡張子を取得
-                    _, extension = os.path.splitext(file_info.filename)
-                    if not extension or extension.lower() not in ALLOWED_EXTENSIONS:
-                        raise HTTPException(
-                            status_code=400,
-                            detail=f"Disallowed file type found in zip: {file_info.filename}"
-                        )
-                        
-                print("Zip file inspection passed.")
-
-        except zipfile.BadZipFile:
-            raise HTTPException(status_code=400, detail="Invalid zip file.")
-        # --- zip内部の検証ロジックここまで ---
-
-        # --- ここからウイルススキャン ---
-        if not run_virus_scan(temp_file_path):
-            raise HTTPException(
-                status_code=400,
-                detail="A virus was detected in the uploaded file."
-            )
-        # --- ウイルススキャンここまで ---
+            package_sha256 = await run_in_threadpool(calculate_sha256, temp_file_path)
+        except IOError:
+            package_sha256 = None
+        hash_ok = package_sha256 is not None and check_file_hash(temp_file_path, package_sha256)
+    if not hash_ok:
+        raise HTTPException(
+            status_code=400,
+            detail="The uploaded file is on the blacklist."
+        )
 
-        # --- ここからハッシュ値チェック ---
-        if not check_file_hash(temp_file_path):
-            raise HTTPException(
-                status_code=400,
-                detail="The uploaded file is on the blacklist."
-            )
-        # --- ハッシュ値チェックここまで ---
+    return file_size, package_sha256
 
-        print(f"Received file: {file.filename}")
-        print(f"Content-Type: {file.content_type}")
-        print(f"File size: {file_size} bytes")
+@router.post("/api/v1/apps/upload")
+async def upload_app(file: UploadFile = File(...)):
+    """
+    アプリケーションのzipファイルをアップロードします。
+    ファイルサイズ、コンテントタイプ、zip内部の検証を追加。
+    """
+    temp_file_path = upload_temp_path(file.filename)
+    try:
+        file_size, _ = await validate_upload(file, temp_file_path)
+
+        logger.info(
+            "アップロードを受け付けました",
+            extra={"upload_filename": file.filename, "content_type": file.content_type, "size": file_size},
+        )
         
         # 検証が終わったら、本来はここでファイルを永続的なストレージ(S3など)に移動する
         # 今はまだ何もしない
@@ -446,7 +855,7 @@ async def upload_app(file: UploadFile = File(...)):
 
 # (upload_app エンドポイントの下に追記)
 
-@app.post("/api/v1/users/", response_model=models.UserSchema)
+@router.post("/api/v1/users/", response_model=models.UserSchema)
 def create_user(user: models.UserCreate, db: Session = Depends(get_db)):
     """
     新しいユーザーを作成（ユーザー登録）
@@ -464,27 +873,167 @@ def create_user(user: models.UserCreate, db: Session = Depends(get_db)):
     # 新しいユーザーをデータベースに作成
     return crud.create_user(db=db, user=user)    
 
-@app.post("/api/v1/token")
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+@router.post("/api/v1/token")
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """
     ユーザー名とパスワードで認証し、アクセストークンを発行する。
     """
-    # ユーザーをメールアドレス（ユーザー名として使用）で検索
-    user = crud.get_user_by_email(db, email=form_data.username)
+    # ユーザーをメールアドレス（ユーザー名として使用）で検索し、パスワードを検証
+    try:
+        user = await authenticate_user(db, form_data.username, form_data.password)
+    except HashingBusyError:
+        raise HTTPException(
+            status_code=429, # Too Many Requests
+            detail="Too many login attempts in progress. Please retry later.",
+            headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER)},
+        )
     
     # ユーザーが存在しない、またはパスワードが間違っている場合
-    if not user or not security.verify_password(form_data.password, user.hashed_password):
+    if not user:
         raise HTTPException(
             status_code=401, # Unauthorized
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # アクセストークンを生成
-    access_token_expires = timedelta(minutes=security.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = security.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
-    )
+    # アクセストークンとリフレッシュトークンを生成
+    access_token, refresh_token = issue_tokens(db, user)
     
     # トークンを返す
-    return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+@router.post("/api/v1/token/refresh")
+def refresh_access_token(body: models.TokenRefreshRequest, db: Session = Depends(get_db)):
+    """
+    リフレッシュトークンを新しいアクセストークン・リフレッシュトークンの組に交換する。
+    パスワード (bcrypt) の検証を行わず、セッションテーブルのインデックス検索だけで済む。
+    使用済みのリフレッシュトークンは無効になり、再利用された場合はそのログインの全セッションを無効化する。
+    """
+    rotated = sessions.rotate_session(db, body.refresh_token)
+    if rotated is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid or expired refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    email, new_refresh_token, session_id = rotated
+    access_token = security.create_access_token(data={"sub": email, "sid": session_id})
+    return {"access_token": access_token, "refresh_token": new_refresh_token, "token_type": "bearer"}
+
+@router.post("/api/v1/logout", status_code=204)
+def api_logout(body: models.TokenRefreshRequest, db: Session = Depends(get_db)):
+    """
+    ランチャー向けのログアウト。リフレッシュトークンが属するセッションをすべて無効化する。
+    """
+    sessions.end_session(db, body.refresh_token)
+    return Response(status_code=204)
+# --- アプリケーションの組み立て ---
+# このモジュールはインポートしただけでは何も作らない。重い準備はワーカーごとに1回だけ行う。
+#   - create_app() の中: テンプレートのコンパイル、ブラックリストの読み込み、キャッシュの計測の登録など、fork しても安全なもの。
+#     gunicorn の --preload ではマスタープロセスで1回だけ実行され、各ワーカーはそれを共有する。
+#       gunicorn server.main:app -k uvicorn.workers.UvicornWorker --preload -w 4
+#   - lifespan の中: DBエンジンの作成と計測、ディレクトリの作成、シグナルハンドラーなど、ワーカーごとに必要なもの。
+#   - 初回利用時: プロセスプール (bcrypt・アイコン生成)。fork をまたいで共有できないため遅延作成する。
+# server.main:app は、初めて参照されたときに create_app() で作成する (モジュールの __getattr__)。
+# uvicorn で直接ファクトリーを使う場合: uvicorn server.main:create_app --factory
+
+def load_malware_hashes(path: Optional[str] = MALWARE_HASHES_FILE):
+    """ブラックリストのファイルを読み込み、KNOWN_MALWARE_HASHES に追加する"""
+    if not path:
+        return
+    with open(path, encoding="utf-8") as f:
+        hashes = {line.strip().lower() for line in f if line.strip() and not line.startswith("#")}
+    KNOWN_MALWARE_HASHES.update(hashes)
+    logger.info("ブラックリストを読み込みました", extra={"path": path, "count": len(hashes)})
+
+def create_templates() -> Jinja2Templates:
+    """テンプレートの設定を作成する"""
+    jinja_templates = Jinja2Templates(directory=TEMPLATE_DIR)
+    # アイコンURLから srcset を組み立てるフィルター
+    jinja_templates.env.filters["icon_srcset"] = icons.icon_srcset
+    return jinja_templates
+
+def warm_templates():
+    """全テンプレートを事前にコンパイルしておき、最初のリクエストでの遅延をなくす"""
+    for name in templates.env.list_templates():
+        templates.get_template(name)
+
+@asynccontextmanager
+async def lifespan(application: FastAPI):
+    """ワーカーの起動・終了時の処理"""
+    started = time.perf_counter()
+    # DBエンジンは fork したあとのワーカーで作る (接続プールをプロセス間で共有しないため)
+    engine = database.init_engine()
+    metrics.instrument_engine(engine)
+    if query_profiler.QUERY_PROFILER_ENABLED:
+        query_profiler.instrument_engine(engine)
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    if os.getenv("PROFILER_SIGNAL", "0") == "1":
+        sampling_profiler.install_signal_handler()
+    logger.info("ワーカーを起動しました", extra={
+        "pid": os.getpid(),
+        "startup_ms": round((time.perf_counter() - started) * 1000, 2),
+    })
+    try:
+        yield
+    finally:
+        events.broker.stop()
+        password_hasher.shutdown()
+        icons.shutdown()
+        database.dispose_engine()
+        logger.info("ワーカーを終了しました", extra={"pid": os.getpid()})
+
+def create_app() -> FastAPI:
+    """
+    FastAPIアプリケーションを作成する。
+    ミドルウェアは後に追加したものほど外側になる。
+    """
+    global templates
+    security.check_signing_keys()
+    application = FastAPI(title="Cat-box API", lifespan=lifespan)
+
+    # --- レート制限 ---
+    application.add_middleware(
+        RateLimitMiddleware,
+        policies=RATE_LIMIT_POLICIES,
+        backend=DatabaseBackend() if RATE_LIMIT_BACKEND == "database" else MemoryBackend(),
+        enabled=os.getenv("RATE_LIMIT_ENABLED", "1") == "1",
+    )
+    # --- CORS ---
+    application.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"], # 全てのHTTPメソッドを許可 (GET, POST, etc.)
+        allow_headers=["*"], # 全てのヘッダーを許可
+    )
+    # --- SQLクエリのプロファイラー (QUERY_PROFILER_ENABLED=1 のときだけ) ---
+    # 計測ミドルウェアより内側に置き、ログにリクエストIDが付くようにする
+    if query_profiler.QUERY_PROFILER_ENABLED:
+        application.add_middleware(query_profiler.QueryProfilerMiddleware)
+    # --- サンプリングプロファイラー (管理用エンドポイントまたは SIGUSR2 で開始) ---
+    application.add_middleware(sampling_profiler.SamplingProfilerMiddleware)
+    # --- 計測 ---
+    # リクエストIDの割り当てとレイテンシの記録。レート制限で拒否されたリクエストも数えるよう、一番外側に置く。
+    application.add_middleware(metrics.InstrumentationMiddleware)
+
+    application.include_router(router)
+
+    # --- 計測 (キャッシュのヒット率。同じ名前で登録し直しても1つにまとまる) ---
+    metrics.register_cache("token_claims", security.claims_cache)
+    metrics.register_cache("refresh_session", sessions.session_cache)
+    metrics.register_cache("html_fragment", fragment_cache)
+
+    load_malware_hashes()
+    templates = create_templates()
+    warm_templates()
+    return application
+
+def __getattr__(name):
+    # server.main:app を参照したときに、初めてアプリを作成する (インポートしただけでは作らない)
+    if name == "app":
+        application = create_app()
+        globals()["app"] = application
+        return application
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
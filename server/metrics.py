@@ -0,0 +1,302 @@
+import itertools
+import os
+import re
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event as sa_event
+
+from .logs import request_id_var
+
+# --- メトリクス ---
+# リクエストのレイテンシ、アップロード検証の各段階の所要時間、DBクエリのレイテンシ、
+# キャッシュのヒット数を集計し、/metrics で Prometheus のテキスト形式で返す。
+#
+# 外部ライブラリを使わず、必要な Histogram だけを実装している (カウンターは collector で出力する)。
+# 集計はワーカープロセスごとなので、Prometheus からは各ワーカーを別のターゲットとしてスクレイプすること。
+# 記録1回のコストは、ロック1回と bisect 1回程度 (benchmarks/bench_metrics.py で計測できる)。
+
+# 既定のバケット境界 (秒)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# DBクエリ用 (HTTPより短い時間に寄せる)
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+REQUEST_ID_HEADER = b"x-request-id"
+# クライアントから受け取るリクエストIDとして許可する形式 (ログやヘッダーを汚さないため)
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._\-]{1,64}$")
+
+
+# リクエストIDは「プロセスごとのランダムな接頭辞 + 連番」で作る (リクエストごとに uuid4 を作るより軽い)
+_request_id_prefix = uuid.uuid4().hex[:12]
+_request_id_counter = itertools.count(1)
+
+
+def _reset_request_id_prefix():
+    """fork した子プロセスが親と同じIDを作らないよう、接頭辞を作り直す"""
+    global _request_id_prefix, _request_id_counter
+    _request_id_prefix = uuid.uuid4().hex[:12]
+    _request_id_counter = itertools.count(1)
+
+
+os.register_at_fork(after_in_child=_reset_request_id_prefix)
+
+
+def new_request_id() -> str:
+    return f"{_request_id_prefix}-{next(_request_id_counter):x}"
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    """
+    所要時間などの分布を、固定のバケットで集計するヒストグラム。
+    バケットごとの件数は累積せずに持ち、出力時に累積する (記録を軽くするため)。
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベルの値 -> [各バケットの件数 (最後は +Inf), 合計, 件数]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *labelvalues: str) -> "_Timer":
+        """with ブロックの所要時間を記録する"""
+        return _Timer(self, labelvalues)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labelvalues, (list(s[0]), s[1], s[2])) for labelvalues, s in self._series.items()]
+        for labelvalues, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class _Timer:
+    """Histogram.time() の戻り値。例外で抜けた場合も記録する"""
+
+    __slots__ = ("histogram", "labelvalues", "start")
+
+    def __init__(self, histogram: Histogram, labelvalues: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelvalues)
+        return False
+
+
+class Registry:
+    """
+    メトリクスの登録先。
+    collector には、出力時に呼ばれて [(名前, 種類, 説明, [(ラベル辞書, 値), ...]), ...] を返す関数を登録する
+    (既存のキャッシュが持つカウンターなど、値を別の場所で管理しているもの用)。
+    """
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], Iterable]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable]):
+        self._collectors.append(collector)
+        return collector
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, kind, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.register(Histogram(
+    "catbox_http_request_duration_seconds",
+    "HTTP request latency by route template.",
+    ("method", "route", "status"),
+))
+UPLOAD_STAGE_LATENCY = registry.register(Histogram(
+    "catbox_upload_stage_duration_seconds",
+    "Duration of each upload validation stage.",
+    ("stage", "outcome"),
+))
+DB_QUERY_LATENCY = registry.register(Histogram(
+    "catbox_db_query_duration_seconds",
+    "Database query latency by statement type.",
+    ("operation",),
+    buckets=DB_BUCKETS,
+))
+
+
+class _Stage:
+    """アップロード検証の1段階の所要時間と、成功/失敗を記録する"""
+
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        outcome = "ok" if exc_type is None else "error"
+        UPLOAD_STAGE_LATENCY.observe(time.perf_counter() - self.start, self.stage, outcome)
+        return False
+
+
+def upload_stage(stage: str) -> _Stage:
+    """
+    アップロード検証の段階を計測する。
+    例: with metrics.upload_stage("zip_inspection"): ...
+    段階名: save, size_check, zip_inspection, virus_scan, hash_check
+    """
+    return _Stage(stage)
+
+
+# --- DBクエリの計測 ---
+_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"}
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_start_time")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement else ""
+    DB_QUERY_LATENCY.observe(elapsed, operation if operation in _OPERATIONS else "OTHER")
+
+
+def instrument_engine(engine):
+    """エンジンの全クエリのレイテンシを記録する (何度呼んでも1回だけ登録する)"""
+    if sa_event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    sa_event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    sa_event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# --- キャッシュのヒット率 ---
+_caches: Dict[str, object] = {}
+
+
+def register_cache(name: str, cache):
+    """hits / misses 属性を持つキャッシュを、ヒット数・ミス数として出力する"""
+    _caches[name] = cache
+
+
+@registry.register_collector
+def _collect_caches():
+    hits = [({"cache": name}, cache.hits) for name, cache in _caches.items()]
+    misses = [({"cache": name}, cache.misses) for name, cache in _caches.items()]
+    return [
+        ("catbox_cache_hits_total", "counter", "Cache hits by cache name.", hits),
+        ("catbox_cache_misses_total", "counter", "Cache misses by cache name.", misses),
+    ]
+
+
+# --- リクエストの計測 ---
+class InstrumentationMiddleware:
+    """
+    リクエストごとにIDを割り当ててログに含め、ルートごとのレイテンシを記録するASGIミドルウェア。
+    クライアントが X-Request-ID を送ってきた場合は、その値を引き継ぐ (ランチャーのログと突き合わせるため)。
+    ラベルにはURLではなくルートのテンプレート (/packages/{digest}.zip など) を使い、系列数が増えすぎないようにする。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id: Optional[str] = None
+        for key, value in scope["headers"]:
+            if key == REQUEST_ID_HEADER:
+                candidate = value.decode("latin-1")
+                if _REQUEST_ID_RE.match(candidate):
+                    request_id = candidate
+                break
+        if request_id is None:
+            request_id = new_request_id()
+        token = request_id_var.set(request_id)
+        encoded_id = request_id.encode("latin-1")
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(REQUEST_ID_HEADER, encoded_id)]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - start,
+                scope["method"],
+                route.path if route is not None else "unmatched",
+                str(status),
+            )
+            request_id_var.reset(token)
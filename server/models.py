@@ -1,5 +1,5 @@
 # SQLAlchemy関連のインポート
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, Enum
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, Enum, DateTime, Float, Index
 from sqlalchemy.orm import relationship
 
 # データベース設定をインポート
@@ -37,6 +37,9 @@ class App(Base):
     
     download_url = Column(String, nullable=False)
     icon_url = Column(String)
+    # パッケージ(zip)のSHA-256とサイズ。ランチャーがダウンロード後の検証に使う
+    package_sha256 = Column(String)
+    package_size = Column(Integer)
     
     owner_id = Column(Integer, ForeignKey("users.id"))
 
@@ -46,6 +49,58 @@ class App(Base):
     app_type = Column(Enum('basic', 'premium', name='app_type_enum'), default='basic', nullable=False)
     status = Column(Enum('public', 'private', 'reported', name='status_enum'), default='public', nullable=False)
 
+    # 同じ開発者の同名アプリ (= 同じアプリの別バージョン) をまとめて引くためのインデックス
+    __table_args__ = (Index('ix_apps_owner_id_name', 'owner_id', 'name'),)
+
+
+class UserSession(Base):
+    """
+    リフレッシュトークンに対応するサーバー側セッション。
+    トークンそのものは保存せず、SHA-256ハッシュだけを保存する。
+    リフレッシュのたびに新しい行を作り (ローテーション)、同じログインから
+    派生したセッションは family_id で束ねる。
+    """
+    __tablename__ = "user_sessions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    token_hash = Column(String, unique=True, index=True, nullable=False)
+    family_id = Column(String, index=True, nullable=False)
+
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    # ローテーション済み・ログアウト済みのセッションは revoked=True になる
+    revoked = Column(Boolean, default=False, nullable=False)
+
+    user = relationship("User")
+
+
+class CatalogChange(Base):
+    """
+    カタログ (公開アプリ一覧) の変更履歴。追記専用で、seq は単調に増加する。
+    ランチャーは最後に受け取った seq (カーソル) 以降の変更だけを取得して同期する。
+    op: 'upsert' = 追加・更新, 'delete' = 削除・非公開化
+    """
+    __tablename__ = "catalog_changes"
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    app_id = Column(Integer, ForeignKey("apps.id"), nullable=False, index=True)
+    op = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+
+
+class RateLimitBucket(Base):
+    """
+    レート制限のトークンバケット (複数ワーカーで制限を共有する場合のみ使用)。
+    更新は ratelimit.DatabaseBackend のUPSERTで行う。
+    """
+    __tablename__ = "rate_limit_buckets"
+
+    bucket_key = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False) # UNIX時刻 (秒)
+    allowed = Column(Boolean, nullable=False)
+
 
 # ======== Pydantic Schemas (APIのデータ形式定義) ========
 # これらはAPIの入出力に使われ、パスワードなどの公開すべきでない情報を含まないようにする
@@ -63,6 +118,8 @@ class AppSchema(AppBase):
     id: int
     owner_id: int
     download_url: HttpUrl
+    package_sha256: Optional[str] = None
+    package_size: Optional[int] = None
 
     class Config:
         orm_mode = True # SQLAlchemyモデルをPydanticモデルに変換できるようにする
@@ -80,4 +137,50 @@ class UserSchema(UserBase):
     apps: List[AppSchema] = []
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class TokenRefreshRequest(BaseModel):
+    refresh_token: str
+
+class CatalogChangesSchema(BaseModel):
+    # 次回のリクエストで since に渡すカーソル
+    cursor: int
+    # limit を超える変更が残っている場合はTrue (続けて取得する)
+    has_more: bool
+    # 追加・更新されたアプリ (アプリごとに最新の状態のみ)
+    upserts: List[AppSchema] = []
+    # 削除・非公開化されたアプリのID
+    deletes: List[int] = []
+
+class InstalledAppVersion(BaseModel):
+    id: int
+    version: str
+
+class VersionBatchGetRequest(BaseModel):
+    # ランチャーにインストール済みのアプリ (ID と ローカルのバージョン)
+    apps: List[InstalledAppVersion]
+
+class AppUpdateSchema(BaseModel):
+    # リクエストで指定されたインストール済みアプリのID
+    installed_id: int
+    # 最新バージョンのアプリ情報
+    id: int
+    name: str
+    version: str
+    download_url: str
+    package_sha256: Optional[str] = None
+    package_size: Optional[int] = None
+
+class VersionBatchGetResponse(BaseModel):
+    # 新しいバージョンがあるアプリだけを含む
+    updates: List[AppUpdateSchema] = []
+
+class ProfilerStartRequest(BaseModel):
+    # 計測する秒数 (最大600秒)
+    duration: float = 30.0
+    # 対象にするリクエストの割合 (0〜1)
+    sample_rate: float = 1.0
+    # 指定した場合は、このパスのリクエストだけを対象にする (例: "/mypage")
+    route: Optional[str] = None
+    # サンプリング間隔 (秒)
+    interval: float = 0.005
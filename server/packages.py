@@ -0,0 +1,471 @@
+import hashlib
+import json
+import os
+import re
+import secrets
+import threading
+import zipfile
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import anyio
+from starlette.background import BackgroundTask
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from .icons import PUBLIC_BASE_URL, is_valid_digest
+
+# --- アプリパッケージの保存と配信 ---
+# 検証済みのパッケージ (zip) は、内容のSHA-256をファイル名にして保存する (コンテンツアドレス)。
+# 同じURLの内容が変わることはないので、ETagにはダイジェストをそのまま使い、永続キャッシュを許可する。
+#
+# URL: {PUBLIC_BASE_URL}/packages/<sha256>.zip
+# Range リクエスト (単一・複数) に対応し、ランチャーは中断したダウンロードの再開や分割ダウンロードができる。
+#
+# パッケージごとに、中のファイルの一覧 (パス・サイズ・SHA-256) をマニフェストとして保存しておき、
+# 2つのバージョン間で変わったファイルだけを入れた差分パッケージ (zip) を作って配信する。
+# ランチャーは変わっていないファイルをインストール済みのバージョンから流用し、結果をマニフェストで検証する。
+#
+# URL: {PUBLIC_BASE_URL}/packages/<sha256>.manifest.json
+#      {PUBLIC_BASE_URL}/packages/deltas/<元のsha256>/<新しいsha256>.zip
+PACKAGE_DIR = os.path.join("uploads", "packages")
+PACKAGE_MEDIA_TYPE = "application/zip"
+PACKAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# サーバーがゼロコピー送信に対応していない場合に、1回で読み込んで送るサイズ。
+# スレッドとの往復回数を減らすため、FileResponse (64 KB) より大きくしている。
+PACKAGE_CHUNK_SIZE = int(os.getenv("PACKAGE_CHUNK_SIZE", str(1024 * 1024)))
+# 1リクエストで指定できる範囲の数の上限 (細かい範囲を大量に指定する攻撃への対策)
+MAX_RANGES = 32
+
+# 差分パッケージの中で、新しいバージョンのマニフェストを入れるファイル名
+DELTA_MANIFEST_NAME = ".catbox-delta.json"
+MANIFEST_READ_SIZE = 1024 * 1024
+
+_RANGE_RE = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+# 同じ差分を複数のリクエストで同時に作らないためのロック ((元, 新しい) の組ごと -> [ロック, 使用中の数])
+# 別の組の差分は並行して作れる
+_delta_locks: Dict[Tuple[str, str], list] = {}
+_delta_locks_guard = threading.Lock()
+
+
+def package_path(digest: str) -> str:
+    """保存先のファイルパス (先頭2文字でディレクトリを分ける)"""
+    return os.path.join(PACKAGE_DIR, digest[:2], f"{digest}.zip")
+
+
+def package_url(digest: str) -> str:
+    """パッケージの公開ダウンロードURL"""
+    return f"{PUBLIC_BASE_URL}/packages/{digest}.zip"
+
+
+def manifest_path(digest: str) -> str:
+    return os.path.join(PACKAGE_DIR, digest[:2], f"{digest}.manifest.json")
+
+
+def delta_path(base_digest: str, target_digest: str) -> str:
+    return os.path.join(PACKAGE_DIR, "deltas", base_digest[:2], f"{base_digest}-{target_digest}.zip")
+
+
+def delta_unavailable_path(base_digest: str, target_digest: str) -> str:
+    """差分がパッケージ全体より小さくならなかったことを記録する空のファイル (次回から作り直さない)"""
+    return f"{delta_path(base_digest, target_digest)}.none"
+
+
+def store_package(temp_path: str, digest: str) -> str:
+    """
+    検証済みの一時ファイルをパッケージとして保存し、マニフェストも作成する。
+    同じ内容のパッケージが既にあれば何もしない (一時ファイルは呼び出し元で削除する)。
+    :return: 保存先のパス
+    """
+    path = package_path(digest)
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 途中まで書かれたファイルが配信されないよう、一時ファイル経由で置き換える。
+    # 同じパッケージが別のスレッドで同時に保存されることがあるので、一時ファイルはスレッドごとに分ける
+    partial_path = _partial_path(path)
+    try:
+        with open(temp_path, "rb") as src, open(partial_path, "wb") as dst:
+            while True:
+                chunk = src.read(PACKAGE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                dst.write(chunk)
+        os.replace(partial_path, path)
+    except BaseException:
+        _remove_quietly(partial_path)
+        raise
+    load_manifest(digest)
+    return path
+
+
+def build_manifest(zip_path: str) -> List[Dict[str, object]]:
+    """zip内のファイル (ディレクトリは除く) の一覧を、パス順に [{"path", "size", "sha256"}, ...] で返す"""
+    files = []
+    with zipfile.ZipFile(zip_path) as zip_file:
+        for member in zip_file.infolist():
+            if member.is_dir():
+                continue
+            sha256 = hashlib.sha256()
+            with zip_file.open(member) as f:
+                while True:
+                    chunk = f.read(MANIFEST_READ_SIZE)
+                    if not chunk:
+                        break
+                    sha256.update(chunk)
+            files.append({"path": member.filename, "size": member.file_size, "sha256": sha256.hexdigest()})
+    files.sort(key=lambda entry: entry["path"])
+    return files
+
+
+def load_manifest(digest: str) -> Optional[List[Dict[str, object]]]:
+    """
+    パッケージのマニフェストを返す。この機能より前に保存されたパッケージは、初めて使うときに作成する。
+    パッケージが存在しなければNone
+    """
+    path = manifest_path(digest)
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+    if not is_valid_digest(digest) or not os.path.exists(package_path(digest)):
+        return None
+    files = build_manifest(package_path(digest))
+    _write_atomic(path, json.dumps(files, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    return files
+
+
+def build_delta(base_digest: str, target_digest: str) -> Optional[str]:
+    """
+    base から target への差分パッケージを作成し (作成済みならそのまま)、そのパスを返す。
+    差分パッケージには、base に同じパス・同じ内容のファイルがないものだけと、
+    target のマニフェスト全体 (DELTA_MANIFEST_NAME) を入れる。
+    差分がパッケージ全体より小さくならない場合や、パッケージが存在しない場合はNone
+    (小さくならなかったことは記録しておき、次からは作らずにNoneを返す)
+    """
+    path = delta_path(base_digest, target_digest)
+    if os.path.exists(path):
+        return path
+    if os.path.exists(delta_unavailable_path(base_digest, target_digest)):
+        return None
+    with _pair_lock((base_digest, target_digest)):
+        if os.path.exists(path):
+            return path
+        if os.path.exists(delta_unavailable_path(base_digest, target_digest)):
+            return None
+        return _build_delta(base_digest, target_digest, path)
+
+
+def _build_delta(base_digest: str, target_digest: str, path: str) -> Optional[str]:
+    """(組ごとのロックを持った状態で呼ぶ)"""
+    base_manifest = load_manifest(base_digest)
+    target_manifest = load_manifest(target_digest)
+    if base_manifest is None or target_manifest is None:
+        return None
+
+    unchanged = {(entry["path"], entry["sha256"]) for entry in base_manifest}
+    changed = [entry["path"] for entry in target_manifest if (entry["path"], entry["sha256"]) not in unchanged]
+    delta_manifest = {"base": base_digest, "target": target_digest, "files": target_manifest}
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial_path = _partial_path(path)
+    try:
+        with zipfile.ZipFile(package_path(target_digest)) as src, \
+                zipfile.ZipFile(partial_path, "w", zipfile.ZIP_DEFLATED) as dst:
+            dst.writestr(DELTA_MANIFEST_NAME, json.dumps(delta_manifest, ensure_ascii=False))
+            for name in changed:
+                # 圧縮済みのデータをそのまま書き写せないので、展開して圧縮し直す
+                info = zipfile.ZipInfo(name, date_time=src.getinfo(name).date_time)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with src.open(name) as member, dst.open(info, "w", force_zip64=True) as out:
+                    while True:
+                        chunk = member.read(MANIFEST_READ_SIZE)
+                        if not chunk:
+                            break
+                        out.write(chunk)
+    except BaseException:
+        _remove_quietly(partial_path)
+        raise
+    if os.path.getsize(partial_path) >= os.path.getsize(package_path(target_digest)):
+        os.remove(partial_path)
+        # 小さくならなかったことを記録し、以降のリクエストでは作り直さない
+        _write_atomic(delta_unavailable_path(base_digest, target_digest), b"")
+        return None
+    os.replace(partial_path, path)
+    return path
+
+
+@contextmanager
+def _pair_lock(key: Tuple[str, str]):
+    """組ごとのロックを取る。使う人がいなくなったらロックを片付ける"""
+    with _delta_locks_guard:
+        entry = _delta_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _delta_locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _delta_locks[key]
+
+
+def _partial_path(path: str) -> str:
+    """書き込み途中のファイルのパス (プロセス・スレッドごとに異なる)"""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial_path = _partial_path(path)
+    try:
+        with open(partial_path, "wb") as f:
+            f.write(data)
+        os.replace(partial_path, path)
+    except BaseException:
+        _remove_quietly(partial_path)
+        raise
+
+
+class RangeNotSatisfiable(Exception):
+    """指定された範囲がファイルの外にある場合の例外 (416を返す)"""
+
+
+def parse_range_header(value: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Rangeヘッダーを解析し、[(開始, 終了+1), ...] を返す。重なる・隣接する範囲はまとめる。
+    形式が不正な場合はNone (RFC 9110 に従い、Rangeを無視して全体を返す)。
+    :raises RangeNotSatisfiable: 有効な範囲が1つもない場合
+    """
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+    parts = spec.split(",")
+    if len(parts) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for part in parts:
+        match = _RANGE_RE.match(part)
+        if not match:
+            return None
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+            if last and int(last) < start:
+                return None
+        elif last:
+            # 末尾から N バイト
+            start = max(size - int(last), 0)
+            end = size
+        else:
+            return None
+        if start < size and start < end:
+            ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+class PackageResponse(Response):
+    """
+    保存済みパッケージを返すASGIレスポンス。
+
+    - ETag (ダイジェスト) による If-None-Match / If-Range の条件付きリクエスト
+    - 単一範囲 (206) と複数範囲 (multipart/byteranges) の Range リクエスト
+    - サーバーが ASGI の zerocopysend 拡張に対応していれば sendfile で送信し、
+      未対応ならファイルの一部を大きめの単位で読み込んで送る
+
+    :param path: パッケージのファイルパス
+    :param digest: パッケージのSHA-256 (ETagに使う)
+    """
+
+    def __init__(self, path: str, digest: str, media_type: str = PACKAGE_MEDIA_TYPE,
+                 background: Optional[BackgroundTask] = None):
+        # ステータスやヘッダーはリクエストの内容で決まるため、Response.__init__ は使わない
+        self.path = path
+        self.etag = f'"{digest}"'
+        self.media_type = media_type
+        self.status_code = 200
+        self.background = background
+        self.raw_headers = []
+
+    def _base_headers(self) -> List[Tuple[bytes, bytes]]:
+        return [
+            (b"etag", self.etag.encode("latin-1")),
+            (b"cache-control", PACKAGE_CACHE_CONTROL.encode("latin-1")),
+            (b"accept-ranges", b"bytes"),
+        ]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        request_headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        header_only = scope["method"] == "HEAD"
+
+        if _etag_matches(request_headers.get("if-none-match"), self.etag):
+            await send({"type": "http.response.start", "status": 304, "headers": self._base_headers()})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        with open(self.path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            ranges = None
+            range_header = request_headers.get("range")
+            if_range = request_headers.get("if-range")
+            # If-Range が一致しない (内容が変わった) 場合は、範囲を無視して全体を返す
+            if range_header and (if_range is None or if_range.strip() == self.etag):
+                try:
+                    ranges = parse_range_header(range_header, size)
+                except RangeNotSatisfiable:
+                    await self._send_unsatisfiable(send, size)
+                    return
+
+            zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+            if ranges is None:
+                await self._send_full(send, file, size, header_only, zerocopy)
+            elif len(ranges) == 1:
+                await self._send_single_range(send, file, size, ranges[0], header_only, zerocopy)
+            else:
+                await self._send_multiple_ranges(send, file, size, ranges, header_only, zerocopy)
+
+        if self.background is not None:
+            await self.background()
+
+    async def _send_unsatisfiable(self, send: Send, size: int):
+        headers = self._base_headers() + [
+            (b"content-range", f"bytes */{size}".encode("latin-1")),
+            (b"content-length", b"0"),
+        ]
+        await send({"type": "http.response.start", "status": 416, "headers": headers})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def _send_full(self, send: Send, file, size: int, header_only: bool, zerocopy: bool):
+        headers = self._base_headers() + [
+            (b"content-type", self.media_type.encode("latin-1")),
+            (b"content-length", str(size).encode("latin-1")),
+        ]
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        if header_only:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        await self._send_segment(send, file, 0, size, zerocopy, more_body=False)
+
+    async def _send_single_range(self, send: Send, file, size: int, byte_range, header_only: bool, zerocopy: bool):
+        start, end = byte_range
+        headers = self._base_headers() + [
+            (b"content-type", self.media_type.encode("latin-1")),
+            (b"content-length", str(end - start).encode("latin-1")),
+            (b"content-range", f"bytes {start}-{end - 1}/{size}".encode("latin-1")),
+        ]
+        await send({"type": "http.response.start", "status": 206, "headers": headers})
+        if header_only:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        await self._send_segment(send, file, start, end, zerocopy, more_body=False)
+
+    async def _send_multiple_ranges(self, send: Send, file, size: int, ranges, header_only: bool, zerocopy: bool):
+        boundary = secrets.token_hex(16)
+        part_headers = [
+            (
+                f"--{boundary}\r\n"
+                f"Content-Type: {self.media_type}\r\n"
+                f"Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n"
+            ).encode("latin-1")
+            for start, end in ranges
+        ]
+        closing = f"\r\n--{boundary}--\r\n".encode("latin-1")
+        # 各パートの区切りは、2つ目以降の先頭に \r\n が付く
+        content_length = (
+            sum(len(header) for header in part_headers)
+            + sum(end - start for start, end in ranges)
+            + 2 * (len(ranges) - 1)
+            + len(closing)
+        )
+        headers = self._base_headers() + [
+            (b"content-type", f"multipart/byteranges; boundary={boundary}".encode("latin-1")),
+            (b"content-length", str(content_length).encode("latin-1")),
+        ]
+        await send({"type": "http.response.start", "status": 206, "headers": headers})
+        if header_only:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        for index, ((start, end), part_header) in enumerate(zip(ranges, part_headers)):
+            prefix = b"\r\n" + part_header if index > 0 else part_header
+            await send({"type": "http.response.body", "body": prefix, "more_body": True})
+            await self._send_segment(send, file, start, end, zerocopy, more_body=True)
+        await send({"type": "http.response.body", "body": closing, "more_body": False})
+
+    async def _send_segment(self, send: Send, file, start: int, end: int, zerocopy: bool, more_body: bool):
+        """ファイルの [start, end) を送信する"""
+        if zerocopy:
+            # サーバー側で sendfile を使い、ユーザー空間にデータをコピーせずに送る
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": file,
+                "offset": start,
+                "count": end - start,
+                "more_body": more_body,
+            })
+            return
+
+        fd = file.fileno()
+        position = start
+        while position < end:
+            length = min(PACKAGE_CHUNK_SIZE, end - position)
+            chunk = await anyio.to_thread.run_sync(os.pread, fd, length, position)
+            if not chunk:
+                # 送信中にファイルが短くなった場合 (通常は起きない)
+                break
+            position += len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body or position < end})
+        if (position < end or start == end) and not more_body:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def package_response(digest: str) -> Optional[PackageResponse]:
+    """ダイジェストに対応するパッケージのレスポンスを返す。存在しなければNone"""
+    if not is_valid_digest(digest):
+        return None
+    path = package_path(digest)
+    if not os.path.exists(path):
+        return None
+    return PackageResponse(path, digest)
+
+
+def delta_response(base_digest: str, target_digest: str) -> Optional[PackageResponse]:
+    """差分パッケージのレスポンスを返す。差分を配信できない場合はNone"""
+    if not is_valid_digest(base_digest) or not is_valid_digest(target_digest) or base_digest == target_digest:
+        return None
+    path = build_delta(base_digest, target_digest)
+    if path is None:
+        return None
+    # 内容は2つのダイジェストで決まるので、ETagにもそれを使う
+    return PackageResponse(path, f"{base_digest}-{target_digest}")
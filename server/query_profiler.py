@@ -0,0 +1,216 @@
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event as sa_event
+
+from .logs import get_logger
+
+# --- SQLクエリのプロファイラーと N+1 検出 ---
+# リクエストごとに実行されたSQLを数えて時間を測り、リテラルを取り除いた「形」でまとめる。
+# 同じ形の SELECT が何度も実行されていれば、User.apps や App.owner などの遅延ロードによる
+# N+1 クエリの疑いがあるとして報告する。
+#
+# QUERY_PROFILER_ENABLED=1 で有効になる (既定は無効。無効時はミドルウェアも追加されない)。
+# QUERY_PROFILER_HEADERS=1 にすると、結果をレスポンスヘッダー (X-Query-*) にも付ける (開発環境用)。
+QUERY_PROFILER_ENABLED = os.getenv("QUERY_PROFILER_ENABLED", "0") == "1"
+QUERY_PROFILER_HEADERS = os.getenv("QUERY_PROFILER_HEADERS", "0") == "1"
+# 同じ形の SELECT がこの回数以上実行されたら N+1 の疑いとする
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+
+logger = get_logger(__name__)
+
+_current_profile: ContextVar[Optional["QueryProfile"]] = ContextVar("query_profile", default=None)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_RE = re.compile(r"%\(\w+\)s|:\w+|\$\d+|%s|\?")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_sql(statement: str) -> str:
+    """
+    SQLから値を取り除き、同じ形のクエリが同じ文字列になるようにする。
+    (リテラルとプレースホルダーを ? に置き換え、IN (?, ?, ...) を IN (?) にまとめる)
+    """
+    normalized = _STRING_RE.sub("?", statement)
+    normalized = _PLACEHOLDER_RE.sub("?", normalized)
+    normalized = _NUMBER_RE.sub("?", normalized)
+    normalized = _IN_LIST_RE.sub("(?)", normalized)
+    return _SPACE_RE.sub(" ", normalized).strip()
+
+
+class QueryProfile:
+    """1つのリクエスト (またはブロック) の間に実行されたクエリの集計"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        # 正規化したSQL -> [回数, 合計時間]
+        self.by_shape: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, elapsed: float):
+        shape = normalize_sql(statement)
+        with self._lock:
+            self.count += 1
+            self.total_time += elapsed
+            entry = self.by_shape.get(shape)
+            if entry is None:
+                self.by_shape[shape] = [1, elapsed]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+
+    def n_plus_one_suspects(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> List[Tuple[str, int, float]]:
+        """同じ形で threshold 回以上実行された SELECT を、回数の多い順に返す"""
+        suspects = [
+            (shape, count, elapsed) for shape, (count, elapsed) in self.by_shape.items()
+            if count >= threshold and shape.upper().startswith("SELECT")
+        ]
+        return sorted(suspects, key=lambda item: item[1], reverse=True)
+
+    def summary(self, limit: int = 5) -> str:
+        """多く実行された順に、クエリの形ごとの回数と時間を並べた文字列"""
+        lines = [f"{self.count} queries, {self.total_time * 1000:.2f} ms"]
+        top = sorted(self.by_shape.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+        for shape, (count, elapsed) in top:
+            lines.append(f"  {count:>4}x {elapsed * 1000:>8.2f} ms  {shape[:200]}")
+        return "\n".join(lines)
+
+
+# --- エンジンのイベント ---
+# 計測対象のプロファイルは、リクエストごとの ContextVar と、テスト用の全体プロファイルの2種類
+_global_profiles: List[QueryProfile] = []
+_global_lock = threading.Lock()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_profile.get() is not None or _global_profiles:
+        conn.info.setdefault("profiler_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("profiler_start_time")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.record(statement, elapsed)
+    for global_profile in list(_global_profiles):
+        global_profile.record(statement, elapsed)
+
+
+_instrumented = set()
+
+
+def instrument_engine(engine):
+    """エンジンのクエリをプロファイラーで記録できるようにする (何度呼んでも1回だけ登録する)"""
+    if id(engine) in _instrumented:
+        return
+    _instrumented.add(id(engine))
+    sa_event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    sa_event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class QueryProfilerMiddleware:
+    """
+    リクエストごとにクエリを集計するASGIミドルウェア。
+    N+1 の疑いがあれば警告としてログに出し、QUERY_PROFILER_HEADERS が有効なら
+    X-Query-Count / X-Query-Time-Ms / X-Query-N-Plus-One ヘッダーを付ける。
+    (ヘッダーはレスポンスの開始時点までの集計。ストリーミング中のクエリはログにだけ含まれる)
+    """
+
+    def __init__(self, app, engine=None, headers: bool = QUERY_PROFILER_HEADERS, threshold: int = N_PLUS_ONE_THRESHOLD):
+        self.app = app
+        self.headers = headers
+        self.threshold = threshold
+        # engine を省略した場合は、エンジンを作成したとき (lifespan) に instrument_engine を呼ぶこと
+        if engine is not None:
+            instrument_engine(engine)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = QueryProfile()
+        token = _current_profile.set(profile)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and self.headers:
+                suspects = profile.n_plus_one_suspects(self.threshold)
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-query-count", str(profile.count).encode("latin-1")),
+                    (b"x-query-time-ms", f"{profile.total_time * 1000:.2f}".encode("latin-1")),
+                    (b"x-query-n-plus-one", str(len(suspects)).encode("latin-1")),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_profile.reset(token)
+            self._log(scope, profile)
+
+    def _log(self, scope, profile: QueryProfile):
+        suspects = profile.n_plus_one_suspects(self.threshold)
+        route = scope.get("route")
+        fields = {
+            "method": scope["method"],
+            "route": route.path if route is not None else scope["path"],
+            "query_count": profile.count,
+            "query_time_ms": round(profile.total_time * 1000, 2),
+        }
+        if suspects:
+            fields["n_plus_one"] = [{"sql": shape[:200], "count": count} for shape, count, _ in suspects]
+            logger.warning("N+1 クエリの疑いがあります", extra=fields)
+        elif profile.count:
+            logger.debug("クエリの集計", extra=fields)
+
+
+# --- テスト用ヘルパー ---
+@contextmanager
+def count_queries(engine=None):
+    """
+    ブロック内で実行されたすべてのクエリを集計する (スレッドをまたいでも数える)。
+    TestClient はアプリを別スレッドで動かすため、リクエスト単位のプロファイルではなく全体で数える。
+
+        with count_queries() as profile:
+            client.get("/mypage")
+        print(profile.summary())
+    """
+    if engine is None:
+        from .database import init_engine
+        engine = init_engine()
+    instrument_engine(engine)
+    profile = QueryProfile()
+    with _global_lock:
+        _global_profiles.append(profile)
+    try:
+        yield profile
+    finally:
+        with _global_lock:
+            _global_profiles.remove(profile)
+
+
+@contextmanager
+def assert_max_queries(max_queries: int, engine=None):
+    """
+    ブロック内のクエリ数が max_queries 以下であることを確認する (pytest などのテスト用)。
+    超えた場合は、多く実行されたクエリの一覧を付けて AssertionError を送出する。
+
+        def test_mypage_queries(client):
+            with assert_max_queries(3):
+                client.get("/mypage")
+    """
+    with count_queries(engine) as profile:
+        yield profile
+    if profile.count > max_queries:
+        raise AssertionError(f"expected at most {max_queries} queries, got {profile.summary()}")
@@ -0,0 +1,239 @@
+import ipaddress
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import anyio
+from sqlalchemy import text
+
+from . import database, security
+
+# メモリ上に保持するバケット数の上限 (ワーカーごと)。超えたら最後に使われたのが古いバケットから捨てる。
+MAX_MEMORY_BUCKETS = 100000
+# 前段のリバースプロキシ・ロードバランサーのアドレス (カンマ区切り、CIDR可)。
+# 接続元がこのどれかのときだけ X-Forwarded-For を信用し、そこから本当のクライアントIPを取り出す。
+# 未設定のままプロキシの後ろで動かすと、全員がプロキシのIPとして1つのバケットを共有してしまう。
+TRUSTED_PROXIES = os.getenv("TRUSTED_PROXIES", "")
+
+
+class RateLimitPolicy(NamedTuple):
+    """
+    1つのエンドポイントに対する制限ルール (トークンバケット方式)。
+    burst 回までは連続で受け付け、その後は1秒あたり rate 回のペースで回復する。
+    key は制限の単位で、"ip" (接続元IP) または "user" (ログインユーザー、未ログインならIP)。
+    """
+    name: str
+    rate: float
+    burst: int
+    key: str = "ip"
+
+
+class MemoryBackend:
+    """
+    ワーカープロセス内のメモリにバケットを保持するバックエンド。
+    イベントループ上でだけ呼ばれるため、ロックは使わない。
+    """
+
+    def __init__(self, max_buckets: int = MAX_MEMORY_BUCKETS):
+        self.max_buckets = max_buckets
+        # バケットキー -> [残りトークン数, 最終更新時刻] (最後に使われた順。先頭が最も古い)
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    def take(self, key: str, rate: float, burst: int, now: float) -> Tuple[bool, float]:
+        """
+        トークンを1つ消費する。
+        :return: (許可するか, 拒否した場合は次にトークンが貯まるまでの秒数)
+        """
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            # 最後に使われたのが最も古いバケット (満タンまで回復している可能性が最も高い) を捨てる。
+            # 使われ続けているバケットは捨てないので、制限中のクライアントの制限が解除されることはない
+            while len(self._buckets) >= self.max_buckets:
+                self._buckets.popitem(last=False)
+            self._buckets[key] = [burst - 1, now]
+            return True, 0.0
+
+        self._buckets.move_to_end(key)
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return True, 0.0
+        bucket[0] = tokens
+        return False, (1 - tokens) / rate
+
+
+class DatabaseBackend:
+    """
+    データベース (rate_limit_buckets テーブル) にバケットを保持するバックエンド。
+    複数のワーカープロセス・複数台のサーバーで制限を共有したい場合に使う。
+    1回の判定は1つの UPSERT で行うので、同時アクセスでもトークンを二重に消費しない。
+
+    :param engine: 使うエンジン (省略時はワーカーのエンジン。最初の判定のときに取得する)
+    """
+
+    # refill = min(burst, 残り + 経過秒 * rate)
+    _REFILL = (
+        "CASE WHEN rate_limit_buckets.tokens + (:now - rate_limit_buckets.updated_at) * :rate > :burst "
+        "THEN :burst ELSE rate_limit_buckets.tokens + (:now - rate_limit_buckets.updated_at) * :rate END"
+    )
+    _SQL = text(
+        "INSERT INTO rate_limit_buckets (bucket_key, tokens, updated_at, allowed) "
+        "VALUES (:key, :burst - 1, :now, TRUE) "
+        "ON CONFLICT (bucket_key) DO UPDATE SET "
+        f"tokens = CASE WHEN {_REFILL} >= 1 THEN {_REFILL} - 1 ELSE {_REFILL} END, "
+        f"allowed = ({_REFILL} >= 1), "
+        "updated_at = :now "
+        "RETURNING allowed, tokens"
+    )
+
+    def __init__(self, engine=None):
+        self.engine = engine
+
+    def take(self, key: str, rate: float, burst: int, now: float) -> Tuple[bool, float]:
+        engine = self.engine or database.init_engine()
+        with engine.begin() as conn:
+            allowed, tokens = conn.execute(
+                self._SQL, {"key": key, "rate": rate, "burst": burst, "now": now}
+            ).one()
+        if allowed:
+            return True, 0.0
+        return False, (1 - tokens) / rate
+
+
+def _get_header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _get_token(scope) -> Optional[str]:
+    """Authorizationヘッダー、またはCookieの access_token からトークンを取り出す"""
+    authorization = _get_header(scope, b"authorization")
+    if authorization and authorization.startswith("Bearer "):
+        return authorization[len("Bearer "):]
+
+    cookie = _get_header(scope, b"cookie")
+    if cookie:
+        for part in cookie.split(";"):
+            name, _, value = part.strip().partition("=")
+            if name == "access_token":
+                value = value.strip('"')
+                return value[len("Bearer "):] if value.startswith("Bearer ") else value
+    return None
+
+
+def parse_trusted_proxies(value: str):
+    """TRUSTED_PROXIES の値 (カンマ区切りのIPアドレス・CIDR) を解釈する"""
+    return tuple(ipaddress.ip_network(part.strip(), strict=False) for part in value.split(",") if part.strip())
+
+
+_trusted_proxies = parse_trusted_proxies(TRUSTED_PROXIES)
+
+
+def _is_trusted(address: str, trusted_proxies) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted_proxies)
+
+
+def get_client_ip(scope, trusted_proxies=None) -> str:
+    """
+    クライアントのIPアドレスを返す。
+    接続元が信頼するプロキシなら、X-Forwarded-For を右 (自分に近い側) からたどり、
+    信頼するプロキシでない最初のアドレスをクライアントとする (それより左はクライアントが偽装できるので使わない)。
+    """
+    if trusted_proxies is None:
+        trusted_proxies = _trusted_proxies
+    client = scope.get("client")
+    address = client[0] if client else "unknown"
+    if not trusted_proxies or not _is_trusted(address, trusted_proxies):
+        return address
+
+    forwarded = [
+        part.strip()
+        for key, value in scope["headers"] if key == b"x-forwarded-for"
+        for part in value.decode("latin-1").split(",")
+    ]
+    for hop in reversed(forwarded):
+        if not hop:
+            continue
+        address = hop
+        if not _is_trusted(hop, trusted_proxies):
+            break
+    return address
+
+
+def get_identity(scope, policy: RateLimitPolicy, trusted_proxies=None) -> str:
+    """制限の単位となる識別子を決める"""
+    if policy.key == "user":
+        token = _get_token(scope)
+        if token:
+            email = security.verify_token(token)
+            if email:
+                return f"user:{email}"
+    return f"ip:{get_client_ip(scope, trusted_proxies)}"
+
+
+class RateLimitMiddleware:
+    """
+    エンドポイントごとのトークンバケットで、リクエスト数を制限するASGIミドルウェア。
+    制限対象でないリクエストは辞書を1回引くだけで素通りさせる。
+    制限を超えた場合は 429 と Retry-After ヘッダーを返す。
+
+    :param policies: (HTTPメソッド, パス) -> RateLimitPolicy の辞書
+    :param backend: MemoryBackend (既定) または DatabaseBackend
+    :param trusted_proxies: X-Forwarded-For を信用するプロキシ (parse_trusted_proxies の戻り値)。
+                            省略時は環境変数 TRUSTED_PROXIES の値
+    """
+
+    def __init__(self, app, policies: Dict[Tuple[str, str], RateLimitPolicy], backend=None, enabled: bool = True,
+                 trusted_proxies=None):
+        self.app = app
+        self.policies = policies
+        self.backend = backend or MemoryBackend()
+        self.enabled = enabled
+        self.trusted_proxies = _trusted_proxies if trusted_proxies is None else trusted_proxies
+        # DBバックエンドはブロッキングI/Oなので、イベントループを止めないようスレッドで実行する
+        self._blocking = not isinstance(self.backend, MemoryBackend)
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        policy = self.policies.get((scope["method"], scope["path"]))
+        if policy is None:
+            await self.app(scope, receive, send)
+            return
+
+        key = f"{policy.name}:{get_identity(scope, policy, self.trusted_proxies)}"
+        now = time.time()
+        if self._blocking:
+            allowed, retry_after = await anyio.to_thread.run_sync(
+                self.backend.take, key, policy.rate, policy.burst, now
+            )
+        else:
+            allowed, retry_after = self.backend.take(key, policy.rate, policy.burst, now)
+
+        if allowed:
+            await self.app(scope, receive, send)
+            return
+
+        body = json.dumps({"detail": "Too many requests. Please retry later."}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode("latin-1")),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
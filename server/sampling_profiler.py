@@ -0,0 +1,263 @@
+import asyncio
+import hmac
+import os
+import random
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+from .logs import get_logger
+
+# --- 稼働中のワーカー向けのサンプリングプロファイラー ---
+# 本番で /mypage やアップロードが遅いときに、再デプロイせずに時間の使われ方を調べるための仕組み。
+# 管理用エンドポイント (ADMIN_TOKEN が必要) またはシグナル (SIGUSR2) でプロファイルを開始すると、
+# 指定した時間だけ、対象のリクエストが処理中の間、一定間隔でスタックを記録する。
+#
+# 記録するのは対象のリクエストのスタックだけ (route や sample_rate で絞り込んだ意味がなくなるので、他のリクエストは混ぜない)。
+# - イベントループのスレッド: ミドルウェアが対象のリクエストを処理しているタスクを登録しておき、
+#   サンプリングの時点でループが実行中のタスクが登録済みのものであるときだけ記録する。
+# - それ以外のスレッド (同期エンドポイントや run_in_threadpool の処理): どのリクエストの処理かは外から分からないので、
+#   処理中のリクエストがすべて対象のときだけ記録する。対象外のリクエストと重なっている間のスレッドの処理は記録されない。
+#
+# 実時間 (wall-clock) でのサンプリングなので、bcrypt のような CPU 処理だけでなく、
+# イベントループを止めているブロッキングI/Oや、DBの応答待ちも記録される。
+# 結果は flamegraph.pl や speedscope で読める collapsed stacks 形式 ("関数;関数;... 回数") で
+# PROFILE_DIR に保存する。
+#
+# プロファイル中でなければ、ミドルウェアのコストは属性を1回確認するだけ。
+# プロファイルはワーカープロセスごと。全ワーカーを調べる場合は各プロセスに SIGUSR2 を送る。
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+DEFAULT_INTERVAL = 0.005      # 5 ms ごとにサンプリング
+DEFAULT_DURATION = 30.0
+MAX_DURATION = 600.0
+MAX_STACK_DEPTH = 128
+# 仕事を待っているだけのスレッド (最も内側のフレームで判定する)。記録しても役に立たないので除く
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+# 常駐していて、リクエストの処理とは関係のないスレッド
+EXCLUDED_THREADS = {"sampling-profiler", "catalog-event-relay"}
+
+logger = get_logger(__name__)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _is_idle(frame) -> bool:
+    return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES
+
+
+def collapse_stack(frame, thread_name: str) -> str:
+    """フレームを外側から順に ; でつないだ1行 (collapsed stacks 形式) にする"""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name)
+    return ";".join(reversed(labels))
+
+
+class ProfilingSession:
+    """
+    1回分のプロファイル。
+
+    :param duration: 計測する秒数
+    :param sample_rate: 対象にするリクエストの割合 (0〜1)
+    :param route: 指定した場合は、このルート (例: "/mypage") のリクエストだけを対象にする
+    :param interval: サンプリング間隔 (秒)
+    """
+
+    def __init__(self, duration: float = DEFAULT_DURATION, sample_rate: float = 1.0,
+                 route: Optional[str] = None, interval: float = DEFAULT_INTERVAL):
+        self.duration = min(max(duration, 0.1), MAX_DURATION)
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.route = route
+        self.interval = max(interval, 0.001)
+        self.started_at = time.monotonic()
+        self.deadline = self.started_at + self.duration
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.profiled_requests = 0
+        # 対象として処理中のリクエスト数と、それ以外の処理中のリクエスト数 (イベントループ上でだけ増減する)
+        self.in_flight = 0
+        self.other_in_flight = 0
+        # 対象のリクエストを処理中のタスクと、それを実行しているイベントループ (ミドルウェアが登録する)
+        self.tasks = set()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id: Optional[int] = None
+        self.output_path: Optional[str] = None
+        self._stopped = threading.Event()
+
+    def wants(self, scope) -> bool:
+        """このリクエストを対象にするか"""
+        if self.route is not None and scope["path"] != self.route:
+            return False
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def run(self):
+        """サンプリングのループ (専用スレッドで実行する)"""
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stopped.wait(self.interval) and time.monotonic() < self.deadline:
+            if self.in_flight <= 0:
+                continue
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            # ループが対象のリクエストを実行中か (フレームを取得する前に確認し、他のリクエストのスタックを混ぜない)
+            loop_on_target = self.loop is not None and asyncio.current_task(self.loop) in self.tasks
+            threads_on_target = self.other_in_flight <= 0
+            for thread_id, frame in sys._current_frames().items():
+                name = names.get(thread_id, f"thread-{thread_id}")
+                if thread_id == own_id or name in EXCLUDED_THREADS or _is_idle(frame):
+                    continue
+                if not (loop_on_target if thread_id == self.loop_thread_id else threads_on_target):
+                    continue
+                self.stacks[collapse_stack(frame, name)] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stopped.set()
+
+    def write(self) -> str:
+        """結果をファイルに書き出し、そのパスを返す"""
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(PROFILE_DIR, f"profile-{os.getpid()}-{timestamp}.collapsed")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self.output_path = path
+        return path
+
+    def status(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "route": self.route,
+            "sample_rate": self.sample_rate,
+            "interval": self.interval,
+            "remaining_seconds": max(0.0, round(self.deadline - time.monotonic(), 1)),
+            "samples": self.samples,
+            "profiled_requests": self.profiled_requests,
+            "output_path": self.output_path,
+        }
+
+
+class SamplingProfiler:
+    """ワーカー内で同時に1つだけプロファイルを実行する"""
+
+    def __init__(self):
+        self.session: Optional[ProfilingSession] = None
+        self.last_session: Optional[ProfilingSession] = None
+        self._lock = threading.Lock()
+
+    def start(self, **options) -> ProfilingSession:
+        """
+        プロファイルを開始する。
+        :raises RuntimeError: 既にプロファイル中の場合
+        """
+        with self._lock:
+            if self.session is not None:
+                raise RuntimeError("A profiling session is already running in this worker.")
+            session = ProfilingSession(**options)
+            self.session = session
+        thread = threading.Thread(target=self._run, args=(session,), name="sampling-profiler", daemon=True)
+        thread.start()
+        logger.info("プロファイルを開始しました", extra=session.status())
+        return session
+
+    def stop(self) -> Optional[ProfilingSession]:
+        """実行中のプロファイルを途中で終了する (結果はファイルに書き出される)"""
+        session = self.session
+        if session is not None:
+            session.stop()
+        return session
+
+    def _run(self, session: ProfilingSession):
+        try:
+            session.run()
+        finally:
+            path = session.write()
+            with self._lock:
+                self.session = None
+                self.last_session = session
+            logger.info("プロファイルを保存しました", extra={"path": path, "samples": session.samples})
+
+
+profiler = SamplingProfiler()
+
+
+class SamplingProfilerMiddleware:
+    """
+    プロファイル中に、対象のリクエストとそれを処理しているタスクをプロファイラーに伝えるASGIミドルウェア。
+    プロファイルしていないときは何もしない。
+    """
+
+    def __init__(self, app, profiler: SamplingProfiler = profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        session = self.profiler.session
+        if session is None or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if not session.wants(scope):
+            session.other_in_flight += 1
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                session.other_in_flight -= 1
+            return
+
+        task = asyncio.current_task()
+        if session.loop is None:
+            session.loop = asyncio.get_running_loop()
+            session.loop_thread_id = threading.get_ident()
+        session.tasks.add(task)
+        session.in_flight += 1
+        session.profiled_requests += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            session.in_flight -= 1
+            session.tasks.discard(task)
+
+
+def check_admin_token(authorization: Optional[str]) -> bool:
+    """管理用エンドポイントのトークンを確認する。ADMIN_TOKEN が未設定なら常にFalse (無効)"""
+    if not ADMIN_TOKEN or not authorization or not authorization.startswith("Bearer "):
+        return False
+    return hmac.compare_digest(authorization[len("Bearer "):], ADMIN_TOKEN)
+
+
+def install_signal_handler(signum: int = getattr(signal, "SIGUSR2", 0)):
+    """
+    シグナルを受け取ったら、全リクエストを対象に既定の時間だけプロファイルする。
+    メインスレッドから呼ぶこと (Windowsなど SIGUSR2 がない環境では何もしない)。
+    """
+    if not signum or threading.current_thread() is not threading.main_thread():
+        return
+
+    def start_quietly():
+        try:
+            profiler.start()
+        except RuntimeError:
+            pass
+
+    def handler(signum, frame):
+        # シグナルハンドラーの中でロックを取らないよう、別スレッドで開始する
+        threading.Thread(target=start_quietly, daemon=True).start()
+
+    signal.signal(signum, handler)
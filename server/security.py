@@ -1,7 +1,12 @@
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from typing import Optional
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
 from jose import JWTError, jwt
+import hashlib
+import secrets
+import threading
+import time
 import os
 
 # JWTの設定
@@ -9,12 +14,62 @@ import os
 # openssl rand -hex 32 などで生成したランダムな文字列を使用します。
 SECRET_KEY = os.getenv("SECRET_KEY", "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# アクセストークンの有効期限。ログアウト後も、他のワーカーでは最大この時間だけトークンが使えてしまうので
+# (下の RevokedSessions を参照)、短くしておく。期限が切れてもリフレッシュトークンで再発行できる。
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+
+# --- 署名鍵のローテーション ---
+# JWT_SIGNING_KEYS="2026a:xxxx,2026b:yyyy" の形式で複数の鍵 (kid:鍵) を登録できる。
+# 新しいトークンは JWT_ACTIVE_KID の鍵で署名し、JWTヘッダーの kid に鍵IDを入れる。
+# 検証時は kid に対応する鍵を使うため、古い鍵を残したまま新しい鍵に切り替えられる。
+# (古い鍵は ACCESS_TOKEN_EXPIRE_MINUTES 経過後に削除してよい)
+# 未設定の場合は SECRET_KEY を kid="default" として使う。
+#
+# kid のないトークン (鍵のローテーション導入前に発行されたもの) は、
+# JWT_SIGNING_KEYS に kid="legacy" の鍵を明示的に登録した場合だけ、その鍵で検証する。
+# (既定の SECRET_KEY は公開されている値なので、それで署名された kid なしのトークンは受け付けない)
+LEGACY_KID = "legacy"
+
+def _load_signing_keys() -> Dict[str, str]:
+    raw = os.getenv("JWT_SIGNING_KEYS")
+    if not raw:
+        return {"default": SECRET_KEY}
+    keys = {}
+    for entry in raw.split(","):
+        kid, _, key = entry.strip().partition(":")
+        if kid and key:
+            keys[kid] = key
+    return keys
+
+SIGNING_KEYS = _load_signing_keys()
+ACTIVE_KID = os.getenv("JWT_ACTIVE_KID", next(iter(SIGNING_KEYS), ""))
+
+def check_signing_keys():
+    """
+    署名鍵の設定を確認する (アプリの作成時に呼ぶ)。
+    :raises RuntimeError: 鍵が1つもない場合や、JWT_ACTIVE_KID の鍵が登録されていない場合
+    """
+    if not SIGNING_KEYS:
+        raise RuntimeError("JWT_SIGNING_KEYS に有効な鍵 (kid:鍵) がありません。")
+    if ACTIVE_KID not in SIGNING_KEYS:
+        raise RuntimeError(
+            f"JWT_ACTIVE_KID '{ACTIVE_KID}' の鍵が JWT_SIGNING_KEYS にありません (登録済み: {', '.join(SIGNING_KEYS)})。"
+        )
+
+# 検証済みトークンのキャッシュ件数の上限 (ワーカーごと)
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+# リフレッシュトークンの有効期限。期限内であればパスワードを再入力せずにアクセストークンを再発行できる。
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+
+# bcryptのコスト (work factor)。1増えるごとに計算時間が約2倍になる。
+# この値より低いコストで保存されたハッシュは、ログイン時に自動で再ハッシュされる。
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
 
 # パスワードのハッシュ化と検証を行うためのコンテキストを作成
 # schemes=["bcrypt"]で、bcryptアルゴリズムを使用することを指定
 # deprecated="auto"は、将来bcryptより安全なアルゴリズムが出た場合に自動で移行を促す設定
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt__roundsでコストを指定すると、needs_update()がコスト不足のハッシュを検出するようになる
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """平文のパスワードとハッシュ化されたパスワードを比較する"""
@@ -33,20 +88,140 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         # デフォルトの有効期限を設定
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(
+        to_encode, SIGNING_KEYS[ACTIVE_KID], algorithm=ALGORITHM, headers={"kid": ACTIVE_KID}
+    )
     return encoded_jwt
 
+def create_refresh_token() -> str:
+    """
+    リフレッシュトークン (推測不可能なランダム文字列) を生成する。
+    JWTではないので、有効性は必ずサーバー側のセッションテーブルで確認する。
+    """
+    return secrets.token_urlsafe(32)
+
+def hash_refresh_token(token: str) -> str:
+    """
+    リフレッシュトークンをDB保存用にハッシュ化する。
+    トークン自体が十分なエントロピーを持つため、bcryptではなくSHA-256で十分 (検索もインデックスで行える)。
+    """
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+class ClaimsCache:
+    """
+    検証済みアクセストークン -> ペイロード の上限付きLRUキャッシュ。
+    同じトークンが繰り返し送られてくるため、署名検証とJSONのデコードを毎回やり直さずに済む。
+    有効期限 (exp) を過ぎたエントリは、取り出す時点で破棄する。
+    """
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[dict]:
+        with self._lock:
+            payload = self._items.get(token)
+            if payload is None:
+                self.misses += 1
+                return None
+            if payload["exp"] <= time.time():
+                del self._items[token]
+                self.misses += 1
+                return None
+            self._items.move_to_end(token)
+            self.hits += 1
+            return payload
+
+    def put(self, token: str, payload: dict):
+        with self._lock:
+            self._items[token] = payload
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+# --- アクセストークンの無効化 (ワーカーごと) ---
+# ログアウトやリフレッシュトークンの盗用検知で無効化したセッションは、このワーカーのメモリにだけ記録する。
+# リクエストごとにDBを確認しないための割り切りで、他のワーカー (別プロセス・別サーバー) には伝わらない。
+# そのため無効化したセッションのアクセストークンも、他のワーカーでは有効期限
+# (ACCESS_TOKEN_EXPIRE_MINUTES) までは受け付けられる。リフレッシュトークンはDBで確認するので、
+# 期限が切れた後に再発行されることはない。(sessions.py のローテーションの猶予期間も同じくワーカーごと)
+class RevokedSessions:
+    """
+    ログアウト等で無効化されたセッションIDの集合 (このワーカーの分だけ)。
+    アクセストークンは発行から ACCESS_TOKEN_EXPIRE_MINUTES で失効するので、
+    それ以上は覚えておく必要がなく、期限の過ぎたIDは自動で削除する。
+    """
+
+    def __init__(self):
+        self._items: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, session_ids: Iterable[int]):
+        forget_at = time.time() + ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        with self._lock:
+            for session_id in session_ids:
+                self._items[session_id] = forget_at
+            self._prune()
+
+    def __contains__(self, session_id) -> bool:
+        # 読み取りはロックなしで行う (dictの参照はアトミック)
+        return session_id in self._items
+
+    def _prune(self):
+        now = time.time()
+        for session_id in [k for k, v in self._items.items() if v <= now]:
+            del self._items[session_id]
+
+
+claims_cache = ClaimsCache()
+revoked_sessions = RevokedSessions()
+
+def revoke_sessions(session_ids: Iterable[int]):
+    """指定したセッションに紐づくアクセストークンを、有効期限前でも無効にする"""
+    revoked_sessions.add(session_ids)
+
+def decode_token(token: str) -> Optional[dict]:
+    """
+    アクセストークンの署名と有効期限を検証し、ペイロードを返す。
+    検証済みのトークンはキャッシュから返す。無効な場合はNone。
+    """
+    payload = claims_cache.get(token)
+    if payload is None:
+        try:
+            # ヘッダーのkidで検証に使う鍵を選ぶ (kidのない古いトークンは legacy の鍵があればそれで検証)
+            kid = jwt.get_unverified_header(token).get("kid") or LEGACY_KID
+            key = SIGNING_KEYS.get(kid)
+            if key is None:
+                return None
+            payload = jwt.decode(token, key, algorithms=[ALGORITHM])
+        except JWTError:
+            # デコードに失敗したら無効
+            return None
+        if "exp" not in payload:
+            return None
+        claims_cache.put(token, payload)
+
+    # ログアウト済みのセッションのトークンは無効
+    sid = payload.get("sid")
+    if sid is not None and sid in revoked_sessions:
+        return None
+    return payload
+
 def verify_token(token: str) -> Optional[str]:
     """アクセストークンを検証し、ペイロード（sub=email）を返す"""
-    try:
-        # トークンをデコード
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        # ペイロードからemailを取得
-        email: str = payload.get("sub")
-        if email is None:
-            # emailがなければ無効
-            return None
-        return email
-    except JWTError:
-        # デコードに失敗したら無効
-        return None
\ No newline at end of file
+    payload = decode_token(token)
+    if payload is None:
+        return None
+    # ペイロードからemailを取得
+    email: str = payload.get("sub")
+    if email is None:
+        # emailがなければ無効
+        return None
+    return email
@@ -0,0 +1,221 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import crud, models, security
+from .logs import get_logger
+
+logger = get_logger(__name__)
+
+# メモリ上にキャッシュするセッション数の上限 (ワーカーごと)
+SESSION_CACHE_SIZE = 10000
+# ローテーションの直後にこの秒数以内に同じ (直前の) トークンが使われた場合は、盗用ではなく
+# 同時に送られたリクエスト (ページの並行読み込みなど) とみなし、同じ新しいトークンを返す (ワーカーごと)。
+# セッションを無効化したときのアクセストークンの失効も、すぐに反映されるのは同じワーカーだけ
+# (他のワーカーではアクセストークンの有効期限まで使える。security.RevokedSessions を参照)
+ROTATION_GRACE_SECONDS = 10
+_ROTATION_LOCK_STRIPES = 64
+
+
+class CachedSession(NamedTuple):
+    """キャッシュに保持するセッション情報。リフレッシュ時にDBのSELECTを省略するために使う"""
+    session_id: int
+    user_id: int
+    email: str
+    family_id: str
+    expires_at: datetime
+
+
+class SessionCache:
+    """
+    トークンハッシュ -> セッション情報 の上限付きLRUキャッシュ。
+    キャッシュに載っているのは「このワーカーが有効だと確認した」セッションだけで、
+    無効化の最終判定は常にDBの条件付きUPDATEで行う。
+    """
+
+    def __init__(self, maxsize: int = SESSION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items: "OrderedDict[str, CachedSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token_hash: str) -> Optional[CachedSession]:
+        with self._lock:
+            item = self._items.get(token_hash)
+            if item is not None:
+                self._items.move_to_end(token_hash)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return item
+
+    def put(self, token_hash: str, item: CachedSession):
+        with self._lock:
+            self._items[token_hash] = item
+            self._items.move_to_end(token_hash)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def pop(self, token_hash: str) -> Optional[CachedSession]:
+        with self._lock:
+            return self._items.pop(token_hash, None)
+
+    def discard_family(self, family_id: str):
+        with self._lock:
+            for key in [k for k, v in self._items.items() if v.family_id == family_id]:
+                del self._items[key]
+
+
+session_cache = SessionCache()
+
+
+class _RecentRotation(NamedTuple):
+    expires_at: float
+    family_id: str
+    result: Tuple[str, str, int]
+
+
+# 直前のトークンハッシュ -> ローテーションの結果 (古いものから順に並ぶ)
+_recent_rotations: "OrderedDict[str, _RecentRotation]" = OrderedDict()
+_recent_lock = threading.Lock()
+# 同じトークンのローテーションを1つずつ行うためのロック (トークンハッシュで振り分ける)
+_rotation_locks = [threading.Lock() for _ in range(_ROTATION_LOCK_STRIPES)]
+
+
+def _recent_rotation(token_hash: str) -> Optional[Tuple[str, str, int]]:
+    """猶予期間内にローテーションしたトークンなら、そのときの結果を返す"""
+    now = time.monotonic()
+    with _recent_lock:
+        while _recent_rotations:
+            oldest = next(iter(_recent_rotations.values()))
+            if oldest.expires_at > now:
+                break
+            _recent_rotations.popitem(last=False)
+        recent = _recent_rotations.get(token_hash)
+    return recent.result if recent is not None and recent.expires_at > now else None
+
+
+def _remember_rotation(token_hash: str, family_id: str, result: Tuple[str, str, int]):
+    """猶予期間の対象は直前のトークンだけなので、同じファミリーのそれより前のものは忘れる"""
+    _forget_rotations(family_id)
+    with _recent_lock:
+        _recent_rotations[token_hash] = _RecentRotation(time.monotonic() + ROTATION_GRACE_SECONDS, family_id, result)
+        while len(_recent_rotations) > SESSION_CACHE_SIZE:
+            _recent_rotations.popitem(last=False)
+
+
+def _forget_rotations(family_id: str):
+    with _recent_lock:
+        for key in [k for k, v in _recent_rotations.items() if v.family_id == family_id]:
+            del _recent_rotations[key]
+
+
+def _lookup(db: Session, token_hash: str) -> Tuple[Optional[CachedSession], bool]:
+    """
+    トークンハッシュからセッションを探す。
+    :return: (セッション情報, 既に無効化済みのトークンだったか)
+    """
+    cached = session_cache.get(token_hash)
+    if cached is not None:
+        return cached, False
+
+    db_session = crud.get_user_session_by_token_hash(db, token_hash)
+    if db_session is None:
+        return None, False
+
+    item = CachedSession(
+        session_id=db_session.id,
+        user_id=db_session.user_id,
+        email=db_session.user.email,
+        family_id=db_session.family_id,
+        expires_at=db_session.expires_at,
+    )
+    if db_session.revoked:
+        return item, True
+    return item, False
+
+
+def _create(db: Session, user_id: int, email: str, family_id: str) -> Tuple[str, int]:
+    """新しいリフレッシュトークンとセッションを作成し、キャッシュにも登録する"""
+    refresh_token = security.create_refresh_token()
+    token_hash = security.hash_refresh_token(refresh_token)
+    now = datetime.utcnow()
+    expires_at = now + timedelta(days=security.REFRESH_TOKEN_EXPIRE_DAYS)
+    db_session = crud.create_user_session(db, user_id, token_hash, family_id, now, expires_at)
+    session_cache.put(token_hash, CachedSession(db_session.id, user_id, email, family_id, expires_at))
+    return refresh_token, db_session.id
+
+
+def _revoke_family(db: Session, family_id: str):
+    """ファミリーのセッションを無効化し、発行済みのアクセストークンも使えなくする"""
+    session_ids = crud.revoke_session_family(db, family_id)
+    session_cache.discard_family(family_id)
+    _forget_rotations(family_id)
+    security.revoke_sessions(session_ids)
+
+
+def start_session(db: Session, user: models.User) -> Tuple[str, int]:
+    """
+    パスワード認証に成功したユーザーのために、新しいセッション (ファミリー) を開始する。
+    :return: (リフレッシュトークン, セッションID)
+    """
+    return _create(db, user.id, user.email, uuid.uuid4().hex)
+
+
+def rotate_session(db: Session, refresh_token: str) -> Optional[Tuple[str, str, int]]:
+    """
+    リフレッシュトークンを検証し、新しいトークンに交換する (ローテーション)。
+    既にローテーション済みのトークンが再利用された場合は、盗用の可能性があるため
+    同じファミリーのセッションをすべて無効化する。
+    ただし ROTATION_GRACE_SECONDS 以内に同じワーカーでローテーションした直前のトークンなら、そのときと同じ結果を返す。
+    :return: (メールアドレス, 新しいリフレッシュトークン, 新しいセッションID) / 無効ならNone
+    """
+    token_hash = security.hash_refresh_token(refresh_token)
+    with _rotation_locks[int(token_hash[:8], 16) % _ROTATION_LOCK_STRIPES]:
+        recent = _recent_rotation(token_hash)
+        if recent is not None:
+            return recent
+        return _rotate(db, token_hash)
+
+
+def _rotate(db: Session, token_hash: str) -> Optional[Tuple[str, str, int]]:
+    """(トークンごとのロックを持った状態で呼ぶ)"""
+    item, reused = _lookup(db, token_hash)
+    if item is None:
+        return None
+
+    if reused:
+        logger.warning("リフレッシュトークンの再利用を検出したため、同じファミリーのセッションをすべて無効化します", extra={"family_id": item.family_id})
+        _revoke_family(db, item.family_id)
+        return None
+
+    if item.expires_at < datetime.utcnow():
+        session_cache.pop(token_hash)
+        return None
+
+    # 古いセッションを無効化する。別ワーカーが先に同じトークンを使っていた場合はここで失敗する。
+    session_cache.pop(token_hash)
+    if not crud.revoke_user_session(db, item.session_id):
+        logger.warning("リフレッシュトークンの再利用を検出したため、同じファミリーのセッションをすべて無効化します", extra={"family_id": item.family_id})
+        _revoke_family(db, item.family_id)
+        return None
+
+    new_refresh_token, session_id = _create(db, item.user_id, item.email, item.family_id)
+    result = (item.email, new_refresh_token, session_id)
+    _remember_rotation(token_hash, item.family_id, result)
+    return result
+
+
+def end_session(db: Session, refresh_token: str):
+    """ログアウト時に、リフレッシュトークンが属するファミリーのセッションをすべて無効化する"""
+    token_hash = security.hash_refresh_token(refresh_token)
+    item, _ = _lookup(db, token_hash)
+    if item is None:
+        return
+    _revoke_family(db, item.family_id)
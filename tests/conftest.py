@@ -0,0 +1,48 @@
+"""
+テスト用の共通フィクスチャ。
+server をインポートする前に環境変数を設定し、一時ディレクトリのSQLiteを使う。
+"""
+import os
+import sys
+import tempfile
+import warnings
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DIR = tempfile.mkdtemp(prefix="catbox-test-")
+
+# server.database などはインポート時に環境変数を読むので、先に設定しておく
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}"
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("PASSWORD_HASH_WORKERS", "1")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+os.environ.setdefault("ICON_WORKERS", "0")
+sys.path.insert(0, ROOT_DIR)
+
+# passlib が bcrypt のバージョンを読めない警告は無視する
+warnings.filterwarnings("ignore", message=".*bcrypt.*")
+
+from fastapi.testclient import TestClient
+
+from server import crud, database, main, models
+
+
+@pytest.fixture(scope="session")
+def client():
+    """lifespan を実行した状態のテストクライアント"""
+    main.UPLOAD_DIR = os.path.join(TEST_DIR, "uploads")
+    models.Base.metadata.create_all(bind=database.init_engine())
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def db(client):
+    """テスト用のDBセッション"""
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
@@ -0,0 +1,50 @@
+"""
+主要なページ・APIのクエリ数の上限テスト。
+アプリ数に比例してクエリが増える (N+1) 変更が入ったら、ここで失敗する。
+"""
+from server import crud, models
+from server.query_profiler import assert_max_queries
+
+# アプリ一覧API: カーソルの境界 + アプリ一覧
+APP_LIST_MAX_QUERIES = 2
+# マイページ: ユーザー + 所有アプリ一覧
+MYPAGE_MAX_QUERIES = 2
+
+
+def create_user_with_apps(db, username: str, app_count: int) -> models.User:
+    """アプリを app_count 個所有するユーザーを作成する (パスワードはユーザー名と同じ)"""
+    user = crud.create_user(db, models.UserCreate(email=f"{username}@example.com", username=username, password=username))
+    for i in range(app_count):
+        crud.create_app_for_user(db, {
+            "name": f"{username}-app-{i}",
+            "version": "1.0.0",
+            "description": "test",
+            "download_url": f"http://testserver/packages/{username}-{i}.zip",
+        }, user.id)
+    return user
+
+
+def login(client, user: models.User):
+    """ログインフォームからログインし、Cookieをクライアントに保存する"""
+    response = client.post("/login", data={"username": user.email, "password": user.username})
+    assert response.status_code == 200
+    assert "access_token" in client.cookies
+
+
+def test_app_list_queries(client, db):
+    create_user_with_apps(db, "lister", 20)
+
+    with assert_max_queries(APP_LIST_MAX_QUERIES):
+        response = client.get("/api/v1/apps/")
+    assert response.status_code == 200
+    assert len(response.json()) >= 20
+
+
+def test_mypage_queries(client, db):
+    user = create_user_with_apps(db, "owner", 20)
+    login(client, user)
+
+    with assert_max_queries(MYPAGE_MAX_QUERIES):
+        response = client.get("/mypage")
+    assert response.status_code == 200
+    assert "owner-app-19" in response.text